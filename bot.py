@@ -1,23 +1,49 @@
 """Discord bot
 
 Scraps events and posts them onto discord.
+
+For large guild counts the bot can run sharded over multiple processes:
+set `SHARD_COUNT` (number of gateway shards) and `SHARD_PROCESSES` (number of processes).
+`python bot.py` then spawns one bot process per shard group, and each process only handles the guilds of its own shards.
 """
 
+import time
+STARTUP_BEGIN = time.perf_counter()  # Startup is measured from here on (see `printStartupReport()`)
+
 # import asyncio
 import discord
 from discord.ext import commands
 from cogs.utils.utils import getJSTtime
+from cogs.utils import metrics
+from cogs.utils import watchdog
 import os
+import sys
+import subprocess
+
+# Durations of the startup phases (in seconds), e.g. {'imports': 0.4, 'cog:event_listener': 0.1, ...}
+STARTUP = {'imports': time.perf_counter() - STARTUP_BEGIN}
+
+# Sharding setup
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 0))  # Total number of gateway shards (0: not sharded)
+SHARD_PROCESSES = int(os.getenv("SHARD_PROCESSES", 1))  # Number of processes the shards are spread across
+SHARD_IDS = [int(i) for i in os.getenv("SHARD_IDS", '').split(',') if i.strip()] or None  # Shards of this process (set by the launcher)
 
 # Bot setup
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-bot = commands.Bot(command_prefix='.')
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(command_prefix='.', shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+else:
+    bot = commands.Bot(command_prefix='.')
 
 @bot.event
 async def on_ready():
     """Gets called when bot is ready. Change presence and other setup of the bot."""
     await bot.change_presence(status=discord.Status.idle, activity=discord.Activity(name='Internet', type=discord.ActivityType.listening))
-    print(f"[{getJSTtime()}] Hello peeps! {os.getenv('BOT_NAME','Matsubo')} is online ⚡")
+    shards = f" (shards {sorted(bot.shards)} of {bot.shard_count})" if SHARD_COUNT else ''
+    print(f"[{getJSTtime()}] Hello peeps! {os.getenv('BOT_NAME','Matsubo')} is online{shards} ⚡")
+    if 'connect' not in STARTUP:  # on_ready is also called after reconnects
+        STARTUP['connect'] = time.perf_counter() - STARTUP_BEGIN - sum(STARTUP.values())
+        printStartupReport()
 
 @bot.command()
 async def load(ctx, extension : str):
@@ -38,14 +64,15 @@ async def unload(ctx, extension : str):
 @bot.command()
 async def reload(ctx, extension : str):
     """Reloads bot cogs during execution"""
+    start = time.perf_counter()
     if extension.lower() == 'all':
         for cog in getAllCogs():
             if cog:
                 bot.reload_extension(f'cogs.{cog}')
-        string = f"Successfully reloaded all active bot-extensions.\nType `{bot.command_prefix}help` for an explanation of my abilities!"
+        string = f"Successfully reloaded all active bot-extensions in {time.perf_counter()-start:.2f}s.\nType `{bot.command_prefix}help` for an explanation of my abilities!"
     else:
         bot.reload_extension(f'cogs.{extension}')
-        string = f"Successfully reloaded bot-extension '{extension}'.\nType `{bot.command_prefix}help` for an explanation of my new abilities!"
+        string = f"Successfully reloaded bot-extension '{extension}' in {time.perf_counter()-start:.2f}s.\nType `{bot.command_prefix}help` for an explanation of my new abilities!"
     print(string)
     await ctx.send(string)
 
@@ -68,13 +95,53 @@ def loadCogs():
     # Load all cogs in the cogs/ folder
     for cog in getAllCogs():
         if cog:
+            start = time.perf_counter()
             bot.load_extension(f'cogs.{cog}')
+            STARTUP[f'cog:{cog}'] = time.perf_counter() - start
             print(f"Successfully loaded bot-extension '{cog}'")
     # Load other cogs
     bot.load_extension('dch')
     print(f"Successfully loaded bot-extension 'discord-custom-help'")
 
+def printStartupReport():
+    """Prints how long each phase of the startup took, and exports it as metric"""
+    string = "Startup report:"
+    for phase, duration in STARTUP.items():
+        string += f"\n  > {phase:<30} {duration:6.2f}s"
+        metrics.STARTUP_DURATION.set(duration, phase=phase)
+    string += f"\n  > {'total':<30} {sum(STARTUP.values()):6.2f}s"
+    print(string)
+
+def launchShards():
+    """Spawns one bot process per shard group and restarts them if they crash. Blocks forever."""
+    groups = [list(range(SHARD_COUNT))[i::SHARD_PROCESSES] for i in range(SHARD_PROCESSES)]
+    processes = {}
+    def spawn(i):
+        env = dict(os.environ, SHARD_IDS=','.join(map(str, groups[i])), SHARD_PROCESSES='1')
+        if metrics.METRICS_PORT:  # Every process serves its own metrics
+            env['METRICS_PORT'] = str(metrics.METRICS_PORT + i)
+        processes[i] = subprocess.Popen([sys.executable, __file__], env=env)
+        print(f"Started bot process {processes[i].pid} for shards {groups[i]} of {SHARD_COUNT}")
+    for i, group in enumerate(groups):
+        if group:
+            spawn(i)
+    try:
+        while True:
+            time.sleep(5)
+            for i, process in list(processes.items()):
+                if process.poll() is not None:
+                    print(f"Bot process {process.pid} for shards {groups[i]} exited with code {process.returncode}. Restarting...")
+                    spawn(i)
+    finally:
+        for process in processes.values():
+            process.terminate()
+
 if __name__ == "__main__":
-    loadCogs()
-    bot.run(BOT_TOKEN)
-    print('Running.')
+    if SHARD_COUNT and SHARD_PROCESSES > 1:
+        launchShards()
+    else:
+        loadCogs()
+        metrics.start(bot)
+        watchdog.start()
+        bot.run(BOT_TOKEN)
+        print('Running.')
@@ -8,17 +8,26 @@ import discord
 import asyncio
 import datetime
 import pytz
+import zlib
 import typing
 
 from discord.ext import commands, tasks
-from itertools import cycle
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from itertools import cycle, count
+from urllib.parse import quote
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.date import DateTrigger
 
 from .utils import utils
 from .utils import database as db
+from .utils import metrics
 from .utils.event import Event
-from .utils.event_scrapper import getEvents
+from .utils import event_scrapper
+from .utils import images
+from .utils import ics
+from .utils import snapshot
+from .utils import sources
+from .utils import state
+from .utils import jobs
 
 
 #########################
@@ -33,30 +42,28 @@ from .utils.event_scrapper import getEvents
 # Local timezone
 LOCAL_TZ = pytz.timezone('Asia/Tokyo')
 
-# Times when the web-scrapper should run
-SCRAP_TIMES = '0 15 * * *'  # Every day at 15:00
+# Times when the web-scrapper should run are defined per source (see utils/sources.py).
+# By default, all sources are scrapped every day at 15:00 (event_scrapper.SCRAP_TIMES).
 
-# Times when new events shall be posted to subscribed channels
+# If set, the web-scrapper runs as a separate worker process (`python -m cogs.utils.event_scrapper worker`).
+# The bot then does not scrap itself, but posts new or changed events whenever the worker publishes them.
+SCRAP_WORKER = os.getenv('SCRAP_WORKER', '').lower() in ['1', 'true', 'yes']
+LISTEN_DEBOUNCE = 5  # seconds to wait for more change notifications before posting
+
+# Times when new events shall be posted to subscribed channels. Channels can set their own times with `.schedule`.
 POST_TIMES = '0 20 * * 5-6'  # Every Saturday & Sunday at 20:00
+POST_WINDOW = 60  # minutes after the post times over which the channels are posted to, so the Discord API is not hit by all channels at once
 POST_BEFORE_WEEKS = 2  # how many weeks prior to the start of the event it is posted
 
 # Time when it shall be reminded of events happening today/tomorrow/...
-REMIND_TIMES = '0 9-10 * * *'  # Every day at 10:00
+# Every channel is reminded at the exact times its events are due (see `getReminderTime()`), not at fixed times.
 REMIND_BEFORE_DAYS = 0  # how many days before the reminder should be done
+REMIND_AT = datetime.time(9, 0)  # Reminders are posted at this time (channels can set their own with `.schedule`), ...
+REMIND_LEAD = datetime.timedelta(hours=3)  # ... or this long before the start time of an event, if that is later (e.g. for evening events)
 
-# Define (logo, thumbnail, footer) for all sources that are scrapped
-SCRAP_SOURCES = {
-    'Web:TokyoCheapo': {
-        'footer': 'TOKYO CHEAPO',
-        'icon': 'https://community.tokyocheapo.com/uploads/db1536/original/1X/91a0a0ee35d00aaa338a0415496d40f3a5cb298e.png',
-        'thumbnail': 'https://cdn.cheapoguides.com/wp-content/themes/cheapo_theme/assets/img/logos/tokyocheapo/logo.png'
-    },
-    'Web:JapanCheapo': {
-        'footer': 'JAPAN CHEAPO',
-        'icon': 'https://pbs.twimg.com/profile_images/1199468429553455104/GdCZbc-R_400x400.png',
-        'thumbnail': 'https://cdn.cheapoguides.com/wp-content/themes/cheapo_theme/assets/img/logos/japancheapo/logo.png'
-    }
-}
+# Posts and reminders of every channel are scheduled as one-shot jobs ahead of time
+PLAN_TIMES = '0 0 * * *'  # Times when they are scheduled (reminders are also scheduled after every scrap): Every day at 00:00
+PLAN_DAYS = 2  # For how many days they are scheduled ahead
 
 # Sleep status messages that will be iterated through
 SLEEP_STATUS = [f"Counting 🐑... {i} {'💤' if i%2 else ''}" for i in range(1, 10)]
@@ -64,37 +71,80 @@ SLEEP_STATUS = [f"Counting 🐑... {i} {'💤' if i%2 else ''}" for i in range(1
 # How many past messages are checked per channel for event searching
 SEARCH_DEPTH = 100
 
-# TODO Make this variable disappear, and instead make it depend on utils/event_scrapper.py
-# All possible topics to be subscribable
-TOPICS = ['Chubu', 'Chugoku', 'Hokkaido', 'Kansai', 'Kanto', 'Kyushu', 'Okinawa', 'Shikoku', 'Tohoku']
+# How long (in seconds) the pages of search results (`.events`) can be turned, and the reactions to turn them
+SEARCH_TIMEOUT = 120
+SEARCH_PREVIOUS, SEARCH_NEXT = '◀️', '▶️'
+
+# Discord rejects embeds with longer field values
+EMBED_FIELD_MAX_LENGTH = 1024
+
+# All possible topics to be subscribable: the regions of all sources that are scrapped (see utils/sources.py)
+TOPICS = sources.getRegions()
 
 
 #########################
 # Classes & Functions
 #########################
 
+def getReminderTime(event:Event, remind_at:datetime.time=REMIND_AT) -> datetime.datetime:
+    """Returns when to remind of an event: `REMIND_BEFORE_DAYS` before its start at `remind_at`, or `REMIND_LEAD` before its start time if that is later"""
+    day = event.date_start - datetime.timedelta(days=REMIND_BEFORE_DAYS)
+    remind_at = LOCAL_TZ.localize(datetime.datetime.combine(day, remind_at))
+    if event.time_start:
+        start = datetime.datetime.combine(event.date_start, event.time_start)
+        start = start.astimezone(LOCAL_TZ) if start.tzinfo else LOCAL_TZ.localize(start)
+        remind_at = max(remind_at, start - REMIND_LEAD)
+    return remind_at
+
+def getJitter(channel_id:int, slot:datetime.datetime, window:int) -> datetime.timedelta:
+    """Returns how long after a post time a channel is posted to: an offset within `window` minutes, different for every channel and post time.
+
+    The offset is derived from the channel and the time, so every process and restart schedules the same one.
+    """
+    if window <= 0:
+        return datetime.timedelta(0)
+    return datetime.timedelta(seconds=zlib.crc32(f"{channel_id}:{slot:%Y%m%dT%H%M}".encode('utf-8')) % (window*60))
+
 class EventListener(commands.Cog):
     """
     This cog gives the bot the ability to scrap for events in the web and post them in subscribed channels.
     """
     def __init__(self, bot:commands.Bot):
         self.bot = bot
-        self.scheduler = AsyncIOScheduler()
-        self.scheduler.start()
+        # The scheduler and the running scraps are shared with the instances of this cog before and after a reload
+        self.scheduler = state.getScheduler()
+        self.scrapping = state.get('event_listener.scrapping', set)  # Names of the sources that are being scrapped right now
+        self.job_ids = []
+        self.planned_job_ids = {}  # IDs of the scheduled posts and reminders, by (kind, channel ID)
+        self.post_queue = asyncio.PriorityQueue()  # Channels that are due to be posted to, by post time (see `loop_post_queue()`)
+        self.post_order = count()  # Keeps the order of channels with the same post time
 
         # Start scheduled tasks
-        self.scheduler.add_job(self.loop_scrap, CronTrigger.from_crontab(SCRAP_TIMES, timezone=LOCAL_TZ), id='scrap')
-        self.scheduler.add_job(self.loop_post, CronTrigger.from_crontab(POST_TIMES, timezone=LOCAL_TZ), id='post')
-        self.scheduler.add_job(self.loop_remind, CronTrigger.from_crontab(REMIND_TIMES, timezone=LOCAL_TZ), id='remind')
+        if not SCRAP_WORKER and utils.isPrimaryShard(self.bot):  # Only one bot process scraps
+            for source in sources.getSources():  # Every source is scrapped at its own times
+                self.addJob(self.loop_scrap, CronTrigger.from_crontab(source.refresh, timezone=LOCAL_TZ), args=[[source.name]], id=f'scrap:{source}')
+            self.addJob(self.loop_archive, CronTrigger.from_crontab(event_scrapper.ARCHIVE_TIMES, timezone=LOCAL_TZ), id='archive')
+        # Posts and reminders are scheduled by every process for its own channels, so scheduling is not exclusive (but every post and reminder is)
+        self.scheduler.add_job(self.loop_plan, CronTrigger.from_crontab(PLAN_TIMES, timezone=LOCAL_TZ), id='plan', replace_existing=True)
+        self.job_ids.append('plan')
 
         # Print next run times of scheduled tasks
         print('Next run time of scheduled tasks:')
-        print(f"  > {self.scheduler.get_job('scrap').func.__name__.upper()}:  {self.scheduler.get_job('scrap').next_run_time}")
-        print(f"  > {self.scheduler.get_job('post').func.__name__.upper()}:   {self.scheduler.get_job('post').next_run_time}")
-        print(f"  > {self.scheduler.get_job('remind').func.__name__.upper()}: {self.scheduler.get_job('remind').next_run_time}")
+        for job_id in self.job_ids:
+            job = self.scheduler.get_job(job_id)
+            if job:
+                print(f"  > {job.func.__name__.upper()}{' (catch up)' if job_id.endswith(':catchup') else ''}:  {job.next_run_time}")
+
+        # Load the snapshot of upcoming events, so posts and reminders don't need to query the database (see utils/snapshot.py)
+        current = snapshot.getSnapshot()
+        if current is not None:
+            print(f"Loaded snapshot of {len(current)} upcoming events from {current.path}")
 
         # Start other loops
         self.countingSheeps.start()
+        self.listen_task = self.bot.loop.create_task(self.loop_listen()) if SCRAP_WORKER else None
+        self.plan_task = self.bot.loop.create_task(self.loop_plan())
+        self.post_task = self.bot.loop.create_task(self.loop_post_queue())
 
 
     @tasks.loop(seconds=10)
@@ -103,6 +153,21 @@ class EventListener(commands.Cog):
         await self.bot.change_presence(status=discord.Status.idle, activity=discord.Game(next(self.status_cycle)))
     def cog_unload(self):
         self.countingSheeps.cancel()
+        if self.listen_task:
+            self.listen_task.cancel()
+        self.plan_task.cancel()
+        self.post_task.cancel()
+        while not self.post_queue.empty():  # Posts that are still queued fail, and are caught up by the next instance of this cog
+            self.post_queue.get_nowait()[-1].cancel()
+        for job_id in self.job_ids + [job_id for job_ids in self.planned_job_ids.values() for job_id in job_ids]:  # The scheduler keeps running, but must not call into this instance anymore
+            if self.scheduler.get_job(job_id):
+                self.scheduler.remove_job(job_id)
+    def addJob(self, func, trigger, id:str, lock_id:str=None, **kwargs):
+        """Schedules a job of this cog. It replaces the job of an earlier instance of this cog (before a reload), and is removed on unload.
+
+        Every slot of the job only runs once across all bot processes and restarts (see utils/jobs.py).
+        """
+        self.job_ids += jobs.addJob(self.scheduler, func, trigger, id=id, lock_id=lock_id, replace_existing=True, **kwargs)
     @countingSheeps.before_loop
     async def before_countingSheeps(self):
         await self.bot.wait_until_ready()
@@ -114,59 +179,281 @@ class EventListener(commands.Cog):
         pass
 
     @utils.log_call
-    async def loop_scrap(self):
-        """[Background task] Scraps web at specified times for new events."""
+    async def loop_scrap(self, source_names:list[str]):
+        """[Background task] Scraps the given sources at their specified times for new events."""
         await self.bot.wait_until_ready()
         self.countingSheeps.cancel() #TODO check if already cancelled
         await asyncio.sleep(1) #bugfix: wait before change_presence is called too fast!
-        await self.scrap()
+        await self.scrap(source_names)
         await asyncio.sleep(1) #bugfix: wait before change_presence is called too fast!
-        self.countingSheeps.start() #TODO check if already started
-        print(f"Next run time of LOOP_SCRAP():  {self.scheduler.get_job('scrap').next_run_time}")
+        if not self.countingSheeps.is_running():  # Sources are scrapped in parallel, another one might have restarted it already
+            self.countingSheeps.start()
+        await self.loop_plan()
+        for source_name in source_names:
+            print(f"Next run time of LOOP_SCRAP({source_name}):  {self.scheduler.get_job(f'scrap:{source_name}').next_run_time}")
 
     @utils.log_call
-    async def loop_post(self):
-        """[Background task] Notifies all subscribed channels of new events."""
+    async def loop_archive(self):
+        """[Background task] Archives events of past months, and prepares the database for events of the upcoming months."""
+        await self.bot.loop.run_in_executor(None, db.eventDB.archivePartitions)
+        print(f"Next run time of LOOP_ARCHIVE():  {self.scheduler.get_job('archive').next_run_time}")
+
+    @utils.log_call
+    async def loop_post(self, channel_id:int, due:datetime.datetime):
+        """[Background task] Notifies a channel of new events at its post time (see `getPostSlots()`).
+
+        Scheduled as one-shot job per channel and post time by `scheduleJobs()`.
+        The channel is queued, and returns once it has been posted to (see `loop_post_queue()`).
+        """
+        done = self.bot.loop.create_future()
+        await self.post_queue.put((due, next(self.post_order), channel_id, done))
+        await done
+
+    async def loop_post_queue(self):
+        """[Background task] Notifies the queued channels of new events, one after another. The channel whose post time is the earliest goes first.
+
+        Channels whose post times coincide (e.g. after a restart) are posted to in turn, so the Discord API is never hit by all of them at once.
+        """
         await self.bot.wait_until_ready()
-        self.countingSheeps.cancel() #TODO check if already cancelled
-        await asyncio.sleep(1) #bugfix: wait before change_presence is called too fast!
-        await self.notify()
-        await asyncio.sleep(1) #bugfix: wait before change_presence is called too fast!
-        self.countingSheeps.start() #TODO check if already started
-        print(f"Next run time of LOOP_POST():  {self.scheduler.get_job('post').next_run_time}")
-    
+        while True:
+            due, _, channel_id, done = await self.post_queue.get()
+            try:
+                channel = self.bot.get_channel(channel_id)
+                if channel is not None:  # Channel has been deleted in the meantime
+                    await self.notify([channel])
+                if not done.done():
+                    done.set_result(None)
+            except asyncio.CancelledError:
+                done.cancel()
+                raise
+            except Exception as e:
+                if not done.done():
+                    done.set_exception(e)
+
     @utils.log_call
-    async def loop_remind(self):
-        """[Background task] Reminds subscribed channels of when events are happening (today, tomorrow, ...).
-        
-        The global variable `REMIND_BEFORE_DAYS`` defines how many days prior to the start of the event the reminder will be issued.
+    async def loop_remind(self, channel_id:int, slot:datetime.datetime):
+        """[Background task] Reminds a channel of the events that are due at the given time (see `getReminderTime()`).
+
+        Scheduled as one-shot job per channel and time by `scheduleJobs()`.
         """
         await self.bot.wait_until_ready()
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:  # Channel has been deleted in the meantime
+            return
+        await self.remind([channel], slot=slot)
+
+    async def loop_plan(self, channel_ids:list[int]=None):
+        """[Background task] Schedules the posts and the reminders of the upcoming events of all channels (or the given ones) of this process.
+
+        Runs at startup, at `PLAN_TIMES`, and whenever events or settings may have changed (after scraps, published changes, `.subscribe`, `.schedule`...).
+        """
+        await self.bot.wait_until_ready()
+        try:
+            chvs, schedules = await self.bot.loop.run_in_executor(None, self.getChannelSettings, channel_ids)
+            chvs = [(channel_id, topics) for channel_id, topics in chvs if self.bot.get_channel(channel_id) is not None]
+            reminders = await self.bot.loop.run_in_executor(None, self.getReminderSlots, chvs, schedules)
+            posts = self.getPostSlots([channel_id for channel_id, _ in chvs], schedules)
+        except Exception as e:  # Posts and reminders that have been scheduled before stay as they are
+            utils.print_warning(f"Could not schedule posts and reminders: {e!r}")
+            return
+        for channel_id in channel_ids or []:  # Channels that have been unsubscribed
+            reminders.setdefault(channel_id, {})
+            posts.setdefault(channel_id, {})
+        self.scheduleJobs('remind', self.loop_remind, reminders)
+        self.scheduleJobs('post', self.loop_post, posts)
+    
+    async def loop_listen(self):
+        """[Background task] Posts events whenever the scrapper worker publishes new or changed events.
+
+        Notifications arriving within `LISTEN_DEBOUNCE` seconds are posted together.
+        If the connection to the database is lost, it reconnects.
+        """
+        await self.bot.wait_until_ready()
+        if db.DB_BACKEND != 'postgres' and snapshot.SNAPSHOT_PATH:
+            await self.loop_watch_snapshot()
+            return
+        if db.DB_BACKEND != 'postgres':
+            utils.print_warning(f"The {db.DB_BACKEND} database can't notify of changes: events published by the scrapper worker are only posted at the post times.")
+            return
+        while True:
+            listener = db.DBListener(db.DBEvent.CHANNEL)
+            received = asyncio.Queue()  # Holds lists of payloads, or the exception that broke the connection
+            fd = None
+            def on_readable():
+                try:
+                    received.put_nowait(listener.poll())
+                except Exception as e:
+                    self.bot.loop.remove_reader(fd)
+                    received.put_nowait(e)
+            async def get_ids() -> set[str]:
+                item = await received.get()
+                if isinstance(item, Exception):
+                    raise item
+                return db.DBEvent.parseChanges(item)
+            try:
+                listener.connect()
+                fd = listener.fileno()
+                self.bot.loop.add_reader(fd, on_readable)
+                print(f"Listening for events published by the scrapper worker on channel '{listener.channel}'")
+                while True:
+                    ids = await get_ids()
+                    await asyncio.sleep(LISTEN_DEBOUNCE)
+                    while not received.empty():
+                        ids |= await get_ids()
+                    if ids:
+                        await self.loop_post_changes(ids)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                utils.print_warning(f"Listening for published events failed: {e!r}. Reconnecting in 60s...")
+                await asyncio.sleep(60)
+            finally:
+                if fd is not None:
+                    self.bot.loop.remove_reader(fd)
+                listener.close()
+
+    async def loop_watch_snapshot(self):
+        """[Background task] Posts events that the scrapper worker has added or changed, by diffing the snapshots it writes after every scrap.
+
+        Used if the database can't notify the bot of changes. The snapshot is checked every `snapshot.SNAPSHOT_POLL` seconds.
+        """
+        print(f"Watching the event snapshot {snapshot.SNAPSHOT_PATH} for events published by the scrapper worker")
+        previous = snapshot.getSnapshot()
+        while True:
+            await asyncio.sleep(snapshot.SNAPSHOT_POLL)
+            current = snapshot.getSnapshot()
+            if current is None or current is previous:
+                continue
+            if previous is not None:
+                added, removed, changed = snapshot.diff(previous, current)
+                ids = set(key[0] for key in added + changed)
+                if ids:
+                    await self.loop_post_changes(ids)
+            previous = current
+
+    @utils.log_call
+    async def loop_post_changes(self, event_ids:set[str]):
+        """Notifies all subscribed channels of events that have been published by the scrapper worker."""
         self.countingSheeps.cancel() #TODO check if already cancelled
         await asyncio.sleep(1) #bugfix: wait before change_presence is called too fast!
-        await self.remind()
+        await self.notify(event_ids=event_ids)
         await asyncio.sleep(1) #bugfix: wait before change_presence is called too fast!
         self.countingSheeps.start() #TODO check if already started
-        print(f"Next run time of LOOP_REMIND():  {self.scheduler.get_job('remind').next_run_time}")
-    
-    async def scrap(self):
-        """Searches the web for new events, and puts them into the database"""
+        await self.loop_plan()
+
+    def getChannelSettings(self, channel_ids:list[int]=None) -> tuple[list[tuple[int,list[str]]],dict[int,tuple]]:
+        """Returns the subscribed channels (all, or those of the given ones) with their topics, and the schedules of all channels.
+
+        Queries the database: run it in the executor.
+        """
+        chvs = [(channel_id, topics) for channel_id, topics in db.discordDB.getAllChannelVisibility() if channel_ids is None or channel_id in channel_ids]
+        return chvs, db.discordDB.getAllSchedules()
+
+    def getSchedule(self, channel_id:int, schedules:dict[int,tuple]) -> tuple[str,int,datetime.time]:
+        """Returns (post_times, post_window, remind_at) of a channel, out of the schedules of all channels (see `getChannelSettings()`).
+
+        Settings the channel has not set are the defaults (`POST_TIMES`, `POST_WINDOW`, `REMIND_AT`).
+        """
+        post_times, post_window, remind_at = schedules.get(channel_id) or (None, None, None)
+        return post_times or POST_TIMES, POST_WINDOW if post_window is None else post_window, remind_at or REMIND_AT
+
+    def getReminderSlots(self, chvs:list[tuple[int,list[str]]], schedules:dict[int,tuple]) -> dict[int,dict[datetime.datetime,datetime.datetime]]:
+        """Returns the times when the given channels (ID, topics) are to be reminded of their events within the next `PLAN_DAYS`, by channel ID.
+
+        Times that have passed are left out, unless they have been missed by less than `jobs.JOB_MISFIRE_GRACE` (e.g. during a restart).
+        """
+        now = datetime.datetime.now(tz=LOCAL_TZ)
+        earliest = now - datetime.timedelta(seconds=jobs.JOB_MISFIRE_GRACE)
+        days = [(now + datetime.timedelta(days=REMIND_BEFORE_DAYS + i)).date() for i in range(PLAN_DAYS)]
+        slots = {}
+        for channel_id, topics in chvs:
+            remind_at = self.getSchedule(channel_id, schedules)[2]
+            events = [event for day in days for event in self.getEvents(topics, day, day) if event.status.lower() not in ['cancelled','canceled']]
+            slots[channel_id] = {slot: slot for slot in (getReminderTime(event, remind_at) for event in events) if slot >= earliest}
+        return slots
+
+    def getPostSlots(self, channel_ids:list[int], schedules:dict[int,tuple]) -> dict[int,dict[datetime.datetime,datetime.datetime]]:
+        """Returns the post times of the given channels within the next `PLAN_DAYS`, with the time each channel is posted to, by channel ID.
+
+        Channels are posted to at their post time plus an offset within their post window (see `getJitter()`), so their posts are spread over the window.
+        Times that have passed are left out, unless they have been missed by less than `jobs.JOB_MISFIRE_GRACE` (e.g. during a restart).
+        """
+        now = datetime.datetime.now(tz=LOCAL_TZ)
+        earliest = now - datetime.timedelta(seconds=jobs.JOB_MISFIRE_GRACE)
+        slots = {}
+        for channel_id in channel_ids:
+            post_times, window, _ = self.getSchedule(channel_id, schedules)
+            try:
+                trigger = CronTrigger.from_crontab(post_times, timezone=LOCAL_TZ)
+            except ValueError as e:
+                utils.print_warning(f"Channel {channel_id} has invalid post times '{post_times}' ({e}), using '{POST_TIMES}'")
+                trigger = CronTrigger.from_crontab(POST_TIMES, timezone=LOCAL_TZ)
+            slots[channel_id] = {}
+            slot = trigger.get_next_fire_time(None, earliest - datetime.timedelta(minutes=window))
+            while slot and slot < now + datetime.timedelta(days=PLAN_DAYS):
+                due = slot + getJitter(channel_id, slot, window)
+                if due >= earliest:
+                    slots[channel_id][slot] = due
+                slot = trigger.get_next_fire_time(slot, slot + datetime.timedelta(microseconds=1))
+        return slots
+
+    def scheduleJobs(self, name:str, func, slots:dict[int,dict[datetime.datetime,datetime.datetime]]):
+        """Schedules one-shot jobs `func(channel_id, time)` per channel and slot, e.g. reminders. Jobs of the channels that are not due anymore are removed.
+
+        `slots` holds the time every slot runs at (e.g. a post time plus its offset), by channel ID.
+        Every slot only runs once across all bot processes and restarts (see utils/jobs.py).
+        """
+        scheduled = 0
+        for channel_id, times in slots.items():
+            job_ids = []
+            for slot, time in sorted(times.items()):
+                job_id = f"{name}:{channel_id}:{slot:%Y%m%dT%H%M}"
+                job_ids += jobs.addJob(self.scheduler, func, DateTrigger(time), id=job_id, args=[channel_id, time], replace_existing=True)
+            for job_id in set(self.planned_job_ids.get((name, channel_id), [])) - set(job_ids):  # Events have been cancelled, moved or unsubscribed
+                if self.scheduler.get_job(job_id):
+                    self.scheduler.remove_job(job_id)
+            self.planned_job_ids[(name, channel_id)] = job_ids
+            scheduled += len(times)
+        print(f"Scheduled {scheduled} jobs '{name}' of {len(slots)} channels")
+
+    async def scrap(self, source_names:list[str]=None):
+        """Searches the web for new events, and puts them into the database
+
+        Parameters
+        ------------
+        source_names: Optional[:class:`list`[:class:`str`]]
+            The sources to be scrapped, ``None`` if all sources shall be scrapped.
+        """
+        # Skip sources that are still being scrapped, e.g. by a scrap started before the cog was reloaded
+        names = [source.name for source in sources.getSources(source_names) if source.name not in self.scrapping]
+        if not names:
+            print("All sources are already being scrapped.")
+            return
         await self.bot.change_presence(status=discord.Status.online, activity=discord.Game('Scrapping the web...'))
 
-        # Scrap events
+        # Scrap events and insert them into database. Runs in a thread, so the bot stays responsive.
         print("Scrapping events...")
-        events = getEvents()
-        # print("Found the following events:")
-        # for event in events:
-        #    print(event)
-
-        # Insert events into database
-        db.eventDB.insertEvents(events)
+        self.scrapping.update(names)
+        try:
+            await self.bot.loop.run_in_executor(None, event_scrapper.scrapEvents, names)
+        finally:
+            self.scrapping.difference_update(names)
 
         print("Finished scrapping events!")
         pass
     
-    async def notify(self, channels:list[commands.TextChannelConverter]=None):
+    def getEvents(self, visibility:list[str], from_date:datetime.date, until_date:datetime.date) -> list[Event]:
+        """Returns events of given visibility, in the given date duration (see `database.DBEvent.getEvents()`).
+
+        They are read from the latest event snapshot if it covers the dates (see utils/snapshot.py), otherwise from the database.
+        """
+        current = snapshot.getSnapshot()
+        if current is not None and current.covers(from_date):
+            return current.getEvents(visibility, from_date, until_date)
+        return db.eventDB.getEvents(visibility=visibility, from_date=from_date, until_date=until_date)
+
+    @metrics.NOTIFY_DURATION.timeit
+    async def notify(self, channels:list[commands.TextChannelConverter]=None, event_ids:set[str]=None):
         """Notifies given channels of new events.
 
         If no list of channels are given, it defaults to notifying every channel.
@@ -175,6 +462,8 @@ class EventListener(commands.Cog):
         ------------
         channels: Optional[:class:`list`[:class:`commands.TextChannelConverter`]]
             The channels to be notified, ``None`` if all channels shall be notified.
+        event_ids: Optional[:class:`set`[:class:`str`]]
+            Only these events are posted or updated, ``None`` if all events shall be considered.
         """
         await self.bot.change_presence(status=discord.Status.online, activity=discord.Game('Notifying channels...'))
 
@@ -189,15 +478,24 @@ class EventListener(commands.Cog):
         # Loop over every channel
         for chv in chvs:
             channel = self.bot.get_channel(chv[0])
+            if channel is None:  # Channel is handled by the bot process of another shard (or has been deleted)
+                continue
             topics = chv[1]
             #print(f"Channel-ID: {channel.id};  Topics: {topics}")
 
             # Obtain all events in database from today until 1 week of topics this channel has subscribed to
-            events = db.eventDB.getEvents(
+            # Events published by the scrapper worker may not be in the snapshot yet: they are read from the database
+            events = (self.getEvents if event_ids is None else db.eventDB.getEvents)(
                 visibility=topics,
                 from_date=datetime.datetime.now(tz=LOCAL_TZ).date(),
                 until_date=datetime.datetime.now(tz=LOCAL_TZ).date()+datetime.timedelta(weeks=POST_BEFORE_WEEKS)
             )
+            if event_ids is not None:
+                events = [event for event in events if event.id in event_ids]
+                if not events:
+                    continue
+            # Drop images that have been checked to be broken or too large (see utils/images.py)
+            events = await self.bot.loop.run_in_executor(None, images.dropBrokenImages, events)
 
             ################
             # Notify channel
@@ -227,7 +525,8 @@ class EventListener(commands.Cog):
         
         print("### Notified all channels!")
 
-    async def remind(self, channels:list[commands.TextChannelConverter]=None):
+    @metrics.REMIND_DURATION.timeit
+    async def remind(self, channels:list[commands.TextChannelConverter]=None, slot:datetime.datetime=None):
         """Reminds given channels of events that are happening soon.
         
         If no list of channels are given, it defaults to reminding every channel.
@@ -238,34 +537,36 @@ class EventListener(commands.Cog):
         ------------
         channels: Optional[:class:`list`[:class:`commands.TextChannelConverter`]]
             The channels to be notified, ``None`` if all channels shall be notified.
+        slot: Optional[:class:`datetime.datetime`]
+            Only events that are due at this time are reminded of (see `getReminderTime()`), ``None`` if all events of the day shall be reminded of.
         """
         await self.bot.change_presence(status=discord.Status.online, activity=discord.Game('Checking for reminders...'))
 
-        # Extract subscribed topics per channel from database
+        # Extract subscribed topics and schedule per channel from database
+        chvs, schedules = await self.bot.loop.run_in_executor(None, self.getChannelSettings, [channel.id for channel in channels] if channels else None)
         if channels:
-            chvs = [[channel.id, db.discordDB.getChannelVisibility(channel.id)] for channel in channels]
             print(f'### Reminding channels {channels} of current events')
         else:
-            chvs = db.discordDB.getAllChannelVisibility()
             print('### Reminding all channels of current events')
         
         # Loop over every channel
         for chv in chvs:
             channel = self.bot.get_channel(chv[0])
+            if channel is None:  # Channel is handled by the bot process of another shard (or has been deleted)
+                continue
             topics = chv[1]
             #print(f"Channel-ID: {channel.id};  Topics: {topics}")
 
             # Obtain all currently happening events in database of topics this channel has subscribed to
-            events = db.eventDB.getEvents(
+            events = self.getEvents(
                 visibility=topics,
                 from_date=(datetime.datetime.now(tz=LOCAL_TZ)+datetime.timedelta(days=REMIND_BEFORE_DAYS)).date(),
                 until_date=(datetime.datetime.now(tz=LOCAL_TZ)+datetime.timedelta(days=REMIND_BEFORE_DAYS)).date()
             )
             
-            # Remove events that are cancelled anyways -> no need to remind
-            for event in events:
-                if event.status.lower() in ['cancelled','canceled']:
-                    events.remove(event)
+            # Remove events that are cancelled anyways -> no need to remind. Of the others, only keep the ones due at this time.
+            remind_at = self.getSchedule(channel.id, schedules)[2]
+            events = [event for event in events if event.status.lower() not in ['cancelled','canceled'] and (slot is None or getReminderTime(event, remind_at) == slot)]
 
             if not events:
                 print(f"-> Channel #{channel}:{channel.id} has no currently happening events")
@@ -288,9 +589,9 @@ class EventListener(commands.Cog):
                 events_t.append((event,url))
             
             # Find today's reminder that has already been posted to Discord (if it even exists)
-            message = await self.findReminderMessage(channel, events)
+            message = await self.findReminderMessage(channel, events, slot, remind_at)
 
-            reminder = self.getReminder(events_t)
+            reminder = self.getReminder(events_t, slot, remind_at)
             if message:  # In case event information has changed, delete reminder and create a new one
                 if message.content != reminder:  # If reminders are different, then event information must have changed last minute!
                     # Delete reminder, then post new one
@@ -353,7 +654,7 @@ class EventListener(commands.Cog):
             idx.append(index)
         return messages, idx
 
-    async def findReminderMessage(self, channel: commands.TextChannelConverter, events: list[Event]) -> discord.Message:
+    async def findReminderMessage(self, channel: commands.TextChannelConverter, events: list[Event], slot:datetime.datetime=None, remind_at:datetime.time=REMIND_AT) -> discord.Message:
         """Finds today's reminder message of currently happening events.
 
         Note:
@@ -367,20 +668,28 @@ class EventListener(commands.Cog):
             The channel where to search for the reminder.
         events: :class:`list`[:class:`Event`]
             The events to check if they have all been mentioned in the reminder.
+        slot: Optional[:class:`datetime.datetime`]
+            The time of the reminder. A channel can have several reminders a day (see `getReminderTime()`).
+        remind_at: :class:`datetime.time`
+            The time of the daily reminder of the channel.
         """
-        today = datetime.datetime.now(tz=LOCAL_TZ).date()
-        header = f"***\*\*\*Reminder   [{utils.custom_strftime('%b {S} ({DAY}), %Y', today)}]\*\*\****"
+        header = self.getReminderHeader(slot, remind_at)
+        today = self.getReminderHeader().split(']')[0]  # Any reminder of today starts with this
         async for message in channel.history(limit=SEARCH_DEPTH):
-            if message.content.startswith('***\*\*\*Reminder'):
-                # This must be the lastest reminder message!
-                # Now check if it is from today.
-                if message.content.startswith(header):  # It is a reminder from today! Return the message
-                    return message
-                else:  # The reminder is old. So there exists no reminder from today yet
-                    return None
+            if message.content.startswith(header):  # It is this reminder from today! Return the message
+                return message
+            if message.content.startswith('***\*\*\*Reminder') and not message.content.startswith(today):
+                # The latest reminders are old. So there exists no reminder from today yet
+                return None
         return None  # No reminder message found
 
-    def getReminder(self, events_t:list[tuple[Event,str]]) -> str:
+    def getReminderHeader(self, slot:datetime.datetime=None, remind_at:datetime.time=REMIND_AT) -> str:
+        """Returns first line of today's reminder. Reminders at other times than the daily reminder (`remind_at`) have their time in the header."""
+        today = datetime.datetime.now(tz=LOCAL_TZ).date()
+        time = f" {slot:%H:%M}" if slot and slot.time() != remind_at else ''
+        return f"***\*\*\*Reminder   [{utils.custom_strftime('%b {S} ({DAY}), %Y', today)}{time}]\*\*\****"
+
+    def getReminder(self, events_t:list[tuple[Event,str]], slot:datetime.datetime=None, remind_at:datetime.time=REMIND_AT) -> str:
         """Creates reminder message and returns as string.
 
         Parameters
@@ -389,19 +698,23 @@ class EventListener(commands.Cog):
             List of tuples.
             First item of the tuple is the currently happening event,
             second item is the URL to the discord message.
+        slot: Optional[:class:`datetime.datetime`]
+            The time of the reminder (see `getReminderHeader()`).
+        remind_at: :class:`datetime.time`
+            The time of the daily reminder of the channel.
         """
-        today = datetime.datetime.now(tz=LOCAL_TZ).date()
-        string = f"***\*\*\*Reminder   [{utils.custom_strftime('%b {S} ({DAY}), %Y', today)}]\*\*\****"
+        string = self.getReminderHeader(slot, remind_at)
         string += f"\nThere are {len(events_t)} events starting { {0:'today',1:'tomorrow'}.get(REMIND_BEFORE_DAYS, f'in {REMIND_BEFORE_DAYS} days') }!"
         for event, url in events_t:
             if not url:
                 url = event.url  # Might still be an empty string, e.g. when emails do not have an url to the event
+            time = f"  {event.getTimeRange()}" if event.time_start else ''
             if url:
                 # string += f"\n   • [{event.name} [{event.id}]:  {event.getDateRange()}]({url})"
-                string += f"\n   • **{event.name} [{event.id}]:  {event.getDateRange()}**\n     *<{url}>*"
+                string += f"\n   • **{event.name} [{event.id}]:  {event.getDateRange()}{time}**\n     *<{url}>*"
             else:
                 # string += f"\n   • **{event.name} [{event.id}]:  {event.getDateRange()}**"
-                string += f"\n   • **{event.name} [{event.id}]:  {event.getDateRange()}**"
+                string += f"\n   • **{event.name} [{event.id}]:  {event.getDateRange()}{time}**"
         return string
 
     def getEmbed(self, event: Event) -> discord.Embed:
@@ -416,7 +729,7 @@ class EventListener(commands.Cog):
             title=event.name,
             colour=discord.Colour(0xd69d37),
             url=event.url,
-            description=f"```{event.description}```\nFind out more [here]({event.url}).",
+            description=f"```{event.details or event.description}```\nFind out more [here]({event.url}).",
             timestamp=event.date_added if event.date_added else datetime.datetime.now(tz=pytz.timezone('Asia/Tokyo'))
         )
 
@@ -432,12 +745,13 @@ class EventListener(commands.Cog):
         )
 
         # Set footer & thumbnail
-        if event.source in SCRAP_SOURCES.keys():
+        if event.source in sources.SOURCES.keys():
+            source = sources.SOURCES[event.source]
             embed.set_footer(
-                text=f"{SCRAP_SOURCES[event.source]['footer']} • {event.id}",
-                icon_url=SCRAP_SOURCES[event.source]['icon']
+                text=f"{source.footer} • {event.id}",
+                icon_url=source.icon
             )
-            embed.set_thumbnail(url=SCRAP_SOURCES[event.source]['thumbnail'])
+            embed.set_thumbnail(url=source.thumbnail)
         else:
             embed.set_footer(text=[event.source])
 
@@ -460,6 +774,16 @@ class EventListener(commands.Cog):
         if loc_string == '':
             loc_string = '---'
         embed.add_field(name='\u200B', value=f":round_pushpin: ***{loc_string}***", inline=True)
+        # Add field: Schedule & Address (only known if the event has been enriched with its detail page)
+        # Both are cut, so events scrapped before their length was limited (see `event_scrapper.enrichCheapoEvent()`) are still sent
+        if event.schedule:
+            embed.add_field(name='\u200B', value=utils.shorten(f":calendar_spiral: {event.schedule}", EMBED_FIELD_MAX_LENGTH), inline=False)
+        if event.address:
+            address = utils.shorten(event.address, event_scrapper.ADDRESS_MAX_LENGTH)
+            value = f":house: [{address}](https://www.google.com/maps/search/?api=1&query={quote(address)})"
+            if len(value) > EMBED_FIELD_MAX_LENGTH:  # Quoted Japanese characters take 9 characters each in the link
+                value = f":house: {address}"
+            embed.add_field(name='\u200B', value=value, inline=False)
         
         return embed
 
@@ -512,11 +836,100 @@ class EventListener(commands.Cog):
         await ctx.send(f"Scanning the web... this might take a while :coffee:")
         await self.scrap()
         await self.notify()
+        await self.loop_plan()
         await ctx.send(f"That's all I could find :innocent:")
 
         await asyncio.sleep(2) #bugfix: wait before change_presence is called too fast!
         self.countingSheeps.start()
 
+    def getPeriod(self, word:str) -> tuple[datetime.date,datetime.date]:
+        """Returns (from_date, until_date) of a period given by the user, ``None`` if the word is not a period.
+
+        Periods are 'today', 'tomorrow', 'week' (next 7 days), 'weekend', 'month' (this month), a month 'YYYY-MM', or a day 'YYYY-MM-DD'.
+        """
+        today = datetime.datetime.now(tz=LOCAL_TZ).date()
+        word = word.lower()
+        if word == 'today':
+            return today, today
+        if word == 'tomorrow':
+            return today + datetime.timedelta(days=1), today + datetime.timedelta(days=1)
+        if word == 'week':
+            return today, today + datetime.timedelta(days=6)
+        if word == 'weekend':
+            saturday = today + datetime.timedelta(days=(5 - today.weekday()) % 7) if today.weekday() != 6 else today - datetime.timedelta(days=1)
+            return max(saturday, today), saturday + datetime.timedelta(days=1)
+        if word == 'month':
+            return today, (today.replace(day=1) + datetime.timedelta(days=32)).replace(day=1) - datetime.timedelta(days=1)
+        try:
+            if len(word) == 7:
+                month = datetime.datetime.strptime(word, '%Y-%m').date()
+                return month, (month + datetime.timedelta(days=32)).replace(day=1) - datetime.timedelta(days=1)
+            day = datetime.datetime.strptime(word, '%Y-%m-%d').date()
+            return day, day
+        except ValueError:
+            return None
+
+    def getSearchEmbed(self, events:list[Event], page:int, query:str) -> discord.Embed:
+        """Returns discord.Embed object of a page of search results"""
+        embed = discord.Embed(
+            title=f"Events: {query}" if query else "Events",
+            colour=discord.Colour(0xd69d37),
+            description='\n\n'.join(f"**[{event.name}]({event.url})**\n:date: {event.getDateRange()}   :round_pushpin: {event.location or '---'}   [{', '.join(event.visibility)}]"
+                                     for event in events) or "I couldn't find any event :pensive:"
+        )
+        embed.set_footer(text=f"Page {page + 1}")
+        return embed
+
+    @commands.command(name='events')
+    @utils.log_call
+    async def cmd_events(self, ctx, *query):
+        """Searches events. Filter by region, period (today, tomorrow, week, weekend, month, YYYY-MM, YYYY-MM-DD) and keywords, e.g. `.events kanto weekend fireworks`."""
+        regions, period, keywords = [], None, []
+        for word in query:
+            if word.capitalize() in TOPICS:
+                regions.append(word.capitalize())
+            elif not period and self.getPeriod(word):
+                period = self.getPeriod(word)
+            else:
+                keywords.append(word)
+        from_date, until_date = period or (datetime.datetime.now(tz=LOCAL_TZ).date(), None)
+        search = lambda after: db.eventDB.searchEvents(' '.join(keywords) or None, regions, from_date, until_date, after=after, limit=db.eventDB.SEARCH_PAGE_SIZE + 1)
+
+        # Pages are fetched by key: the last event of a page is where the next page starts
+        loop = asyncio.get_running_loop()
+        cursors = [None]  # Key of every page that has been shown
+        page = 0
+        events = await loop.run_in_executor(None, search, cursors[page])
+        message = await ctx.send(embed=self.getSearchEmbed(events[:db.eventDB.SEARCH_PAGE_SIZE], page, ' '.join(query)))
+        if len(events) <= db.eventDB.SEARCH_PAGE_SIZE:
+            return
+        await message.add_reaction(SEARCH_PREVIOUS)
+        await message.add_reaction(SEARCH_NEXT)
+        check = lambda reaction, user: reaction.message.id == message.id and user == ctx.author and str(reaction.emoji) in [SEARCH_PREVIOUS, SEARCH_NEXT]
+        while True:
+            try:
+                reaction, user = await self.bot.wait_for('reaction_add', timeout=SEARCH_TIMEOUT, check=check)
+            except asyncio.TimeoutError:
+                break
+            try:
+                await message.remove_reaction(reaction, user)
+            except discord.Forbidden:
+                pass
+            if str(reaction.emoji) == SEARCH_NEXT and len(events) > db.eventDB.SEARCH_PAGE_SIZE:
+                last = events[db.eventDB.SEARCH_PAGE_SIZE - 1]
+                cursors[page + 1:] = [(last.date_start, last.id)]
+                page += 1
+            elif str(reaction.emoji) == SEARCH_PREVIOUS and page > 0:
+                page -= 1
+            else:
+                continue
+            events = await loop.run_in_executor(None, search, cursors[page])
+            await message.edit(embed=self.getSearchEmbed(events[:db.eventDB.SEARCH_PAGE_SIZE], page, ' '.join(query)))
+        try:
+            await message.clear_reactions()
+        except discord.Forbidden:
+            pass
+
     @commands.command(name='subscribe')
     @commands.has_permissions(administrator=True)
     @utils.log_call
@@ -530,6 +943,7 @@ class EventListener(commands.Cog):
             topics_all = topics | db.discordDB.getChannelVisibility(channel.id)
             db.discordDB.updateChannel(channel.id, list(topics_all))
             await ctx.send(f"Subscribed the following new topics for channel <#{channel.id}>: {topics}\nAll subscribed topics of this channel: {topics_all}")
+            await self.loop_plan([channel.id])
         else:
             await ctx.send(f"Either I don't know that topic, or you already subscribed to that topic!")
 
@@ -555,6 +969,52 @@ class EventListener(commands.Cog):
         else:
             db.discordDB.removeChannel(channel.id)
             await ctx.send(f"Unsubscribed channel <#{channel.id}> from all topics")
+        await self.loop_plan([channel.id])
+
+    @commands.command(name='schedule')
+    @commands.has_permissions(administrator=True)
+    @utils.log_call
+    async def cmd_schedule(self, ctx, channel:typing.Optional[commands.TextChannelConverter]=None, setting:str=None, *value):
+        """Shows or sets when events are posted to the channel the message was sent in, and when it is reminded of them.
+
+        `.schedule post 0 20 * * 5-6`: posts new events at these times (cron, Japan time)
+        `.schedule window 60`: spreads posts over this many minutes after the post time
+        `.schedule remind 09:00`: reminds of events at this time
+        `.schedule reset`: uses the defaults of the bot again
+        """
+        if not channel:
+            channel = ctx.channel
+        _, schedules = await self.bot.loop.run_in_executor(None, self.getChannelSettings, [channel.id])
+        if channel.id not in schedules:
+            await ctx.send(f"<#{channel.id}> has currently no subscribtions. Subscribe it first with `.subscribe`")
+            return
+        post_times, post_window, remind_at = schedules[channel.id]
+        value = ' '.join(value)
+        try:
+            if setting is None:
+                pass
+            elif setting.lower() == 'post':
+                CronTrigger.from_crontab(value, timezone=LOCAL_TZ)
+                post_times = value
+            elif setting.lower() == 'window':
+                post_window = int(value)
+                if post_window < 0:
+                    raise ValueError(f"window must not be negative")
+            elif setting.lower() == 'remind':
+                remind_at = datetime.time.fromisoformat(value)
+            elif setting.lower() == 'reset':
+                post_times, post_window, remind_at = None, None, None
+            else:
+                await ctx.send(f"I don't know of that setting... Use `post`, `window`, `remind` or `reset`")
+                return
+        except ValueError as e:
+            await ctx.send(f"That is not a valid value for `{setting}`: {e}")
+            return
+        if setting is not None:
+            await self.bot.loop.run_in_executor(None, db.discordDB.updateSchedule, channel.id, post_times, post_window, remind_at)
+            await self.loop_plan([channel.id])
+        post_times, post_window, remind_at = self.getSchedule(channel.id, {channel.id: (post_times, post_window, remind_at)})
+        await ctx.send(f"Schedule of <#{channel.id}>: new events are posted at `{post_times}` (within {post_window} minutes), reminders at {remind_at:%H:%M}")
 
     @commands.command(name='getsubscribedtopics')
     @utils.log_call
@@ -568,6 +1028,25 @@ class EventListener(commands.Cog):
         else:
             await ctx.send(f"<#{channel.id}> has currently no subscribtions")
     
+    @commands.command(name='calendar')
+    @utils.log_call
+    async def cmd_calendar(self, ctx, channel:commands.TextChannelConverter=None):
+        """Sends a calendar file (.ics) of all events of the topics this channel is subscribed to."""
+        if not channel:
+            channel = ctx.channel
+        topics = db.discordDB.getChannelVisibility(channel.id)
+        if not topics:
+            await ctx.send(f"<#{channel.id}> has currently no subscribtions, so there are no events for a calendar")
+            return
+        try:
+            path = await asyncio.get_running_loop().run_in_executor(None, ics.getCalendar, list(topics))
+        except Exception as e:
+            utils.print_warning(f"Could not write calendar of {sorted(topics)}: {e!r}")
+            await ctx.send("I couldn't put the calendar together right now :pensive: Please try again later.")
+            return
+        await ctx.send(f"All events of {sorted(topics)}. Import the file into your calendar app :calendar:",
+                       file=discord.File(path, filename=f"matsubo-{'-'.join(sorted(topics)).lower()}.ics"))
+
     @commands.command(name='gettopics')
     @utils.log_call
     async def cmd_getTopics(self, ctx):
@@ -576,8 +1055,9 @@ class EventListener(commands.Cog):
         await ctx.send(f"These are all topics that can be subscribed:\n{string}")
         
     @cmd_getSubscribedTopics.error
+    @cmd_calendar.error
     async def error_getSubscribedTopics(self, ctx, error):
-        """Error handler. Is invoked when channel given to cmd_getSubscribedTopics() is unknown."""
+        """Error handler. Is invoked when channel given to cmd_getSubscribedTopics() or cmd_calendar() is unknown."""
         if isinstance(error, commands.BadArgument):
             await ctx.send("I don't know of that channel... Did you mistype it?")
     
@@ -586,7 +1066,7 @@ class EventListener(commands.Cog):
     @utils.log_call
     async def cmd_recreateTable(self, ctx, *tables):
         """Recreates given tables."""
-        tables = set({'discord':db.discordDB, 'event':db.eventDB}.get(table, None) for table in tables)
+        tables = set({'discord':db.discordDB, 'event':db.eventDB, 'journal':db.journalDB, 'images':db.imageDB, 'jobs':db.jobDB}.get(table, None) for table in tables)
         tables.discard(None)
         if not tables:
             await ctx.send(f"... either I don't know this table, or I don't know any table by that name :thinking:\nPlease specify it more.")
@@ -600,6 +1080,5 @@ def setup(bot):
 
 
 # TODO:
-# - Implement command that returns which events are happening {currently; in given period; this month;  in this area; ...}
 # - Extend sources of event scrapping
 # - Add list of topics one can subscribe
@@ -10,6 +10,7 @@ Simple discord bot cog that defines basic commands on a server for a bot:
 import discord
 from discord.ext import commands
 from .utils.utils import *
+from .utils import watchdog
 import traceback
 
 class ServerCommands(commands.Cog):
@@ -57,6 +58,16 @@ class ServerCommands(commands.Cog):
         """Test command to check if bot has not frozen && discord API is still working"""
         await ctx.send(f'pong! [{round(self.bot.latency * 1000)}ms]')
 
+    @commands.command()
+    @commands.has_permissions(administrator=True)
+    async def blocking(self, ctx, amount : int = 5):
+        """Shows the calls that blocked the bot the longest (total time | longest stall | #stalls | call site)"""
+        if not watchdog.watchdog:
+            await ctx.send("The watchdog is not running, so I can't tell what blocked me :eyes:")
+            return
+        report = watchdog.watchdog.report(n=amount)
+        await ctx.send(f"```{report[:1990]}```")
+
     @commands.command()
     @commands.has_permissions(manage_messages=True)
     async def clear(self, ctx, amount : int):
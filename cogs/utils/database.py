@@ -1,18 +1,35 @@
 """Database wrapper
 
 Simple interface to save and load event data of a postgres database.
+
+The storage backend is selected by `DB_BACKEND`:
+- `postgres` (default): the classes of this module.
+- `sqlite`: an embedded database file at `SQLITE_PATH` (see `database_sqlite.py`), for single-node deployments, tests and benchmarks.
+Both backends offer the same tables (`eventDB`, `discordDB`, `journalDB`, `imageDB`, `jobDB`) with the same methods.
+
+Importing this module has no side effects: the tables are created on first access (see `openDatabase()`),
+and the database driver is only imported once a connection is made.
 """
 
 import os
+import re
 import sys
-import psycopg2
-import psycopg2.extras
+import json
+import uuid
+import hashlib
+import threading
+import functools
+import contextlib
 import datetime
+import pytz
 
 from .event import Event
 from . import utils
+from . import metrics
 
 # Setup database
+DB_BACKEND = os.getenv('DB_BACKEND', 'postgres').lower()
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'matsubo.db')
 if os.getenv('DATABASE_URL'):  # On Heroku, all fields are concatenated into one string
     DB_USER, DB_PW, DB_HOST, DB_PORT, DB_NAME = os.getenv('DATABASE_URL').replace(
         'postgres://','').translate(str.maketrans({':': ' ', '@': ' ', '/': ' '})).split()
@@ -22,9 +39,23 @@ else:  # Default
     DB_USER = os.getenv("DB_USER")
     DB_PW = os.getenv("DB_PW")
     DB_NAME = os.getenv("DB_NAME")
-print(f"DATABASE-INFO: HOST={DB_HOST},PORT={DB_PORT},USER={DB_USER},PW={'*'*len(DB_PW)},NAME={DB_NAME}")
+# Connections kept open per database. Threads wait for a free connection if all of them are in use.
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 8))
+# Time zone of every connection: dates and times are read and written in Japanese time
+DB_TIMEZONE = 'Asia/Tokyo'
+LOCAL_TZ = pytz.timezone(DB_TIMEZONE)
+# Rows fetched at once from server-side cursors, when large results are streamed (see `DBConnector.stream()`)
+DB_ITERSIZE = int(os.getenv('DB_ITERSIZE', 2000))
+# Events are partitioned by month of their start date. Partitions of months older than this are archived.
+EVENTS_RETENTION_MONTHS = int(os.getenv('EVENTS_RETENTION_MONTHS', 3))
+# Archived partitions are detached from the events table and kept as standalone tables, or dropped if set to 'drop'
+ARCHIVE_MODE = os.getenv('ARCHIVE_MODE', 'detach').lower()
 
 
+# Pools of open connections, shared by all connectors of the same database
+_pools = {}
+_pools_lock = threading.Lock()
+
 class DBConnector():
     """
     Class helper to connect with a database using psycopg2.
@@ -32,6 +63,10 @@ class DBConnector():
 
     with DBConnector() as conn:
         # do something
+
+    The same connector can be used by several threads (e.g. sources scrapped in parallel) at the same time.
+    Connections are taken from a pool of `DB_POOL_SIZE` open connections, so a `with` does not connect anew.
+    Every connection is set up once with the time zone `DB_TIMEZONE`, and keeps the statements prepared on it (see `execute()`).
     """
     def __init__(self,host=DB_HOST,port=DB_PORT,user=DB_USER,password=DB_PW,database=DB_NAME):
         self.host = host
@@ -39,110 +74,536 @@ class DBConnector():
         self.user = user
         self.password = password
         self.database = database
+        self._local = threading.local()
+    def _connections(self) -> list:
+        """Returns stack of (connection, cursor) opened by the current thread"""
+        if not hasattr(self._local, 'connections'):
+            self._local.connections = []
+        return self._local.connections
+    def _getParams(self) -> dict:
+        """Returns parameters of new connections: they are set up with the time zone `DB_TIMEZONE`"""
+        return dict(host=self.host,port=self.port,user=self.user,password=self.password,database=self.database,
+                    options=f"-c timezone={DB_TIMEZONE}", connection_factory=_getConnectionClass())
+    def connect(self):
+        """Returns a new connection to the database, outside of the pool"""
+        import psycopg2
+        return psycopg2.connect(**self._getParams())
+    def _getPool(self) -> tuple:
+        """Returns (pool, free slots) of the database of this connector"""
+        key = (self.host, self.port, self.user, self.database)
+        with _pools_lock:
+            if key not in _pools:
+                import psycopg2.pool
+                _pools[key] = (psycopg2.pool.ThreadedConnectionPool(0, DB_POOL_SIZE, **self._getParams()), threading.BoundedSemaphore(DB_POOL_SIZE))
+            return _pools[key]
     def __enter__(self):
-        self.conn = psycopg2.connect(host=self.host,port=self.port,user=self.user,password=self.password,database=self.database)
-        self.cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        return self.cur
+        import psycopg2.extras
+        pool, slots = self._getPool()
+        slots.acquire()  # The pool raises an error instead of waiting when all connections are in use
+        try:
+            conn = pool.getconn()
+        except Exception:
+            slots.release()
+            raise
+        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        self._connections().append((conn, cur))
+        metrics.DB_CONNECTIONS.inc()
+        return cur
     def __exit__(self, type, value, traceback):
-        self.conn.commit()
-        self.cur.close()
-        self.conn.close()
+        conn, cur = self._connections().pop()
+        metrics.DB_CONNECTIONS.dec()
+        pool, slots = self._getPool()
+        try:
+            cur.close()
+            if type is None:
+                conn.commit()
+            elif not conn.closed:
+                conn.rollback()
+                with conn.cursor() as c:  # Statements prepared in the failed transaction are prepared again on next use
+                    c.execute("DEALLOCATE ALL;")
+                conn.prepared.clear()
+        except Exception:
+            pool.putconn(conn, close=True)
+            raise
+        else:
+            pool.putconn(conn, close=bool(conn.closed))  # Broken connections are replaced by new ones
+        finally:
+            slots.release()
+    def execute(self, cur, query:str, data:tuple=()):
+        """Executes a query as prepared statement: it is parsed and planned once per pooled connection, and reused by every later call.
+
+        The query uses `%s` placeholders, like `cur.execute()`. Use it for the queries that are run most often.
+        """
+        name = f"q_{hashlib.md5(query.encode('utf-8')).hexdigest()[:16]}"
+        conn = cur.connection
+        if name not in conn.prepared:
+            params = iter(range(1, query.count('%s') + 1))
+            cur.execute(f"PREPARE {name} AS {re.sub('%s', lambda match: f'${next(params)}', query.rstrip(' ;'))};")
+            conn.prepared.add(name)
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(data))});" if data else f"EXECUTE {name};", data)
+    @contextlib.contextmanager
+    def stream(self, itersize:int=DB_ITERSIZE):
+        """Context manager. Returns a server-side (named) cursor, so rows of a query are fetched in batches of `itersize` while iterating over it, instead of all at once.
+
+        with connector.stream() as cur:
+            cur.execute(query)
+            for row in cur:
+                # do something
+
+        The cursor has a connection of its own (not on the stack of the thread), so it can be consumed lazily, e.g. by a generator
+        that is interleaved with other queries or closed in another thread. It is read-only: nothing is committed.
+        """
+        import psycopg2.extras
+        conn = self.connect()
+        metrics.DB_CONNECTIONS.inc()
+        try:
+            named = conn.cursor(name=f"stream_{uuid.uuid4().hex}", cursor_factory=psycopg2.extras.DictCursor)
+            named.itersize = itersize
+            try:
+                yield named
+            finally:
+                named.close()
+        finally:
+            metrics.DB_CONNECTIONS.dec()
+            conn.close()
+
+def _getConnectionClass():
+    """Returns class of the connections to the database. They remember which statements have been prepared on them (see `DBConnector.execute()`)."""
+    global _Connection
+    if '_Connection' not in globals():
+        import psycopg2.extensions
+        class _Connection(psycopg2.extensions.connection):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.prepared = set()
+    return _Connection
+
+class DBListener():
+    """
+    Class helper to receive notifications of a channel (postgres `LISTEN`/`NOTIFY`).
+
+    The connection is non-blocking: wait until `fileno()` is readable (e.g. with `loop.add_reader()`), then call `poll()`.
+    """
+    def __init__(self,channel,host=DB_HOST,port=DB_PORT,user=DB_USER,password=DB_PW,database=DB_NAME):
+        self.channel = channel
+        self.connector = DBConnector(host=host,port=port,user=user,password=password,database=database)
+        self.conn = None
+    def connect(self):
+        """Connects to the database and starts listening on the channel"""
+        import psycopg2.extensions
+        self.conn = self.connector.connect()
+        self.conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with self.conn.cursor() as cur:
+            cur.execute(f"LISTEN {self.channel};")
+    def fileno(self) -> int:
+        return self.conn.fileno()
+    def poll(self) -> list[str]:
+        """Returns payloads of all notifications received since the last call"""
+        self.conn.poll()
+        payloads = [notify.payload for notify in self.conn.notifies]
+        self.conn.notifies.clear()
+        return payloads
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
 
 class DBEvent():
     """
     Class helper for saving events into an event-database.
     """
     TABLE = "events"
-    def __init__(self,host=DB_HOST,port=DB_PORT,user=DB_USER,password=DB_PW,database=DB_NAME):
+    CHANNEL = "events_changed"  # Notification channel of new or changed events
+    ALIASES = "event_aliases"  # Listings of events that have been merged into another listing of the same event (see `dedupe.py`)
+    ARCHIVE = "events_archive"  # Archived events of the default partition (see `archivePartitions()`)
+    NOTIFY_PAYLOAD_SIZE = 7900  # Postgres limits payloads of notifications to 8000 bytes
+    INSERT_PAGE_SIZE = 100  # Rows per INSERT statement
+    PARTITIONS_AHEAD = 3  # Partitions of this many upcoming months are created ahead of time
+    # Columns in the order of `_toEvent()`. Queries name them instead of `SELECT *`, so prepared statements stay valid when columns are added.
+    COLUMNS = "id, name, description, url, img, date_start, date_end, date_fuzzy, time_start, time_end, location, cost, status, other, visibility, source, date_added, content_hash, details, address, schedule"
+    SEARCH_PAGE_SIZE = 10  # Events per page of search results
+    STREAM_ITERSIZE = DB_ITERSIZE  # Rows fetched at once by `iterEvents()`
+    # Full-text document of an event. Indexed as an expression, so queries must use exactly the same expression.
+    SEARCH_VECTOR = "to_tsvector('english', coalesce(name, '') || ' ' || coalesce(description, '') || ' ' || coalesce(location, ''))"
+    def __init__(self,host=DB_HOST,port=DB_PORT,user=DB_USER,password=DB_PW,database=DB_NAME,retention_months=EVENTS_RETENTION_MONTHS):
         self.connector = DBConnector(host=host,port=port,user=user,password=password,database=database)
+        self.retention_months = retention_months
+        self._partitions = set()  # Months whose partition is known to exist
+        self._partition_lock = threading.Lock()
     def __str__(self):
         return self.TABLE
     def createTable(self):
-        """Creates database if not present."""
-        with self.connector as cur:
-            cur.execute(f"""CREATE TABLE events (
-                    id VARCHAR NOT NULL,
-                    name VARCHAR NOT NULL,
-                    description TEXT,
-                    url VARCHAR,
-                    img VARCHAR,
-                    date_start DATE NOT NULL,
-                    date_end DATE,
-                    date_fuzzy VARCHAR,
-                    time_start TIME WITH TIME ZONE,
-                    time_end TIME WITH TIME ZONE,
-                    location VARCHAR,
-                    cost VARCHAR,
-                    status VARCHAR,
-                    other VARCHAR,
-                    visibility VARCHAR,
-                    source VARCHAR,
-                    date_added TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT current_timestamp,
-                    CONSTRAINT PK_event PRIMARY KEY (id, date_start)
-                );""") #BUG: current_timestamp will use timezone of PC, but it should use Japan timezone!
+        """Creates database if not present.
+
+        The table is partitioned by month of `date_start`, so queries of upcoming events only touch the partitions of the next months,
+        and past months can be archived as a whole (see `archivePartitions()`).
+        Partitions are created ahead of time, and on demand when events are inserted (see `ensurePartitions()`).
+        """
+        with self.connector as cur:
+            self._createTable(cur)
+            self._createAliasTable(cur)
+        self.createIndexes()
+        self.ensurePartitions(self._getUpcomingMonths())
+    def _createTable(self, cur):
+        cur.execute(f"""CREATE TABLE {self.TABLE} (
+                id VARCHAR NOT NULL,
+                name VARCHAR NOT NULL,
+                description TEXT,
+                url VARCHAR,
+                img VARCHAR,
+                date_start DATE NOT NULL,
+                date_end DATE,
+                date_fuzzy VARCHAR,
+                time_start TIME WITH TIME ZONE,
+                time_end TIME WITH TIME ZONE,
+                location VARCHAR,
+                cost VARCHAR,
+                status VARCHAR,
+                other VARCHAR,
+                visibility VARCHAR[],
+                source VARCHAR,
+                date_added TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT current_timestamp,
+                content_hash VARCHAR,
+                details TEXT,
+                address VARCHAR,
+                schedule VARCHAR,
+                date_updated TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT current_timestamp,
+                CONSTRAINT PK_event PRIMARY KEY (id, date_start)
+            ) PARTITION BY RANGE (date_start);""") #BUG: current_timestamp will use timezone of PC, but it should use Japan timezone!
+        # Events of archived months that are still listed on the web end up here, as partitions of these months are not created anymore
+        cur.execute(f"CREATE TABLE {self.TABLE}_default PARTITION OF {self.TABLE} DEFAULT;")
+        self._partitions.clear()
+    def _createAliasTable(self, cur):
+        """Creates the table of merged listings, if not present. Every listing of a merged event has a row, its canonical listing as well."""
+        cur.execute(f"""CREATE TABLE IF NOT EXISTS {self.ALIASES} (
+                id VARCHAR NOT NULL,
+                date_start DATE NOT NULL,
+                canonical_id VARCHAR NOT NULL,
+                content_hash VARCHAR,
+                visibility VARCHAR[],
+                CONSTRAINT PK_event_alias PRIMARY KEY (id, date_start)
+            );""")
+    def migrateTable(self):
+        """Adds columns that were introduced after the table has been created, and partitions the table if it is not partitioned yet."""
+        with self.connector as cur:
+            cur.execute(f"""ALTER TABLE {self.TABLE} ADD COLUMN IF NOT EXISTS content_hash VARCHAR,
+                ADD COLUMN IF NOT EXISTS details TEXT, ADD COLUMN IF NOT EXISTS address VARCHAR, ADD COLUMN IF NOT EXISTS schedule VARCHAR,
+                ADD COLUMN IF NOT EXISTS date_updated TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT current_timestamp;""")
+            cur.execute("SELECT data_type FROM information_schema.columns WHERE table_name = %s AND column_name = 'visibility';", (self.TABLE,))
+            ret = cur.fetchone()
+            if ret and ret[0] != 'ARRAY':  # Visibility was a single region, or several joined by ', '
+                cur.execute(f"ALTER TABLE {self.TABLE} ALTER COLUMN visibility TYPE VARCHAR[] USING string_to_array(visibility, ', ');")
+            cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s);", (self.TABLE,))
+            ret = cur.fetchone()
+            if ret and ret[0] != 'p':  # Table was created before it was partitioned: Move all events into a new, partitioned table
+                old = f"{self.TABLE}_unpartitioned"
+                cur.execute(f"ALTER TABLE {self.TABLE} RENAME TO {old}; ALTER TABLE {old} RENAME CONSTRAINT PK_event TO PK_event_unpartitioned;")
+                self._createTable(cur)
+                cur.execute(f"SELECT DISTINCT date_trunc('month', date_start)::date FROM {old};")
+                for (month,) in cur.fetchall():
+                    self._createPartition(cur, month)
+                cur.execute(f"INSERT INTO {self.TABLE} SELECT * FROM {old}; DROP TABLE {old};")
+            self._createAliasTable(cur)
+        self.createIndexes()
+        self.ensurePartitions(self._getUpcomingMonths())
+    def createIndexes(self):
+        """Creates the indexes used by `getEvents()` and `searchEvents()`, if not present. Indexes of the table are inherited by all its partitions.
+
+        Topics are looked up in a GIN index of the visibility array (`visibility && topics`).
+
+        Keywords are looked up in a full-text index of name, description and location, and parts of words in trigram indexes of name and location.
+        The trigram indexes need the extension `pg_trgm`. If it can't be created (missing privileges), searches still work, just slower.
+        """
+        import psycopg2
+        with self.connector as cur:
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {self.TABLE}_search ON {self.TABLE} USING GIN ({self.SEARCH_VECTOR});")
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {self.TABLE}_date_start ON {self.TABLE} (date_start, id);")
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {self.TABLE}_visibility ON {self.TABLE} USING GIN (visibility);")
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {self.TABLE}_date_updated ON {self.TABLE} (date_updated);")
+        try:
+            with self.connector as cur:
+                cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+                cur.execute(f"CREATE INDEX IF NOT EXISTS {self.TABLE}_name_trgm ON {self.TABLE} USING GIN (name gin_trgm_ops);")
+                cur.execute(f"CREATE INDEX IF NOT EXISTS {self.TABLE}_location_trgm ON {self.TABLE} USING GIN (location gin_trgm_ops);")
+        except psycopg2.Error as e:
+            utils.print_warning(f"Could not create trigram indexes of table {self.TABLE}: {e!r}")
+    def getPartitionName(self, month:datetime.date) -> str:
+        """Returns name of the partition of the month of the given date"""
+        return f"{self.TABLE}_p{month.year:04d}{month.month:02d}"
+    def _createPartition(self, cur, month:datetime.date):
+        month = month.replace(day=1)
+        next_month = (month + datetime.timedelta(days=32)).replace(day=1)
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {self.getPartitionName(month)} PARTITION OF {self.TABLE} FOR VALUES FROM (%s) TO (%s);", (month, next_month))
+        self._partitions.add(month)
+    def _getUpcomingMonths(self) -> list[datetime.date]:
+        """Returns the first day of this month and of the next `PARTITIONS_AHEAD` months"""
+        month = datetime.datetime.now(tz=LOCAL_TZ).date().replace(day=1)
+        months = [month]
+        for _ in range(self.PARTITIONS_AHEAD):
+            month = (month + datetime.timedelta(days=32)).replace(day=1)
+            months.append(month)
+        return months
+    def getRetentionCutoff(self) -> datetime.date:
+        """Returns the first day of the oldest month that is not archived"""
+        month = datetime.datetime.now(tz=LOCAL_TZ).date().replace(day=1)
+        for _ in range(self.retention_months):
+            month = (month - datetime.timedelta(days=1)).replace(day=1)
+        return month
+    def ensurePartitions(self, dates:list[datetime.date]):
+        """Creates the partitions of the months of the given dates, if not present. Months before the retention cutoff are skipped."""
+        import psycopg2.errors
+        cutoff = self.getRetentionCutoff()
+        months = set(date.replace(day=1) for date in dates if date) - self._partitions
+        with self._partition_lock:
+            for month in sorted(months):
+                if month < cutoff or month in self._partitions:
+                    continue
+                try:
+                    with self.connector as cur:
+                        self._createPartition(cur, month)
+                except (psycopg2.errors.DuplicateTable, psycopg2.errors.UniqueViolation):
+                    self._partitions.add(month)  # Created by another process in the meantime
+    def archivePartitions(self, mode:str=ARCHIVE_MODE) -> list[str]:
+        """Archives the partitions of months before the retention cutoff, and creates the partitions of the upcoming months. Returns names of the archived partitions.
+
+        If `mode` is 'detach', archived partitions are kept as standalone tables. If it is 'drop', they are deleted.
+        Events of the default partition that start before the cutoff (e.g. of months whose partition had already been archived) are moved into the table `ARCHIVE`,
+        or deleted as well.
+        """
+        self.ensurePartitions(self._getUpcomingMonths())
+        cutoff = self.getRetentionCutoff()
+        with self.connector as cur:
+            cur.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(%s);", (self.TABLE,))
+            names = sorted(ret[0] for ret in cur.fetchall())
+        archived = []
+        for name in names:
+            match = re.fullmatch(rf"{self.TABLE}_p(\d{{4}})(\d{{2}})", name)
+            if not match:
+                continue  # Default partition
+            month = datetime.date(int(match[1]), int(match[2]), 1)
+            if month >= cutoff:
+                continue
+            with self.connector as cur:
+                cur.execute(f"ALTER TABLE {self.TABLE} DETACH PARTITION {name};")
+                if mode == 'drop':
+                    cur.execute(f"DROP TABLE {name};")
+            self._partitions.discard(month)
+            archived.append(name)
+        with self.connector as cur:
+            if mode == 'drop':
+                cur.execute(f"DELETE FROM {self.TABLE}_default WHERE date_start < %s;", (cutoff,))
+            else:
+                cur.execute(f"CREATE TABLE IF NOT EXISTS {self.ARCHIVE} (LIKE {self.TABLE});")
+                cur.execute(f"""WITH moved AS (DELETE FROM {self.TABLE}_default WHERE date_start < %s RETURNING {self.COLUMNS}, date_updated)
+                    INSERT INTO {self.ARCHIVE} ({self.COLUMNS}, date_updated) SELECT * FROM moved;""", (cutoff,))
+            if cur.rowcount > 0:
+                archived.append(f"{self.TABLE}_default")
+            cur.execute(f"DELETE FROM {self.ALIASES} WHERE date_start < %s;", (cutoff,))
+        if archived:
+            print(f"[INFO] archived ({mode}) partitions of table {self.TABLE}: {archived}")
+        return archived
     def printTable(self):
-        """Print all records in database"""
+        """Print all records in database. Rows are streamed, so the table is never loaded into memory as a whole."""
+        with self.connector.stream(self.STREAM_ITERSIZE) as cur:
+            cur.execute(f"SELECT * FROM {self.TABLE};")
+            for ret in cur:
+                print(tuple(ret))
+    def getEvents(self, visibility:list[str]=None, from_date:datetime.datetime.date=None, until_date:datetime.datetime.date=None, stream:bool=False) -> list[Event]:
+        """Return events of given visibility, in the given date duration.
+
+        If `stream` is set, returns an iterator that yields the events lazily from a server-side cursor instead of a list (see `iterEvents()`).
+        """
+        if stream:
+            return self.iterEvents(visibility, from_date, until_date)
+        query, data = self._getEventsQuery(bool(visibility), bool(from_date), bool(until_date)), self._getEventsData(visibility, from_date, until_date)
         with self.connector as cur:
-            cur.execute(f"SELECT * FROM events;")
-            print(cur.fetchall())
-    def getEvents(self, visibility:list[str]=None, from_date:datetime.datetime.date=None, until_date:datetime.datetime.date=None) -> list[Event]:
-        """Return events of given visibility, in the given date duration"""
-        with self.connector as cur:
-            # Construct query and data based on arguments given
-            query = f"set time zone 'Asia/Tokyo'; SELECT * FROM {self.TABLE} WHERE "
-            data = ()
-            if visibility:
-                query += f"(visibility = ANY(%s)) AND "
-                data += (visibility,)
-            if from_date:
-                query += f"date_start >= %s AND "
-                data += (from_date,)
-            if until_date:
-                query += f"date_end <= %s AND "
-                data += (until_date,)
-            query = query.rstrip(' AND ').rstrip(' WHERE ')
-            query += f";"
-            # Execute query
+            self.connector.execute(cur, query, data)
+            return [self._toEvent(ret) for ret in cur]
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _getEventsQuery(visibility:bool, from_date:bool, until_date:bool) -> str:
+        """Returns query of `getEvents()` with the given filters. Every shape of the query is built once, for all instances."""
+        conditions = []
+        if visibility:
+            conditions.append("visibility && %s::varchar[]")
+        if from_date:
+            conditions.append("date_start >= %s")
+        if until_date:
+            conditions.append("date_start <= %s AND date_end <= %s")  # Condition on date_start lets postgres skip partitions of later months
+        return f"SELECT {DBEvent.COLUMNS} FROM {DBEvent.TABLE}" + (f" WHERE {' AND '.join(conditions)}" if conditions else '') + " ORDER BY date_start, id;"
+    @staticmethod
+    def _getEventsData(visibility:list[str]=None, from_date:datetime.date=None, until_date:datetime.date=None) -> tuple:
+        """Returns parameters of the query of `getEvents()`"""
+        return ((list(visibility),) if visibility else ()) + ((from_date,) if from_date else ()) + ((until_date, until_date) if until_date else ())
+    def iterEvents(self, visibility:list[str]=None, from_date:datetime.date=None, until_date:datetime.date=None, itersize:int=STREAM_ITERSIZE):
+        """Yields events of given visibility, in the given date duration, ordered by (date_start, id).
+
+        Rows are streamed from a server-side cursor in batches of `itersize`, so memory stays constant whatever the number of events.
+        """
+        query, data = self._getEventsQuery(bool(visibility), bool(from_date), bool(until_date)), self._getEventsData(visibility, from_date, until_date)
+        with self.connector.stream(itersize) as cur:
             cur.execute(query, data)
-            # Construct Event objects and return them as a list
-            events = []
             for ret in cur:
-                event = Event(id=ret[0], name=ret[1], description=ret[2], url=ret[3], img=ret[4], date_start=ret[5], date_end=ret[6],
-                                date_fuzzy=ret[7], time_start=ret[8], time_end=ret[9], location=ret[10], cost=ret[11], status=ret[12],
-                                other=ret[13], visibility=ret[14], source=ret[15], date_added=ret[16])
-                events.append(event)
-            return events
-    def insertEvents(self, events):
-        """Inserts events into database"""
-        with self.connector as cur:
-            query = f"""set time zone 'Asia/Tokyo'; INSERT INTO events (id, name, description, url, img, date_start, date_end, date_fuzzy, time_start, time_end, location, cost, status, other, visibility, source) VALUES """
-            for event in events:
-                id = event.id
-                name = event.name
-                description = event.description.replace("'","''")
-                url = event.url
-                img = event.img
-                date_start = event.date_start if event.date_start else 'NULL'
-                date_end = event.date_end if event.date_end else 'NULL'
-                date_fuzzy = event.date_fuzzy if event.date_fuzzy else 'NULL'
-                time_start = event.time_start if event.time_start else 'NULL'
-                time_end = event.time_end if event.time_end else 'NULL'
-                location = event.location
-                cost = event.cost
-                status = event.status
-                other = event.other if event.other else 'NULL'
-                visibility = event.visibility
-                source = event.source
-                query += f"('{id}', '{name}', '{description}', '{url}', '{img}', '{date_start}', '{date_end}', '{date_fuzzy}', '{time_start}', '{time_end}', '{location}', '{cost}', '{status}', '{other}', '{visibility}', '{source}'),"
-            query = query.strip(',') + ' ON CONFLICT ON CONSTRAINT PK_event DO UPDATE SET name=EXCLUDED.name, description=EXCLUDED.description, url=EXCLUDED.url, img=EXCLUDED.img, date_end=EXCLUDED.date_end, date_fuzzy=EXCLUDED.date_fuzzy, time_start=EXCLUDED.time_start, time_end=EXCLUDED.time_end, location=EXCLUDED.location, cost=EXCLUDED.cost, status=EXCLUDED.status, other=EXCLUDED.other, visibility=EXCLUDED.visibility, source=EXCLUDED.source;'
-            query = query.replace("'NULL'", "NULL")
-            cur.execute(query)
+                yield self._toEvent(ret)
+    def searchEvents(self, keywords:str=None, visibility:list[str]=None, from_date:datetime.date=None, until_date:datetime.date=None,
+                     after:tuple[datetime.date,str]=None, limit:int=SEARCH_PAGE_SIZE) -> list[Event]:
+        """Returns events that match the keywords, of given visibility, happening in the given date duration. At most `limit` events, ordered by (date_start, id).
+
+        Keywords are matched as words (e.g. 'fireworks', '"flea market"', 'beer -craft') in name, description and location, or as parts of the name or location.
+        Results are paginated by key: pass (date_start, id) of the last event of a page as `after` to get the next page.
+        """
+        conditions = []
+        data = ()
+        if keywords:
+            pattern = '%' + re.sub(r'([\\%_])', r'\\\1', keywords) + '%'
+            conditions.append(f"({self.SEARCH_VECTOR} @@ websearch_to_tsquery('english', %s) OR name ILIKE %s OR location ILIKE %s)")
+            data += (keywords, pattern, pattern)
+        if visibility:
+            conditions.append("visibility && %s::varchar[]")
+            data += (list(visibility),)
+        if from_date:
+            conditions.append("date_end >= %s")
+            data += (from_date,)
+        if until_date:
+            conditions.append("date_start <= %s")  # Lets postgres skip partitions of later months
+            data += (until_date,)
+        if after:
+            conditions.append("(date_start, id) > (%s, %s)")
+            data += tuple(after)
+        query = f"SELECT {self.COLUMNS} FROM {self.TABLE}" + (f" WHERE {' AND '.join(conditions)}" if conditions else '') + " ORDER BY date_start, id LIMIT %s;"
+        with self.connector as cur:
+            cur.execute(query, data + (limit,))
+            return [self._toEvent(ret) for ret in cur]
+    @staticmethod
+    def _toEvent(ret) -> Event:
+        """Returns the event of a row of the table"""
+        return Event(id=ret[0], name=ret[1], description=ret[2], url=ret[3], img=ret[4], date_start=ret[5], date_end=ret[6],
+                     date_fuzzy=ret[7], time_start=ret[8], time_end=ret[9], location=ret[10], cost=ret[11], status=ret[12],
+                     other=ret[13], visibility=ret[14], source=ret[15], date_added=ret[16],
+                     details=ret[18] or '', address=ret[19] or '', schedule=ret[20] or '')
+    def insertEvents(self, events) -> list[str]:
+        """Inserts (upserts) events into database. Returns IDs of the events that were new or have changed.
+
+        Events must be unique by (id, date_start). Large lists are sent in pages of `INSERT_PAGE_SIZE` rows.
+        Details of events that have not been enriched (see `event_scrapper.enrichPages()`) do not overwrite details already in the database.
+        Stale content hashes of unchanged events are updated as well, but these events are not returned (and their `date_updated` is kept, see `getVersion()`).
+        """
+        if not events:
+            return []
+        rows = [(event.id, event.name, event.description, event.url, event.img,
+                 event.date_start or None, event.date_end or None, event.date_fuzzy or None,
+                 event.time_start or None, event.time_end or None, event.location, event.cost, event.status,
+                 event.other or None, event.visibility, event.source, event.getHash(),
+                 event.details or None, event.address or None, event.schedule or None) for event in events]
+        import psycopg2.extras
+        self.ensurePartitions([event.date_start for event in events])
+        with self.connector as cur:
+            query = f"""INSERT INTO {self.TABLE} (id, name, description, url, img, date_start, date_end, date_fuzzy, time_start, time_end, location, cost, status, other, visibility, source, content_hash, details, address, schedule) VALUES %s
+                ON CONFLICT ON CONSTRAINT PK_event DO UPDATE SET content_hash=EXCLUDED.content_hash, name=EXCLUDED.name, description=EXCLUDED.description, url=EXCLUDED.url, img=EXCLUDED.img, date_end=EXCLUDED.date_end, date_fuzzy=EXCLUDED.date_fuzzy, time_start=EXCLUDED.time_start, time_end=EXCLUDED.time_end, location=EXCLUDED.location, cost=EXCLUDED.cost, status=EXCLUDED.status, other=EXCLUDED.other, visibility=EXCLUDED.visibility, source=EXCLUDED.source,
+                    details=COALESCE(EXCLUDED.details, {self.TABLE}.details), address=COALESCE(EXCLUDED.address, {self.TABLE}.address), schedule=COALESCE(EXCLUDED.schedule, {self.TABLE}.schedule), date_updated=current_timestamp
+                WHERE ({self.TABLE}.name, {self.TABLE}.description, {self.TABLE}.url, {self.TABLE}.img, {self.TABLE}.date_end, {self.TABLE}.date_fuzzy, {self.TABLE}.time_start, {self.TABLE}.time_end, {self.TABLE}.location, {self.TABLE}.cost, {self.TABLE}.status, {self.TABLE}.other, {self.TABLE}.visibility, {self.TABLE}.source, {self.TABLE}.details, {self.TABLE}.address, {self.TABLE}.schedule)
+                IS DISTINCT FROM (EXCLUDED.name, EXCLUDED.description, EXCLUDED.url, EXCLUDED.img, EXCLUDED.date_end, EXCLUDED.date_fuzzy, EXCLUDED.time_start, EXCLUDED.time_end, EXCLUDED.location, EXCLUDED.cost, EXCLUDED.status, EXCLUDED.other, EXCLUDED.visibility, EXCLUDED.source,
+                    COALESCE(EXCLUDED.details, {self.TABLE}.details), COALESCE(EXCLUDED.address, {self.TABLE}.address), COALESCE(EXCLUDED.schedule, {self.TABLE}.schedule))
+                RETURNING id;"""  # Only rows whose content has changed are touched, so the returned IDs are exactly the new or changed events
+            changed = [ret[0] for ret in psycopg2.extras.execute_values(cur, query, rows, page_size=self.INSERT_PAGE_SIZE, fetch=True)]
+            # Rows whose content is the same, but whose hash is not (not hashed yet, or hashed by an older `Event.getHash()`): fix the hash, without counting them as changed
+            psycopg2.extras.execute_values(cur, f"""UPDATE {self.TABLE} AS e SET content_hash = v.content_hash FROM (VALUES %s) AS v (id, date_start, content_hash)
+                WHERE e.id = v.id AND e.date_start = v.date_start::date AND e.content_hash IS DISTINCT FROM v.content_hash;""",
+                [(event.id, event.date_start, event.getHash()) for event in events if event.date_start], page_size=self.INSERT_PAGE_SIZE)
+        metrics.EVENTS_INGESTED.inc(len(events))
+        metrics.EVENTS_CHANGED.inc(len(changed))
+        return changed
+    def getHashes(self, events:list[Event]) -> dict[tuple[str,datetime.date],str]:
+        """Returns the content hashes stored in the database of the given events, by (id, date_start). Unknown events are left out.
+
+        Listings that have been merged into another listing (see `ALIASES`) are known as long as the event they have been merged into is.
+        """
+        if not events:
+            return {}
+        ids, dates = list(set(event.id for event in events)), list(set(event.date_start for event in events if event.date_start))
+        with self.connector as cur:
+            self.connector.execute(cur, f"""SELECT id, date_start, content_hash FROM {self.TABLE} WHERE id = ANY(%s) AND date_start = ANY(%s)
+                UNION ALL SELECT a.id, a.date_start, a.content_hash FROM {self.ALIASES} a JOIN {self.TABLE} e ON e.id = a.canonical_id AND e.date_start = a.date_start
+                WHERE a.id = ANY(%s) AND a.date_start = ANY(%s);""", (ids, dates, ids, dates))
+            return {(ret[0], ret[1]): ret[2] for ret in cur.fetchall()}
+    def getEventsOn(self, dates:list[datetime.date]) -> list[Event]:
+        """Returns all events that start on one of the given dates"""
+        dates = list(set(date for date in dates if date))
+        if not dates:
+            return []
+        with self.connector as cur:
+            self.connector.execute(cur, f"SELECT {self.COLUMNS} FROM {self.TABLE} WHERE date_start = ANY(%s::date[]);", (dates,))
+            return [self._toEvent(ret) for ret in cur]
+    def getAliasesOn(self, dates:list[datetime.date]) -> dict[tuple[str,datetime.date],tuple[str,str,list[str]]]:
+        """Returns the merged listings of events that start on one of the given dates: (canonical_id, content_hash, visibility) by (id, date_start)"""
+        dates = list(set(date for date in dates if date))
+        if not dates:
+            return {}
+        with self.connector as cur:
+            self.connector.execute(cur, f"SELECT id, date_start, canonical_id, content_hash, visibility FROM {self.ALIASES} WHERE date_start = ANY(%s::date[]);", (dates,))
+            return {(ret[0], ret[1]): (ret[2], ret[3], ret[4] or []) for ret in cur}
+    def updateAliases(self, aliases:dict[tuple[str,datetime.date],tuple[str,str,list[str]]]):
+        """Stores merged listings, as returned by `dedupe.mergeDuplicates()`. Listings that are ``None`` are deleted."""
+        rows = [(id, date_start, *alias) for (id, date_start), alias in aliases.items() if alias]
+        removed = [key for key, alias in aliases.items() if not alias]
+        if not rows and not removed:
+            return
+        import psycopg2.extras
+        with self.connector as cur:
+            if rows:
+                psycopg2.extras.execute_values(cur, f"""INSERT INTO {self.ALIASES} (id, date_start, canonical_id, content_hash, visibility) VALUES %s
+                    ON CONFLICT ON CONSTRAINT PK_event_alias DO UPDATE SET canonical_id=EXCLUDED.canonical_id, content_hash=EXCLUDED.content_hash, visibility=EXCLUDED.visibility;""",
+                    rows, page_size=self.INSERT_PAGE_SIZE)
+            if removed:
+                cur.execute(f"DELETE FROM {self.ALIASES} WHERE (id, date_start) IN (SELECT * FROM unnest(%s::varchar[], %s::date[]));",
+                            ([id for id, _ in removed], [date_start for _, date_start in removed]))
+    def getVersion(self) -> tuple[int,datetime.datetime]:
+        """Returns (number of events, time of the latest change of an event). Changes whenever events are inserted, changed, deleted or archived, so it can key caches of events.
+
+        Both are cheap: the count is an index-only scan, and the latest change is looked up in the index of `date_updated`.
+        """
+        with self.connector as cur:
+            cur.execute(f"SELECT count(*), max(date_updated) FROM {self.TABLE};")
+            return tuple(cur.fetchone())
+    def deleteEvents(self, events:list[Event]):
+        """Deletes the given events (by ID and start date)"""
+        if not events:
+            return
+        with self.connector as cur:
+            cur.execute(f"DELETE FROM {self.TABLE} WHERE (id, date_start) IN (SELECT * FROM unnest(%s::varchar[], %s::date[]));",
+                        ([event.id for event in events], [event.date_start for event in events]))
+    def publishChanges(self, ids:list[str]):
+        """Notifies everyone listening on `CHANNEL` of new or changed events. The payload is a JSON list of event IDs."""
+        # Split IDs into chunks, so each payload stays below the size limit
+        chunks = [[]]
+        size = 2
+        for id in dict.fromkeys(ids):
+            id_size = len(json.dumps(id)) + 2
+            if chunks[-1] and size + id_size > self.NOTIFY_PAYLOAD_SIZE:
+                chunks.append([])
+                size = 2
+            chunks[-1].append(id)
+            size += id_size
+        with self.connector as cur:
+            for chunk in chunks:
+                cur.execute("SELECT pg_notify(%s, %s);", (self.CHANNEL, json.dumps(chunk)))
+    @staticmethod
+    def parseChanges(payloads:list[str]) -> set[str]:
+        """Returns event IDs of notification payloads sent by `publishChanges()`"""
+        ids = set()
+        for payload in payloads:
+            try:
+                ids.update(json.loads(payload))
+            except ValueError:
+                utils.print_warning(f"Received malformed notification payload: {payload[:100]}")
+        return ids
 
 
 class DBDiscord():
     """
     Class helper for saving Discord-related data, for example:
     - Where should events be posted
+    - When should events be posted and reminded of (``NULL``: the defaults of the bot)
     - ...
     """
     TABLE = "discord"
@@ -156,8 +617,16 @@ class DBDiscord():
             cur.execute(f"""CREATE TABLE {self.TABLE} (
                     channel_id BIGINT NOT NULL,
                     visibility VARCHAR[],
+                    post_times VARCHAR,
+                    post_window INTEGER,
+                    remind_at TIME,
                     CONSTRAINT PK_discord PRIMARY KEY (channel_id)
                 );""")
+    def migrateTable(self):
+        """Adds columns that were introduced after the table has been created."""
+        with self.connector as cur:
+            cur.execute(f"""ALTER TABLE {self.TABLE} ADD COLUMN IF NOT EXISTS post_times VARCHAR,
+                ADD COLUMN IF NOT EXISTS post_window INTEGER, ADD COLUMN IF NOT EXISTS remind_at TIME;""")
     def executeQuery(self, query : str, retval : bool = False):
         """Executes any query. Returns output if retval flag is set to true."""
         with self.connector as cur:
@@ -176,12 +645,12 @@ class DBDiscord():
         with self.connector as cur:
             query = f"""INSERT INTO {self.TABLE} (channel_id, visibility) VALUES (%s, %s)
                         ON CONFLICT ON CONSTRAINT PK_discord DO UPDATE SET visibility=EXCLUDED.visibility;"""
-            data = (channel_id, visibility)
-            cur.execute(query,data)
+            data = (channel_id, list(visibility))
+            self.connector.execute(cur, query, data)
     def getChannelVisibility(self, channel_id : int) -> set[str]:
         """Returns the visibility of events to this channel"""
         with self.connector as cur:
-            cur.execute(f"SELECT visibility FROM {self.TABLE} WHERE (channel_id = %s);", (channel_id,))
+            self.connector.execute(cur, f"SELECT visibility FROM {self.TABLE} WHERE (channel_id = %s);", (channel_id,))
             ret = cur.fetchone()
             if ret:
                 return set(ret[0])
@@ -189,12 +658,198 @@ class DBDiscord():
     def removeChannel(self, channel_id : int):
         """Removes channel from table"""
         with self.connector as cur:
-            cur.execute(f"DELETE FROM {self.TABLE} WHERE (channel_id = %s);", (channel_id,))
+            self.connector.execute(cur, f"DELETE FROM {self.TABLE} WHERE (channel_id = %s);", (channel_id,))
     def getAllChannelVisibility(self):
         """Returns all channels with their visibility"""
         with self.connector as cur:
-            cur.execute(f"SELECT channel_id, visibility FROM {self.TABLE};")
+            self.connector.execute(cur, f"SELECT channel_id, visibility FROM {self.TABLE};")
             return cur.fetchall()
+    def updateSchedule(self, channel_id:int, post_times:str=None, post_window:int=None, remind_at:datetime.time=None):
+        """Sets when events are posted to this channel (cron), over how many minutes, and when it is reminded of events. ``None`` for the defaults."""
+        with self.connector as cur:
+            self.connector.execute(cur, f"UPDATE {self.TABLE} SET post_times = %s, post_window = %s, remind_at = %s WHERE (channel_id = %s);",
+                                   (post_times, post_window, remind_at, channel_id))
+    def getAllSchedules(self) -> dict[int,tuple[str,int,datetime.time]]:
+        """Returns (post_times, post_window, remind_at) of all channels, by channel ID. Settings that are not set are ``None``."""
+        with self.connector as cur:
+            self.connector.execute(cur, f"SELECT channel_id, post_times, post_window, remind_at FROM {self.TABLE};")
+            return {ret[0]: tuple(ret[1:]) for ret in cur.fetchall()}
+
+class DBScrapJournal():
+    """
+    Class helper for the journal of scrap runs.
+
+    Records per run which pages of a source have been fetched, ingested or have failed,
+    so a crashed run can be resumed instead of starting over.
+    """
+    TABLE = "scrap_journal"
+    KEEP_DAYS = 14  # Journal entries older than this are deleted
+    def __init__(self,host=DB_HOST,port=DB_PORT,user=DB_USER,password=DB_PW,database=DB_NAME):
+        self.connector = DBConnector(host=host,port=port,user=user,password=password,database=database)
+    def __str__(self):
+        return self.TABLE
+    def createTable(self, if_not_exists:bool=False):
+        """Creates table if not present."""
+        with self.connector as cur:
+            cur.execute(f"""CREATE TABLE {'IF NOT EXISTS ' if if_not_exists else ''}{self.TABLE} (
+                    run_id VARCHAR NOT NULL,
+                    source VARCHAR NOT NULL,
+                    url VARCHAR NOT NULL,
+                    status VARCHAR NOT NULL,
+                    attempts INT NOT NULL DEFAULT 1,
+                    error TEXT,
+                    started TIMESTAMP WITH TIME ZONE NOT NULL,
+                    updated TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT current_timestamp,
+                    CONSTRAINT PK_scrap_journal PRIMARY KEY (run_id, url)
+                );""")
+    def migrateTable(self):
+        """Creates the table, if it does not exist yet."""
+        self.createTable(if_not_exists=True)
+    def printTable(self):
+        """Print all records in database"""
+        with self.connector as cur:
+            cur.execute(f"SELECT * FROM {self.TABLE};")
+            print(cur.fetchall())
+    def markPage(self, run_id:str, source:str, url:str, status:str, started:datetime.datetime, error:str=None):
+        """Records the status of a page in a run. Failed attempts are counted."""
+        with self.connector as cur:
+            cur.execute(f"""INSERT INTO {self.TABLE} (run_id, source, url, status, error, started) VALUES (%s, %s, %s, %s, %s, %s)
+                            ON CONFLICT ON CONSTRAINT PK_scrap_journal DO UPDATE SET status=EXCLUDED.status, error=EXCLUDED.error, updated=current_timestamp,
+                            attempts={self.TABLE}.attempts + (CASE WHEN EXCLUDED.status = 'failed' THEN 1 ELSE 0 END);""",
+                        (run_id, source, url, status, error, started))
+    def prune(self):
+        """Deletes journal entries older than `KEEP_DAYS`"""
+        with self.connector as cur:
+            cur.execute(f"DELETE FROM {self.TABLE} WHERE updated < current_timestamp - interval '{int(self.KEEP_DAYS)} days';")
+    def getLatestRun(self, source:str) -> tuple[str,datetime.datetime,dict[str,str]]:
+        """Returns (run_id, started, {url: status}) of the latest run of a source, ``None`` if it has never run."""
+        with self.connector as cur:
+            cur.execute(f"SELECT run_id, started FROM {self.TABLE} WHERE source = %s ORDER BY started DESC LIMIT 1;", (source,))
+            ret = cur.fetchone()
+            if not ret:
+                return None
+            run_id, started = ret
+            cur.execute(f"SELECT url, status FROM {self.TABLE} WHERE run_id = %s;", (run_id,))
+            return run_id, started, {url: status for url, status in cur.fetchall()}
+
+class DBImage():
+    """
+    Class helper for the checks of image URLs of events (see `images.py`).
+
+    Records per URL whether the image is reachable, its content type and size, and when it has been checked.
+    """
+    TABLE = "images"
+    def __init__(self,host=DB_HOST,port=DB_PORT,user=DB_USER,password=DB_PW,database=DB_NAME):
+        self.connector = DBConnector(host=host,port=port,user=user,password=password,database=database)
+    def __str__(self):
+        return self.TABLE
+    def createTable(self, if_not_exists:bool=False):
+        """Creates table if not present."""
+        with self.connector as cur:
+            cur.execute(f"""CREATE TABLE {'IF NOT EXISTS ' if if_not_exists else ''}{self.TABLE} (
+                    url VARCHAR NOT NULL,
+                    reachable BOOLEAN NOT NULL,
+                    status INT,
+                    content_type VARCHAR,
+                    size BIGINT,
+                    checked TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT current_timestamp,
+                    CONSTRAINT PK_images PRIMARY KEY (url)
+                );""")
+    def migrateTable(self):
+        """Creates the table, if the database was created before it was introduced."""
+        self.createTable(if_not_exists=True)
+    def printTable(self):
+        """Print all records in database"""
+        with self.connector as cur:
+            cur.execute(f"SELECT * FROM {self.TABLE};")
+            print(cur.fetchall())
+    def getUnchecked(self, urls:list[str], ttl:datetime.timedelta) -> list[str]:
+        """Returns the URLs that have never been checked, or whose check is older than `ttl`"""
+        urls = list(set(url for url in urls if url))
+        if not urls:
+            return []
+        with self.connector as cur:
+            cur.execute(f"SELECT url FROM {self.TABLE} WHERE url = ANY(%s) AND checked > current_timestamp - %s;", (urls, ttl))
+            fresh = set(ret[0] for ret in cur.fetchall())
+        return [url for url in urls if url not in fresh]
+    def saveChecks(self, checks:list[tuple[str,bool,int,str,int]]):
+        """Saves checks (url, reachable, status, content_type, size) of image URLs"""
+        if not checks:
+            return
+        import psycopg2.extras
+        with self.connector as cur:
+            psycopg2.extras.execute_values(cur, f"""INSERT INTO {self.TABLE} (url, reachable, status, content_type, size) VALUES %s
+                ON CONFLICT ON CONSTRAINT PK_images DO UPDATE SET reachable=EXCLUDED.reachable, status=EXCLUDED.status,
+                content_type=EXCLUDED.content_type, size=EXCLUDED.size, checked=current_timestamp;""", checks)
+    def getChecks(self, urls:list[str]) -> dict[str,tuple[bool,str,int]]:
+        """Returns {url: (reachable, content_type, size)} of the given URLs. URLs that have never been checked are left out."""
+        urls = list(set(url for url in urls if url))
+        if not urls:
+            return {}
+        with self.connector as cur:
+            cur.execute(f"SELECT url, reachable, content_type, size FROM {self.TABLE} WHERE url = ANY(%s);", (urls,))
+            return {ret[0]: (ret[1], ret[2], ret[3]) for ret in cur.fetchall()}
+
+class DBJobRun():
+    """
+    Class helper for the runs of scheduled jobs (see `jobs.py`).
+
+    Every run of a job is recorded by the time slot it was scheduled for. Claiming a slot is atomic,
+    so each slot of a job runs only once, even with several bot processes or after a restart.
+    """
+    TABLE = "job_runs"
+    KEEP_DAYS = 30  # Runs older than this are deleted
+    def __init__(self,host=DB_HOST,port=DB_PORT,user=DB_USER,password=DB_PW,database=DB_NAME):
+        self.connector = DBConnector(host=host,port=port,user=user,password=password,database=database)
+    def __str__(self):
+        return self.TABLE
+    def createTable(self, if_not_exists:bool=False):
+        """Creates table if not present."""
+        with self.connector as cur:
+            cur.execute(f"""CREATE TABLE {'IF NOT EXISTS ' if if_not_exists else ''}{self.TABLE} (
+                    job_id VARCHAR NOT NULL,
+                    slot TIMESTAMP WITH TIME ZONE NOT NULL,
+                    owner VARCHAR NOT NULL,
+                    status VARCHAR NOT NULL,
+                    attempts INT NOT NULL DEFAULT 1,
+                    started TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT current_timestamp,
+                    finished TIMESTAMP WITH TIME ZONE,
+                    CONSTRAINT PK_job_runs PRIMARY KEY (job_id, slot)
+                );""")
+    def migrateTable(self):
+        """Creates the table, if the database was created before it was introduced."""
+        self.createTable(if_not_exists=True)
+    def printTable(self):
+        """Print all records in database"""
+        with self.connector as cur:
+            cur.execute(f"SELECT * FROM {self.TABLE};")
+            print(cur.fetchall())
+    def claimSlot(self, job_id:str, slot:datetime.datetime, owner:str, stale_after:datetime.timedelta, reclaim_done:bool=False) -> bool:
+        """Claims the slot of a job for `owner`. Returns `True` if the caller shall run the job, `False` if it is taken.
+
+        A slot can be claimed again if its run failed, or if it is still running after `stale_after` (its process has died).
+        If flag `reclaim_done` is set to `True`, finished slots can be claimed again too (i.e. the slot is used as a lock).
+        """
+        with self.connector as cur:
+            cur.execute(f"DELETE FROM {self.TABLE} WHERE started < current_timestamp - interval '{int(self.KEEP_DAYS)} days';")
+            cur.execute(f"""INSERT INTO {self.TABLE} (job_id, slot, owner, status) VALUES (%s, %s, %s, 'running')
+                            ON CONFLICT ON CONSTRAINT PK_job_runs DO UPDATE SET owner=EXCLUDED.owner, status='running', started=current_timestamp, finished=NULL,
+                            attempts={self.TABLE}.attempts + 1
+                            WHERE {self.TABLE}.status = 'failed' OR ({self.TABLE}.status = 'done' AND %s)
+                            OR ({self.TABLE}.status = 'running' AND {self.TABLE}.started < current_timestamp - %s)
+                            RETURNING job_id;""", (job_id, slot, owner, reclaim_done, stale_after))
+            return cur.fetchone() is not None
+    def finishSlot(self, job_id:str, slot:datetime.datetime, owner:str, status:str):
+        """Records the result ('done', 'failed') of the run of a slot"""
+        with self.connector as cur:
+            cur.execute(f"UPDATE {self.TABLE} SET status=%s, finished=current_timestamp WHERE job_id=%s AND slot=%s AND owner=%s;", (status, job_id, slot, owner))
+
+def migrateTables(*tables):
+    """Brings given existing tables up to date with their current definition, without losing data."""
+    for table in tables:
+        if hasattr(table, 'migrateTable'):
+            table.migrateTable()
+            print(f"[INFO] migrated table {table.TABLE}.")
 
 def dropTables(*tables):
     """Attempts to drops given tables."""
@@ -226,25 +881,61 @@ def createDatabase(recreate=False):
 
     If flag `recreate` is set to `True`, it will delete all tables beforehand (only if they exist).
     """
-    createTables(eventDB, discordDB, recreate=recreate)
+    createTables(*openDatabase(), recreate=recreate)
+
+
+# Tables of the configured backend. Created on first access, see `openDatabase()`.
+TABLES = ('eventDB', 'discordDB', 'journalDB', 'imageDB', 'jobDB')
+_open_lock = threading.Lock()
 
+def openDatabase() -> tuple:
+    """Returns the tables (eventDB, discordDB, journalDB, imageDB, jobDB) of the configured backend. Creates them on the first call.
+
+    No connection is opened here: connections are made whenever a table is used.
+    """
+    global eventDB, discordDB, journalDB, imageDB, jobDB
+    with _open_lock:
+        if 'eventDB' not in globals():
+            if DB_BACKEND == 'sqlite':
+                from . import database_sqlite
+                print(f"DATABASE-INFO: SQLITE={SQLITE_PATH}")
+                eventDB = database_sqlite.DBEvent(SQLITE_PATH, retention_months=EVENTS_RETENTION_MONTHS, archive_mode=ARCHIVE_MODE)
+                discordDB = database_sqlite.DBDiscord(SQLITE_PATH)
+                journalDB = database_sqlite.DBScrapJournal(SQLITE_PATH)
+                imageDB = database_sqlite.DBImage(SQLITE_PATH)
+                jobDB = database_sqlite.DBJobRun(SQLITE_PATH)
+            elif DB_BACKEND == 'postgres':
+                print(f"DATABASE-INFO: HOST={DB_HOST},PORT={DB_PORT},USER={DB_USER},PW={'*'*len(DB_PW or '')},NAME={DB_NAME}")
+                eventDB = DBEvent(host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PW, database=DB_NAME)
+                discordDB = DBDiscord(host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PW, database=DB_NAME)
+                journalDB = DBScrapJournal(host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PW, database=DB_NAME)
+                imageDB = DBImage(host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PW, database=DB_NAME)
+                jobDB = DBJobRun(host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PW, database=DB_NAME)
+            else:
+                raise ValueError(f"Unknown database backend DB_BACKEND={DB_BACKEND!r}. Choose 'postgres' or 'sqlite'.")
+    return eventDB, discordDB, journalDB, imageDB, jobDB
 
-# Open database connections
-eventDB = DBEvent(host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PW, database=DB_NAME)
-discordDB = DBDiscord(host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PW, database=DB_NAME)
+def __getattr__(name:str):
+    """Creates the tables on first access of `database.eventDB`, `database.discordDB`, ..."""
+    if name in TABLES:
+        return dict(zip(TABLES, openDatabase()))[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == '__main__':
+    eventDB, discordDB, journalDB, imageDB, jobDB = openDatabase()
     args = sys.argv[1:]
     for arg in args:
         if arg == 'create':
             createDatabase(recreate=True)
+        elif arg == 'migrate':
+            migrateTables(eventDB, discordDB, journalDB, imageDB, jobDB)
         else:
             print(f"argument '{arg}' unknown. SKIP")
 
     try:
         discordDB.printTable()
-        eventDB.printTable()
+        eventDB.printTable()  # Streamed, see `DB_ITERSIZE`
     except Exception:
         pass
     # print("Special query:")
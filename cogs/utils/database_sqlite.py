@@ -0,0 +1,590 @@
+"""SQLite database backend
+
+Embedded drop-in for the postgres tables of `database.py`, for single-node deployments, local tests and benchmarks.
+Select it with `DB_BACKEND=sqlite` (and `SQLITE_PATH`). Every class offers the same methods as its postgres counterpart.
+
+Differences to postgres:
+- The events table is not partitioned. Archiving moves events of past months into the table `events_archive` (or deletes them).
+- There is no `LISTEN`/`NOTIFY`, so changes can't be published to a bot in another process (`SCRAP_WORKER` needs postgres).
+- Searching events has no full-text index: every keyword must appear (`LIKE`) in name, description or location.
+"""
+
+import re
+import json
+import sqlite3
+import datetime
+import threading
+import contextlib
+import pytz
+
+from .event import Event
+from . import utils
+from . import metrics
+
+
+# Dates are in Japanese time, like in the postgres backend (see `database.DB_TIMEZONE`)
+LOCAL_TZ = pytz.timezone('Asia/Tokyo')
+
+# Store dates and times as ISO strings, and parse them back by the declared type of their column
+sqlite3.register_adapter(datetime.date, lambda d: d.isoformat())
+sqlite3.register_adapter(datetime.datetime, lambda d: d.isoformat())
+sqlite3.register_adapter(datetime.time, lambda t: t.isoformat())
+sqlite3.register_converter('DATE', lambda b: datetime.date.fromisoformat(b.decode()))
+sqlite3.register_converter('TIMETZ', lambda b: datetime.time.fromisoformat(b.decode()))
+def _convertTimestamp(b:bytes) -> datetime.datetime:
+    timestamp = datetime.datetime.fromisoformat(b.decode())
+    if timestamp.tzinfo is None:  # Set by CURRENT_TIMESTAMP, which is UTC
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+    return timestamp
+sqlite3.register_converter('TIMESTAMP', _convertTimestamp)
+
+
+class DBConnector():
+    """
+    Class helper to connect with a SQLite database file.
+    Allows to connect to database with python command:
+
+    with DBConnector(path) as cur:
+        # do something
+
+    Every `with` opens its own connection, so the connector can be used by several threads at the same time.
+    The database runs in WAL mode: readers never block the writer and vice versa.
+    """
+    BUSY_TIMEOUT = 10  # seconds to wait for the lock of another writer
+    def __init__(self, path:str):
+        self.path = path
+        self._local = threading.local()
+    def _connections(self) -> list:
+        """Returns stack of (connection, cursor) opened by the current thread"""
+        if not hasattr(self._local, 'connections'):
+            self._local.connections = []
+        return self._local.connections
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT, detect_types=sqlite3.PARSE_DECLTYPES)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        return conn
+    def __enter__(self):
+        conn = self._connect()
+        cur = conn.cursor()
+        self._connections().append((conn, cur))
+        metrics.DB_CONNECTIONS.inc()
+        return cur
+    def __exit__(self, type, value, traceback):
+        conn, cur = self._connections().pop()
+        metrics.DB_CONNECTIONS.dec()
+        if type is None:
+            conn.commit()
+        else:
+            conn.rollback()
+        cur.close()
+        conn.close()
+    def execute(self, cur, query:str, data:tuple=()):
+        """Executes a query, see `database.DBConnector.execute()`. SQLite caches the prepared statements of a connection itself."""
+        cur.execute(query.replace('%s', '?'), data)
+    @contextlib.contextmanager
+    def stream(self, itersize:int=2000):
+        """Context manager. Returns a read-only cursor with a connection of its own, see `database.DBConnector.stream()`.
+
+        SQLite cursors read rows while iterating already. `itersize` is used as `arraysize`.
+        """
+        conn = self._connect()
+        metrics.DB_CONNECTIONS.inc()
+        try:
+            cur = conn.cursor()
+            cur.arraysize = itersize
+            try:
+                yield cur
+            finally:
+                cur.close()
+        finally:
+            metrics.DB_CONNECTIONS.dec()
+            conn.close()
+
+class DBEvent():
+    """
+    Class helper for saving events, see `database.DBEvent`.
+    """
+    TABLE = "events"
+    ARCHIVE = "events_archive"  # Events of archived months
+    CHANNEL = "events_changed"
+    ALIASES = "event_aliases"  # Listings of events that have been merged into another listing, see `database.DBEvent.ALIASES`
+    SEARCH_PAGE_SIZE = 10
+    STREAM_ITERSIZE = 2000
+    # Regions of an event are stored as JSON array. Condition of the events visible in one of the topics (`visibility && topics` in postgres).
+    NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"  # CURRENT_TIMESTAMP has only seconds, too coarse for `getVersion()`
+    VISIBILITY = f"EXISTS (SELECT 1 FROM json_each({TABLE}.visibility) AS region JOIN json_each(?) AS topic ON region.value = topic.value)"
+    def __init__(self, path:str, retention_months:int=3, archive_mode:str='detach'):
+        self.connector = DBConnector(path)
+        self.retention_months = retention_months
+        self.archive_mode = archive_mode
+    def __str__(self):
+        return self.TABLE
+    def createTable(self, if_not_exists:bool=False):
+        """Creates table if not present."""
+        exists = 'IF NOT EXISTS ' if if_not_exists else ''
+        with self.connector as cur:
+            cur.execute(f"""CREATE TABLE {exists}{self.TABLE} (
+                    id VARCHAR NOT NULL,
+                    name VARCHAR NOT NULL,
+                    description TEXT,
+                    url VARCHAR,
+                    img VARCHAR,
+                    date_start DATE NOT NULL,
+                    date_end DATE,
+                    date_fuzzy VARCHAR,
+                    time_start TIMETZ,
+                    time_end TIMETZ,
+                    location VARCHAR,
+                    cost VARCHAR,
+                    status VARCHAR,
+                    other VARCHAR,
+                    visibility JSON,
+                    source VARCHAR,
+                    date_added TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    content_hash VARCHAR,
+                    details TEXT,
+                    address VARCHAR,
+                    schedule VARCHAR,
+                    date_updated TIMESTAMP,
+                    CONSTRAINT PK_event PRIMARY KEY (id, date_start)
+                );""")
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {self.TABLE}_date_start_id ON {self.TABLE} (date_start, id);")
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {self.TABLE}_date_updated ON {self.TABLE} (date_updated);")
+            cur.execute(f"""CREATE TABLE IF NOT EXISTS {self.ALIASES} (
+                    id VARCHAR NOT NULL,
+                    date_start DATE NOT NULL,
+                    canonical_id VARCHAR NOT NULL,
+                    content_hash VARCHAR,
+                    visibility JSON,
+                    CONSTRAINT PK_event_alias PRIMARY KEY (id, date_start)
+                );""")
+    def migrateTable(self):
+        """Creates the table, if it does not exist yet, adds columns that were introduced after it has been created,
+        and converts visibilities stored as string (regions joined by ', ') into JSON arrays."""
+        with self.connector as cur:
+            for table in (self.TABLE, self.ARCHIVE):  # The archive has the columns of the table, see `archivePartitions()`
+                columns = [ret[1] for ret in cur.execute(f"PRAGMA table_info({table});").fetchall()]
+                if columns and 'date_updated' not in columns:
+                    cur.execute(f"ALTER TABLE {table} ADD COLUMN date_updated TIMESTAMP;")
+        self.createTable(if_not_exists=True)
+        with self.connector as cur:
+            cur.execute(f"SELECT DISTINCT visibility FROM {self.TABLE} WHERE visibility IS NOT NULL AND visibility NOT LIKE '[%';")
+            for (visibility,) in cur.fetchall():
+                cur.execute(f"UPDATE {self.TABLE} SET visibility = ? WHERE visibility = ?;", (json.dumps(visibility.split(', ')), visibility))
+    def printTable(self):
+        """Print all records in database. Rows are streamed, so the table is never loaded into memory as a whole."""
+        with self.connector.stream(self.STREAM_ITERSIZE) as cur:
+            cur.execute(f"SELECT * FROM {self.TABLE};")
+            for ret in cur:
+                print(tuple(ret))
+    def ensurePartitions(self, dates:list[datetime.date]):
+        """The table is not partitioned, nothing to do."""
+        pass
+    def getRetentionCutoff(self) -> datetime.date:
+        """Returns the first day of the oldest month that is not archived"""
+        month = datetime.datetime.now(tz=LOCAL_TZ).date().replace(day=1)
+        for _ in range(self.retention_months):
+            month = (month - datetime.timedelta(days=1)).replace(day=1)
+        return month
+    def archivePartitions(self, mode:str=None) -> list[str]:
+        """Archives events of months before the retention cutoff. Returns the archived months (like the names of postgres partitions).
+
+        If `mode` is 'detach', archived events are moved into the table `ARCHIVE`. If it is 'drop', they are deleted.
+        """
+        mode = mode or self.archive_mode
+        cutoff = self.getRetentionCutoff()
+        with self.connector as cur:
+            cur.execute(f"SELECT DISTINCT strftime('%Y%m', date_start) FROM {self.TABLE} WHERE date_start < ? ORDER BY 1;", (cutoff,))
+            archived = [f"{self.TABLE}_p{ret[0]}" for ret in cur.fetchall()]
+            if not archived:
+                return []
+            if mode != 'drop':
+                cur.execute(f"CREATE TABLE IF NOT EXISTS {self.ARCHIVE} AS SELECT * FROM {self.TABLE} WHERE 0;")
+                cur.execute(f"INSERT INTO {self.ARCHIVE} SELECT * FROM {self.TABLE} WHERE date_start < ?;", (cutoff,))
+            cur.execute(f"DELETE FROM {self.TABLE} WHERE date_start < ?;", (cutoff,))
+            cur.execute(f"DELETE FROM {self.ALIASES} WHERE date_start < ?;", (cutoff,))
+        print(f"[INFO] archived ({mode}) events of table {self.TABLE}: {archived}")
+        return archived
+    def getEvents(self, visibility:list[str]=None, from_date:datetime.datetime.date=None, until_date:datetime.datetime.date=None, stream:bool=False) -> list[Event]:
+        """Return events of given visibility, in the given date duration. If `stream` is set, returns an iterator that yields the events lazily."""
+        events = self.iterEvents(visibility, from_date, until_date)
+        return events if stream else list(events)
+    def iterEvents(self, visibility:list[str]=None, from_date:datetime.date=None, until_date:datetime.date=None, itersize:int=STREAM_ITERSIZE):
+        """Yields events of given visibility, in the given date duration, ordered by (date_start, id). Rows are read while iterating."""
+        conditions = []
+        data = ()
+        if visibility:
+            conditions.append(self.VISIBILITY)
+            data += (json.dumps(list(visibility)),)
+        if from_date:
+            conditions.append("date_start >= ?")
+            data += (from_date,)
+        if until_date:
+            conditions.append("date_start <= ? AND date_end <= ?")
+            data += (until_date, until_date)
+        query = f"SELECT * FROM {self.TABLE}" + (f" WHERE {' AND '.join(conditions)}" if conditions else '') + " ORDER BY date_start, id;"
+        with self.connector.stream(itersize) as cur:
+            cur.execute(query, data)
+            for ret in cur:
+                yield self._toEvent(ret)
+    def searchEvents(self, keywords:str=None, visibility:list[str]=None, from_date:datetime.date=None, until_date:datetime.date=None,
+                     after:tuple[datetime.date,str]=None, limit:int=SEARCH_PAGE_SIZE) -> list[Event]:
+        """Returns events that match the keywords, of given visibility, happening in the given date duration, see `database.DBEvent.searchEvents()`.
+
+        Every word of the keywords must appear in name, description or location.
+        """
+        conditions = []
+        data = ()
+        for word in (keywords or '').split():
+            pattern = '%' + re.sub(r'([\\%_])', r'\\\1', word.strip('"')) + '%'
+            conditions.append("(name LIKE ? ESCAPE '\\' OR description LIKE ? ESCAPE '\\' OR location LIKE ? ESCAPE '\\')")
+            data += (pattern, pattern, pattern)
+        if visibility:
+            conditions.append(self.VISIBILITY)
+            data += (json.dumps(list(visibility)),)
+        if from_date:
+            conditions.append("date_end >= ?")
+            data += (from_date,)
+        if until_date:
+            conditions.append("date_start <= ?")
+            data += (until_date,)
+        if after:
+            conditions.append("(date_start, id) > (?, ?)")
+            data += tuple(after)
+        query = f"SELECT * FROM {self.TABLE}" + (f" WHERE {' AND '.join(conditions)}" if conditions else '') + " ORDER BY date_start, id LIMIT ?;"
+        with self.connector as cur:
+            cur.execute(query, data + (limit,))
+            return [self._toEvent(ret) for ret in cur]
+    @staticmethod
+    def _toEvent(ret:sqlite3.Row) -> Event:
+        """Returns the event of a row of the table"""
+        return Event(id=ret['id'], name=ret['name'], description=ret['description'], url=ret['url'], img=ret['img'],
+                     date_start=ret['date_start'], date_end=ret['date_end'], date_fuzzy=ret['date_fuzzy'] or '',
+                     time_start=ret['time_start'] or '', time_end=ret['time_end'] or '', location=ret['location'], cost=ret['cost'],
+                     status=ret['status'], other=ret['other'] or '', visibility=json.loads(ret['visibility'] or '[]'), source=ret['source'],
+                     date_added=ret['date_added'], details=ret['details'] or '', address=ret['address'] or '', schedule=ret['schedule'] or '')
+    def insertEvents(self, events) -> list[str]:
+        """Inserts (upserts) events into database. Returns IDs of the events that were new or have changed.
+
+        Same semantics as the postgres backend: unchanged rows are not touched, and missing details do not overwrite stored ones.
+        """
+        if not events:
+            return []
+        query = f"""INSERT INTO {self.TABLE} (id, name, description, url, img, date_start, date_end, date_fuzzy, time_start, time_end, location, cost, status, other, visibility, source, content_hash, details, address, schedule, date_updated)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, {self.NOW})
+            ON CONFLICT (id, date_start) DO UPDATE SET content_hash=excluded.content_hash, name=excluded.name, description=excluded.description, url=excluded.url, img=excluded.img, date_end=excluded.date_end, date_fuzzy=excluded.date_fuzzy, time_start=excluded.time_start, time_end=excluded.time_end, location=excluded.location, cost=excluded.cost, status=excluded.status, other=excluded.other, visibility=excluded.visibility, source=excluded.source,
+                details=COALESCE(excluded.details, {self.TABLE}.details), address=COALESCE(excluded.address, {self.TABLE}.address), schedule=COALESCE(excluded.schedule, {self.TABLE}.schedule), date_updated=excluded.date_updated
+            WHERE ({self.TABLE}.name, {self.TABLE}.description, {self.TABLE}.url, {self.TABLE}.img, {self.TABLE}.date_end, {self.TABLE}.date_fuzzy, {self.TABLE}.time_start, {self.TABLE}.time_end, {self.TABLE}.location, {self.TABLE}.cost, {self.TABLE}.status, {self.TABLE}.other, {self.TABLE}.visibility, {self.TABLE}.source, {self.TABLE}.details, {self.TABLE}.address, {self.TABLE}.schedule)
+            IS NOT (excluded.name, excluded.description, excluded.url, excluded.img, excluded.date_end, excluded.date_fuzzy, excluded.time_start, excluded.time_end, excluded.location, excluded.cost, excluded.status, excluded.other, excluded.visibility, excluded.source,
+                COALESCE(excluded.details, {self.TABLE}.details), COALESCE(excluded.address, {self.TABLE}.address), COALESCE(excluded.schedule, {self.TABLE}.schedule));"""
+        changed = []
+        with self.connector as cur:
+            for event in events:
+                cur.execute(query, (event.id, event.name, event.description, event.url, event.img,
+                                    event.date_start or None, event.date_end or None, event.date_fuzzy or None,
+                                    event.time_start or None, event.time_end or None, event.location, event.cost, event.status,
+                                    event.other or None, json.dumps(event.visibility), event.source, event.getHash(),
+                                    event.details or None, event.address or None, event.schedule or None))
+                if cur.rowcount > 0:  # Rows whose content has not changed are not touched
+                    changed.append(event.id)
+                else:  # ... but a stale hash of theirs is fixed, see `database.DBEvent.insertEvents()`
+                    cur.execute(f"UPDATE {self.TABLE} SET content_hash = ? WHERE id = ? AND date_start = ? AND content_hash IS NOT ?;",
+                                (event.getHash(), event.id, event.date_start or None, event.getHash()))
+        metrics.EVENTS_INGESTED.inc(len(events))
+        metrics.EVENTS_CHANGED.inc(len(changed))
+        return changed
+    def getVersion(self) -> tuple[int,datetime.datetime]:
+        """Returns (number of events, time of the latest change of an event), see `database.DBEvent.getVersion()`"""
+        with self.connector as cur:
+            cur.execute(f"SELECT count(*), max(date_updated) FROM {self.TABLE};")
+            return tuple(cur.fetchone())
+    def getHashes(self, events:list[Event]) -> dict[tuple[str,datetime.date],str]:
+        """Returns the content hashes stored in the database of the given events, by (id, date_start). Unknown events are left out."""
+        if not events:
+            return {}
+        ids = json.dumps(list(set(event.id for event in events)))
+        with self.connector as cur:
+            cur.execute(f"""SELECT id, date_start, content_hash FROM {self.TABLE} WHERE id IN (SELECT value FROM json_each(?))
+                UNION ALL SELECT a.id, a.date_start, a.content_hash FROM {self.ALIASES} a JOIN {self.TABLE} e ON e.id = a.canonical_id AND e.date_start = a.date_start
+                WHERE a.id IN (SELECT value FROM json_each(?));""", (ids, ids))
+            return {(ret[0], ret[1]): ret[2] for ret in cur.fetchall()}
+    def getEventsOn(self, dates:list[datetime.date]) -> list[Event]:
+        """Returns all events that start on one of the given dates"""
+        dates = list(set(date for date in dates if date))
+        if not dates:
+            return []
+        with self.connector as cur:
+            cur.execute(f"SELECT * FROM {self.TABLE} WHERE date_start IN (SELECT value FROM json_each(?));", (json.dumps([date.isoformat() for date in dates]),))
+            return [self._toEvent(ret) for ret in cur]
+    def getAliasesOn(self, dates:list[datetime.date]) -> dict[tuple[str,datetime.date],tuple[str,str,list[str]]]:
+        """Returns the merged listings of events that start on one of the given dates, see `database.DBEvent.getAliasesOn()`"""
+        dates = list(set(date for date in dates if date))
+        if not dates:
+            return {}
+        with self.connector as cur:
+            cur.execute(f"SELECT id, date_start, canonical_id, content_hash, visibility FROM {self.ALIASES} WHERE date_start IN (SELECT value FROM json_each(?));",
+                        (json.dumps([date.isoformat() for date in dates]),))
+            return {(ret[0], ret[1]): (ret[2], ret[3], json.loads(ret[4] or '[]')) for ret in cur}
+    def updateAliases(self, aliases:dict[tuple[str,datetime.date],tuple[str,str,list[str]]]):
+        """Stores merged listings, as returned by `dedupe.mergeDuplicates()`. Listings that are ``None`` are deleted."""
+        with self.connector as cur:
+            cur.executemany(f"""INSERT INTO {self.ALIASES} (id, date_start, canonical_id, content_hash, visibility) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (id, date_start) DO UPDATE SET canonical_id=excluded.canonical_id, content_hash=excluded.content_hash, visibility=excluded.visibility;""",
+                [(id, date_start, canonical_id, content_hash, json.dumps(visibility)) for (id, date_start), alias in aliases.items() if alias
+                 for canonical_id, content_hash, visibility in [alias]])
+            cur.executemany(f"DELETE FROM {self.ALIASES} WHERE id = ? AND date_start = ?;", [key for key, alias in aliases.items() if not alias])
+    def deleteEvents(self, events:list[Event]):
+        """Deletes the given events (by ID and start date)"""
+        with self.connector as cur:
+            cur.executemany(f"DELETE FROM {self.TABLE} WHERE id = ? AND date_start = ?;", [(event.id, event.date_start) for event in events])
+    def publishChanges(self, ids:list[str]):
+        """SQLite can't notify other processes. Changes are posted at the next `POST_TIMES` instead."""
+        pass
+    @staticmethod
+    def parseChanges(payloads:list[str]) -> set[str]:
+        """Returns the event IDs of the given notification payloads"""
+        ids = set()
+        for payload in payloads:
+            try:
+                ids.update(json.loads(payload))
+            except ValueError:
+                utils.print_warning(f"Received malformed notification payload: {payload[:100]}")
+        return ids
+
+
+class DBDiscord():
+    """
+    Class helper for saving Discord-related data, see `database.DBDiscord`.
+    """
+    TABLE = "discord"
+    def __init__(self, path:str):
+        self.connector = DBConnector(path)
+    def __str__(self):
+        return self.TABLE
+    def createTable(self, if_not_exists:bool=False):
+        """Creates table if not present."""
+        with self.connector as cur:
+            cur.execute(f"""CREATE TABLE {'IF NOT EXISTS ' if if_not_exists else ''}{self.TABLE} (
+                    channel_id BIGINT NOT NULL,
+                    visibility JSON,
+                    post_times VARCHAR,
+                    post_window INTEGER,
+                    remind_at VARCHAR,
+                    CONSTRAINT PK_discord PRIMARY KEY (channel_id)
+                );""")
+    def migrateTable(self):
+        """Creates the table, if it does not exist yet, and adds columns that were introduced after it has been created."""
+        self.createTable(if_not_exists=True)
+        with self.connector as cur:
+            cur.execute(f"PRAGMA table_info({self.TABLE});")
+            columns = set(ret[1] for ret in cur.fetchall())
+            for column, type in [('post_times', 'VARCHAR'), ('post_window', 'INTEGER'), ('remind_at', 'VARCHAR')]:
+                if column not in columns:
+                    cur.execute(f"ALTER TABLE {self.TABLE} ADD COLUMN {column} {type};")
+    def executeQuery(self, query : str, retval : bool = False):
+        """Executes any query. Returns output if retval flag is set to true."""
+        with self.connector as cur:
+            cur.execute(query)
+            if retval:
+                return cur.fetchall()
+            else:
+                return None
+    def printTable(self):
+        """Print all records in database"""
+        with self.connector as cur:
+            cur.execute(f"SELECT * FROM {self.TABLE};")
+            print([tuple(ret) for ret in cur.fetchall()])
+    def updateChannel(self, channel_id : int, visibility : list[str]):
+        """Updates channel info in database. If it does not exist, it will be newly created"""
+        with self.connector as cur:
+            cur.execute(f"""INSERT INTO {self.TABLE} (channel_id, visibility) VALUES (?, ?)
+                            ON CONFLICT (channel_id) DO UPDATE SET visibility=excluded.visibility;""", (channel_id, json.dumps(list(visibility))))
+    def getChannelVisibility(self, channel_id : int) -> set[str]:
+        """Returns the visibility of events to this channel"""
+        with self.connector as cur:
+            cur.execute(f"SELECT visibility FROM {self.TABLE} WHERE (channel_id = ?);", (channel_id,))
+            ret = cur.fetchone()
+            if ret:
+                return set(json.loads(ret[0]))
+            return set([])
+    def removeChannel(self, channel_id : int):
+        """Removes channel from table"""
+        with self.connector as cur:
+            cur.execute(f"DELETE FROM {self.TABLE} WHERE (channel_id = ?);", (channel_id,))
+    def getAllChannelVisibility(self):
+        """Returns all channels with their visibility"""
+        with self.connector as cur:
+            cur.execute(f"SELECT channel_id, visibility FROM {self.TABLE};")
+            return [(ret[0], json.loads(ret[1])) for ret in cur.fetchall()]
+    def updateSchedule(self, channel_id:int, post_times:str=None, post_window:int=None, remind_at:datetime.time=None):
+        """Sets when events are posted to this channel, see `database.DBDiscord.updateSchedule()`"""
+        with self.connector as cur:
+            cur.execute(f"UPDATE {self.TABLE} SET post_times = ?, post_window = ?, remind_at = ? WHERE (channel_id = ?);",
+                        (post_times, post_window, remind_at.isoformat(timespec='minutes') if remind_at else None, channel_id))
+    def getAllSchedules(self) -> dict[int,tuple[str,int,datetime.time]]:
+        """Returns (post_times, post_window, remind_at) of all channels, by channel ID. Settings that are not set are ``None``."""
+        with self.connector as cur:
+            cur.execute(f"SELECT channel_id, post_times, post_window, remind_at FROM {self.TABLE};")
+            return {ret[0]: (ret[1], ret[2], datetime.time.fromisoformat(ret[3]) if ret[3] else None) for ret in cur.fetchall()}
+
+
+class DBScrapJournal():
+    """
+    Class helper for the journal of scrap runs, see `database.DBScrapJournal`.
+    """
+    TABLE = "scrap_journal"
+    KEEP_DAYS = 14  # Journal entries older than this are deleted
+    def __init__(self, path:str):
+        self.connector = DBConnector(path)
+    def __str__(self):
+        return self.TABLE
+    def createTable(self, if_not_exists:bool=False):
+        """Creates table if not present."""
+        with self.connector as cur:
+            cur.execute(f"""CREATE TABLE {'IF NOT EXISTS ' if if_not_exists else ''}{self.TABLE} (
+                    run_id VARCHAR NOT NULL,
+                    source VARCHAR NOT NULL,
+                    url VARCHAR NOT NULL,
+                    status VARCHAR NOT NULL,
+                    attempts INT NOT NULL DEFAULT 1,
+                    error TEXT,
+                    started TIMESTAMP NOT NULL,
+                    updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    CONSTRAINT PK_scrap_journal PRIMARY KEY (run_id, url)
+                );""")
+    def migrateTable(self):
+        """Creates the table, if it does not exist yet."""
+        self.createTable(if_not_exists=True)
+    def printTable(self):
+        """Print all records in database"""
+        with self.connector as cur:
+            cur.execute(f"SELECT * FROM {self.TABLE};")
+            print([tuple(ret) for ret in cur.fetchall()])
+    def markPage(self, run_id:str, source:str, url:str, status:str, started:datetime.datetime, error:str=None):
+        """Records the status of a page in a run. Failed attempts are counted."""
+        with self.connector as cur:
+            cur.execute(f"""INSERT INTO {self.TABLE} (run_id, source, url, status, error, started) VALUES (?, ?, ?, ?, ?, ?)
+                            ON CONFLICT (run_id, url) DO UPDATE SET status=excluded.status, error=excluded.error, updated=CURRENT_TIMESTAMP,
+                            attempts={self.TABLE}.attempts + (CASE WHEN excluded.status = 'failed' THEN 1 ELSE 0 END);""",
+                        (run_id, source, url, status, error, started))
+    def prune(self):
+        """Deletes journal entries older than `KEEP_DAYS`"""
+        with self.connector as cur:
+            cur.execute(f"DELETE FROM {self.TABLE} WHERE updated < datetime('now', ?);", (f'-{int(self.KEEP_DAYS)} days',))
+    def getLatestRun(self, source:str) -> tuple[str,datetime.datetime,dict[str,str]]:
+        """Returns (run_id, started, {url: status}) of the latest run of a source, ``None`` if it has never run."""
+        with self.connector as cur:
+            cur.execute(f"SELECT run_id, started FROM {self.TABLE} WHERE source = ? ORDER BY started DESC LIMIT 1;", (source,))
+            ret = cur.fetchone()
+            if not ret:
+                return None
+            run_id, started = ret
+            cur.execute(f"SELECT url, status FROM {self.TABLE} WHERE run_id = ?;", (run_id,))
+            return run_id, started, {url: status for url, status in cur.fetchall()}
+
+
+class DBImage():
+    """
+    Class helper for the checks of image URLs of events, see `database.DBImage`.
+    """
+    TABLE = "images"
+    def __init__(self, path:str):
+        self.connector = DBConnector(path)
+    def __str__(self):
+        return self.TABLE
+    def createTable(self, if_not_exists:bool=False):
+        """Creates table if not present."""
+        with self.connector as cur:
+            cur.execute(f"""CREATE TABLE {'IF NOT EXISTS ' if if_not_exists else ''}{self.TABLE} (
+                    url VARCHAR NOT NULL,
+                    reachable BOOLEAN NOT NULL,
+                    status INT,
+                    content_type VARCHAR,
+                    size BIGINT,
+                    checked TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    CONSTRAINT PK_images PRIMARY KEY (url)
+                );""")
+    def migrateTable(self):
+        """Creates the table, if it does not exist yet."""
+        self.createTable(if_not_exists=True)
+    def printTable(self):
+        """Print all records in database"""
+        with self.connector as cur:
+            cur.execute(f"SELECT * FROM {self.TABLE};")
+            print([tuple(ret) for ret in cur.fetchall()])
+    def getUnchecked(self, urls:list[str], ttl:datetime.timedelta) -> list[str]:
+        """Returns the URLs that have never been checked, or whose check is older than `ttl`"""
+        urls = list(set(url for url in urls if url))
+        if not urls:
+            return []
+        with self.connector as cur:
+            cur.execute(f"SELECT url FROM {self.TABLE} WHERE url IN (SELECT value FROM json_each(?)) AND checked > datetime('now', ?);",
+                        (json.dumps(urls), f'-{int(ttl.total_seconds())} seconds'))
+            fresh = set(ret[0] for ret in cur.fetchall())
+        return [url for url in urls if url not in fresh]
+    def saveChecks(self, checks:list[tuple[str,bool,int,str,int]]):
+        """Saves checks (url, reachable, status, content_type, size) of image URLs"""
+        if not checks:
+            return
+        with self.connector as cur:
+            cur.executemany(f"""INSERT INTO {self.TABLE} (url, reachable, status, content_type, size) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (url) DO UPDATE SET reachable=excluded.reachable, status=excluded.status,
+                content_type=excluded.content_type, size=excluded.size, checked=CURRENT_TIMESTAMP;""", checks)
+    def getChecks(self, urls:list[str]) -> dict[str,tuple[bool,str,int]]:
+        """Returns {url: (reachable, content_type, size)} of the given URLs. URLs that have never been checked are left out."""
+        urls = list(set(url for url in urls if url))
+        if not urls:
+            return {}
+        with self.connector as cur:
+            cur.execute(f"SELECT url, reachable, content_type, size FROM {self.TABLE} WHERE url IN (SELECT value FROM json_each(?));", (json.dumps(urls),))
+            return {ret[0]: (bool(ret[1]), ret[2], ret[3]) for ret in cur.fetchall()}
+
+
+class DBJobRun():
+    """
+    Class helper for the runs of scheduled jobs, see `database.DBJobRun`.
+    """
+    TABLE = "job_runs"
+    KEEP_DAYS = 30  # Runs older than this are deleted
+    def __init__(self, path:str):
+        self.connector = DBConnector(path)
+    def __str__(self):
+        return self.TABLE
+    def createTable(self, if_not_exists:bool=False):
+        """Creates table if not present."""
+        with self.connector as cur:
+            cur.execute(f"""CREATE TABLE {'IF NOT EXISTS ' if if_not_exists else ''}{self.TABLE} (
+                    job_id VARCHAR NOT NULL,
+                    slot TIMESTAMP NOT NULL,
+                    owner VARCHAR NOT NULL,
+                    status VARCHAR NOT NULL,
+                    attempts INT NOT NULL DEFAULT 1,
+                    started TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    finished TIMESTAMP,
+                    CONSTRAINT PK_job_runs PRIMARY KEY (job_id, slot)
+                );""")
+    def migrateTable(self):
+        """Creates the table, if it does not exist yet."""
+        self.createTable(if_not_exists=True)
+    def printTable(self):
+        """Print all records in database"""
+        with self.connector as cur:
+            cur.execute(f"SELECT * FROM {self.TABLE};")
+            print([tuple(ret) for ret in cur.fetchall()])
+    def claimSlot(self, job_id:str, slot:datetime.datetime, owner:str, stale_after:datetime.timedelta, reclaim_done:bool=False) -> bool:
+        """Claims the slot of a job for `owner`. Returns `True` if the caller shall run the job, `False` if it is taken."""
+        with self.connector as cur:
+            cur.execute(f"DELETE FROM {self.TABLE} WHERE started < datetime('now', ?);", (f'-{int(self.KEEP_DAYS)} days',))
+            cur.execute(f"""INSERT INTO {self.TABLE} (job_id, slot, owner, status) VALUES (?, ?, ?, 'running')
+                            ON CONFLICT (job_id, slot) DO UPDATE SET owner=excluded.owner, status='running', started=CURRENT_TIMESTAMP, finished=NULL,
+                            attempts={self.TABLE}.attempts + 1
+                            WHERE {self.TABLE}.status = 'failed' OR ({self.TABLE}.status = 'done' AND ?)
+                            OR ({self.TABLE}.status = 'running' AND {self.TABLE}.started < datetime('now', ?));""",
+                        (job_id, slot, owner, reclaim_done, f'-{int(stale_after.total_seconds())} seconds'))
+            return cur.rowcount > 0
+    def finishSlot(self, job_id:str, slot:datetime.datetime, owner:str, status:str):
+        """Records the result ('done', 'failed') of the run of a slot"""
+        with self.connector as cur:
+            cur.execute(f"UPDATE {self.TABLE} SET status=?, finished=CURRENT_TIMESTAMP WHERE job_id=? AND slot=? AND owner=?;", (status, job_id, slot, owner))
@@ -0,0 +1,198 @@
+"""Duplicate events
+
+Finds events that are listed several times under different IDs, e.g. by both Tokyo Cheapo and Japan Cheapo,
+or by Japan Cheapo in two prefectures, and merges them into one canonical event that is visible in all their regions.
+
+Listings of the same source with different IDs are never merged: a source lists an event once per region under the same ID,
+so two IDs of one source are two events (e.g. a "Christmas Market" in Sapporo and one in Osaka).
+
+Comparing every pair of events would be O(n²). Instead, events are blocked:
+- Only events with the same `date_start` can be duplicates.
+- Names are normalized and cut into character shingles, which are summarized by a MinHash signature.
+  The signature is split into `BANDS` bands (locality-sensitive hashing): only events that share a band are candidates.
+Only candidates are scored (Jaccard similarity of their shingles), so the cost grows with the number of events, not with its square.
+
+Merged listings are stored as aliases of their canonical event, with their own regions (see `database.DBEvent.ALIASES`),
+so they are known at the next scrap, and a region is dropped once no listing of the event has it anymore.
+"""
+
+import re
+import zlib
+import random
+import unicodedata
+
+from .event import Event
+from . import sources
+from . import metrics
+
+
+#########################
+# Global variables
+#########################
+
+# Length of the character shingles of names
+SHINGLE_SIZE = 3
+
+# MinHash signatures have BANDS * ROWS values. Events whose names have a Jaccard similarity of about (1/BANDS)^(1/ROWS) (~0.6) or more become candidates.
+BANDS = 8
+ROWS = 4
+
+# Candidates with at least this similarity of their names are duplicates, unless both have a location and the locations have nothing in common
+THRESHOLD = 0.7
+
+# Words that do not tell events apart
+STOP_WORDS = {'the', 'a', 'an', 'and', 'of', 'in', 'at', 'event', 'events', 'festival', 'matsuri'}
+
+# Parameters of the hash functions of the signatures: h(x) = (a*x + b) mod PRIME
+PRIME = (1 << 61) - 1
+_rng = random.Random(1337)
+HASHES = [(_rng.randrange(1, PRIME), _rng.randrange(0, PRIME)) for _ in range(BANDS * ROWS)]
+
+
+#########################
+# Functions
+#########################
+
+def normalize(text:str) -> str:
+    """Returns text in lower case, without accents, punctuation, years and stop words"""
+    text = ''.join(c for c in unicodedata.normalize('NFKD', text or '') if not unicodedata.combining(c))
+    words = re.findall(r'\w+', text.lower())
+    return ' '.join(word for word in words if word not in STOP_WORDS and not re.fullmatch(r'(19|20)\d\d', word))
+
+def getShingles(text:str) -> set[str]:
+    """Returns the character shingles of a normalized text"""
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i+SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+def getSignature(shingles:set[str]) -> list[int]:
+    """Returns the MinHash signature of a set of shingles"""
+    values = [zlib.crc32(shingle.encode('utf-8')) for shingle in shingles]
+    return [min((a * x + b) % PRIME for x in values) for a, b in HASHES]
+
+def getSimilarity(shinglesA:set[str], shinglesB:set[str]) -> float:
+    """Returns the Jaccard similarity of two sets of shingles"""
+    if not shinglesA or not shinglesB:
+        return 0.0
+    return len(shinglesA & shinglesB) / len(shinglesA | shinglesB)
+
+def isDuplicate(eventA:Event, eventB:Event, similarity:float) -> bool:
+    """Returns `True` if two candidates with the given similarity of their names are the same event.
+
+    Events with generic names (e.g. 'Christmas Market') happen in many places at once: events at different locations are never the same.
+    """
+    if eventA.source == eventB.source and eventA.id != eventB.id:
+        return False
+    if (eventA.date_end or eventA.date_start) != (eventB.date_end or eventB.date_start):
+        return False
+    locationA, locationB = set(normalize(eventA.location).split()), set(normalize(eventB.location).split())
+    if locationA and locationB and not locationA & locationB:
+        return False
+    return similarity >= THRESHOLD
+
+def findDuplicates(events:list[Event]) -> list[list[Event]]:
+    """Returns groups of events that are duplicates of each other. Events without duplicates are left out."""
+    shingles = [getShingles(normalize(event.name)) for event in events]
+    # Block: events with the same start date and the same band of their signature are candidates
+    buckets = {}
+    for i, event in enumerate(events):
+        if not event.date_start or not shingles[i]:
+            continue
+        signature = getSignature(shingles[i])
+        for band in range(BANDS):
+            key = (event.date_start, band, tuple(signature[band*ROWS:(band+1)*ROWS]))
+            buckets.setdefault(key, []).append(i)
+    # Score candidates, and group duplicates (union-find).
+    # Groups never get two listings of the same source, even through a listing of another source they both match.
+    parent = list(range(len(events)))
+    group_sources = [{event.source} for event in events]  # Sources of the group, by its root
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    scored = set()
+    for bucket in buckets.values():
+        for x, i in enumerate(bucket):
+            for j in bucket[x+1:]:
+                if (i, j) in scored or find(i) == find(j):
+                    continue
+                scored.add((i, j))
+                root_i, root_j = find(i), find(j)
+                if group_sources[root_i] & group_sources[root_j]:
+                    continue
+                if isDuplicate(events[i], events[j], getSimilarity(shingles[i], shingles[j])):
+                    parent[root_j] = root_i
+                    group_sources[root_i] |= group_sources[root_j]
+    groups = {}
+    for i in range(len(events)):
+        groups.setdefault(find(i), []).append(events[i])
+    return [group for group in groups.values() if len(group) > 1]
+
+def getCanonical(group:list[Event]) -> Event:
+    """Returns the event of a group of duplicates that is kept: the one of the first registered source, then the one with the lowest ID"""
+    ranks = {name: rank for rank, name in enumerate(sources.SOURCES)}
+    return min(group, key=lambda event: (ranks.get(event.source, len(ranks)), event.id))
+
+def mergeDuplicates(events:list[Event], known:list[Event]=(), aliases:dict=None) -> tuple[list[Event],list[Event],dict]:
+    """Merges duplicates among the given events, and between them and known events (e.g. of the database with the same start dates).
+
+    Every group of duplicates is merged into its canonical event (see `getCanonical()`), which is made visible in the regions of all listings of the group.
+    `aliases` are the listings that have been merged before, by (id, date_start) (see `database.DBEvent.getAliasesOn()`).
+    Regions are only merged across different listings: a scrapped event replaces the regions of the same listing,
+    so an event is not visible anymore in a region where no source lists it.
+    Returns (events to keep, known events that are duplicates of a kept event and can be deleted, aliases to store by (id, date_start)).
+    The events to keep include known events whose regions have changed. Aliases that are ``None`` are not merged anymore and can be deleted.
+    """
+    aliases = aliases or {}
+    # Same listing scrapped several times in a run (e.g. in two prefectures): merge regions
+    unique = {}
+    for event in events:
+        key = (event.id, event.date_start)
+        if key in unique and unique[key] is not event:
+            event.addVisibility(unique[key].visibility)
+        unique[key] = event
+    # Same listing as a known event: the scrapped event replaces it, regions included
+    known = {(event.id, event.date_start): event for event in known if (event.id, event.date_start) not in unique}
+    # Regions of every listing itself. Known events that have been merged are stored with the regions of their whole group.
+    regions = {key: event.visibility for key, event in unique.items()}
+    regions.update({key: aliases[key][2] if key in aliases else event.visibility for key, event in known.items()})
+    # Listings that have been merged before, by the key of their canonical event
+    listings = {}
+    for key, (canonical_id, content_hash, visibility) in aliases.items():
+        listings.setdefault((canonical_id, key[1]), []).append((key, content_hash, visibility))
+    # Different listings of the same event
+    keep = dict(unique)
+    stale = []
+    merged_aliases = {}
+    grouped = set()
+    merged = 0
+    for group in findDuplicates(list(unique.values()) + list(known.values())):
+        merged += len(group) - 1
+        canonical = getCanonical(group)
+        members = {(event.id, event.date_start): event for event in group}
+        # Listings merged into any member before, that are not part of the group (e.g. of a source scrapped at another time)
+        others = [listing for key in members for listing in listings.get(key, []) if listing[0] not in members]
+        canonical.visibility = sorted(set().union(*[regions[key] for key in members], *[visibility for _, _, visibility in others]))
+        for key, content_hash, visibility in others:
+            merged_aliases[key] = (canonical.id, content_hash, visibility)
+        for key, event in members.items():
+            grouped.add(key)
+            merged_aliases[key] = (canonical.id, event.getHash(), regions[key])
+            if event is canonical:
+                keep[key] = event
+            elif key in known:
+                stale.append(event)
+            else:
+                del keep[key]
+    for key, event in unique.items():
+        if key in grouped:
+            continue
+        others = [listing for listing in listings.get(key, []) if listing[0] != key and listing[0] not in unique]
+        if others:  # Listings merged into this event before, that have not been scrapped with it
+            event.addVisibility(*[visibility for _, _, visibility in others])
+            merged_aliases[key] = (event.id, event.getHash(), regions[key])
+        elif key in aliases:  # Has been merged before, but is not a duplicate anymore
+            merged_aliases[key] = None
+    metrics.EVENTS_MERGED.inc(merged)
+    return list(keep.values()), stale, merged_aliases
@@ -4,6 +4,7 @@ Simple event class to define what attributes an event has, and other helpful fun
 """
 
 import calendar
+import hashlib
 
 from . import utils
 
@@ -24,8 +25,11 @@ class Event(object):
             cost='', # Entry-fee to event
             status='', # Cancelled, Online, Postponed, ...
             other='', # Additional information tag
-            visibility='', # Prefecture, University, ... used for visibility to channels
+            visibility=None, # Prefectures, Universities, ... used for visibility to channels. An event found in several regions is visible in all of them.
             source='', # Source where event was scrapped
+            details='', # Full description from the detail page of the event (only if enriched)
+            address='', # Exact address from the detail page of the event (only if enriched)
+            schedule='', # Opening hours, dates... from the detail page of the event (only if enriched)
             date_added=None): # ONLY SET BY DATABASE: Date of when event was added to database
         self.id = id
         self.name = name
@@ -41,8 +45,11 @@ class Event(object):
         self.cost = cost
         self.status = status
         self.other = other
-        self.visibility = visibility
+        self.visibility = sorted(set(v for v in ([visibility] if isinstance(visibility, str) else visibility or []) if v))
         self.source = source
+        self.details = details
+        self.address = address
+        self.schedule = schedule
         self.date_added = date_added
 
     def __eq__(self, other):
@@ -65,6 +72,23 @@ class Event(object):
         description: {self.description}"""
         return text
     
+    def getHash(self) -> str:
+        """Returns hash of the content of the event. Changes whenever any detail of the event listing changes.
+
+        Details from the detail page (`details`, `address`, `schedule`) are left out, so the hash of a scrapped listing can be compared to the database before the detail page is fetched.
+        The visibility is left out as well: the listing of one region does not know in which other regions the event has been found (see `dedupe.py`).
+        """
+        content = (self.id, self.name, self.description, self.url, self.img, self.date_start, self.date_end, self.date_fuzzy,
+                   self.time_start, self.time_end, self.location, self.cost, self.status, self.other, self.source)
+        return hashlib.md5('\x1f'.join(str(value) for value in content).encode('utf-8')).hexdigest()
+
+    def addVisibility(self, *visibilities:list[str]):
+        """Makes the event visible in the regions of the given visibilities as well"""
+        regions = set(self.visibility)
+        for visibility in visibilities:
+            regions.update(visibility)
+        self.visibility = sorted(regions)
+
     def getDateRange(self) -> str:
         """Returns date-range of when event occurs"""
         if self.date_fuzzy:
@@ -1,27 +1,145 @@
 """Event scrapper
 
 Scraps events from pre-defined websites.
+
+Can also run as a standalone worker process, independent of the discord bot:
+
+    python -m cogs.utils.event_scrapper worker
+
+The worker scraps at `SCRAP_TIMES`, writes the events into the database,
+and publishes the IDs of new or changed events (postgres `NOTIFY`), which the bot consumes to post them.
+
+The scrapping stack (BeautifulSoup, dateutil, urllib.request) is only imported once a page is scrapped,
+so importing this module (e.g. for the registered sources) is cheap.
 """
 
+import os
 import sys
-from bs4 import BeautifulSoup as soup
-from urllib.request import urlopen
+import time
+import hashlib
+import tempfile
+import queue
+import threading
+from urllib.error import HTTPError
+from urllib.parse import urlparse
 import datetime, pytz
-from dateutil.parser import parse as parse_date
 import calendar
-from .event import Event, mergeDuplicateEvents
+from concurrent.futures import ThreadPoolExecutor
+from .event import Event
 from . import database
+from . import images
+from . import dedupe
+from . import jobs
+from . import metrics
+from . import recorder
+from . import snapshot
+from . import sources
+from . import utils
 
 
-def grabPage(url: str):
-    """Return html-code of a given url as soup"""
+# Default times when the sources are scrapped (UNIX CRON format, see cogs/event_listener.py)
+SCRAP_TIMES = '0 15 * * *'  # Every day at 15:00
+
+# Times when partitions of past months are archived, and partitions of upcoming months are created (see `DBEvent.archivePartitions()`)
+ARCHIVE_TIMES = '30 4 1 * *'  # Every 1st of the month at 04:30
+
+# How many sources are scrapped at the same time
+MAX_PARALLEL_SOURCES = 4
+
+# How many pages of a source are downloaded ahead of the parser
+PREFETCH_PAGES = 2
+
+# How many events are upserted into the database at once
+INGEST_CHUNK_SIZE = 100
+
+# How often a page is attempted to be downloaded, and how long to wait after the first failed attempt (doubles after every attempt)
+PAGE_RETRIES = 3
+PAGE_RETRY_DELAY = 5  # seconds
+
+# How many listing pages per URL are crawled at most.
+# Crawling stops earlier at the first page that only lists events already known to the database.
+MAX_PAGES = 10
+
+# Unfinished scrap runs younger than this are resumed instead of starting over
+RESUME_WITHIN = datetime.timedelta(hours=12)
+
+# Fetch the detail page of every new or changed event, to get its full description, exact address and schedule
+ENRICH_DETAILS = os.getenv('ENRICH_DETAILS', '').lower() in ['1', 'true', 'yes']
+
+# How many detail pages are downloaded at the same time (across all sources)
+ENRICH_CONCURRENCY = int(os.getenv('ENRICH_CONCURRENCY', 4))
+
+# Detail pages are cached on disk for this long (in seconds), so recurring events and resumed runs don't download them again
+ENRICH_CACHE_DIR = os.getenv('ENRICH_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'matsubo-details'))
+ENRICH_CACHE_TTL = int(os.getenv('ENRICH_CACHE_TTL', 24*60*60))
+
+# Full descriptions, addresses and schedules of the detail pages are cut after this many characters
+DETAILS_MAX_LENGTH = 1500
+ADDRESS_MAX_LENGTH = 200
+SCHEDULE_MAX_LENGTH = 300
+
+# Local timezone
+LOCAL_TZ = pytz.timezone('Asia/Tokyo')
+
+
+def downloadPage(url: str) -> bytes:
+    """Return html-code of a given url"""
+    from urllib.request import urlopen
     uClient = urlopen(url)
     page_html = uClient.read()
     uClient.close()
+    metrics.PAGES_FETCHED.inc(host=urlparse(url).netloc)
+    return page_html
+
+def grabPage(url: str):
+    """Return html-code of a given url as soup"""
+    from bs4 import BeautifulSoup as soup
+    return soup(downloadPage(url), "html.parser")
+
+# Limits downloads of detail pages across all sources that are scrapped in parallel
+_detail_slots = threading.BoundedSemaphore(ENRICH_CONCURRENCY)
+
+def grabDetailPage(url: str):
+    """Return html-code of the detail page of an event as soup.
+
+    Pages downloaded less than `ENRICH_CACHE_TTL` seconds ago are read from the cache in `ENRICH_CACHE_DIR`.
+    """
+    from bs4 import BeautifulSoup as soup
+    path = os.path.join(ENRICH_CACHE_DIR, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.html')
+    try:
+        if time.time() - os.path.getmtime(path) < ENRICH_CACHE_TTL:
+            with open(path, 'rb') as f:
+                page_html = f.read()
+            metrics.PAGES_CACHED.inc(host=urlparse(url).netloc)
+            return soup(page_html, "html.parser")
+    except OSError:
+        pass  # Not cached yet
+    with _detail_slots:
+        page_html = downloadPage(url)
+    try:
+        os.makedirs(ENRICH_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(page_html)
+        os.replace(tmp_path, path)  # Atomic, so other threads never read half a page
+    except OSError as e:
+        utils.print_warning(f"Could not cache detail page {url}: {e!r}")
     return soup(page_html, "html.parser")
 
+def pruneDetailCache():
+    """Deletes detail pages from the cache that are older than `ENRICH_CACHE_TTL`"""
+    if not os.path.isdir(ENRICH_CACHE_DIR):
+        return
+    for entry in os.scandir(ENRICH_CACHE_DIR):
+        try:
+            if time.time() - entry.stat().st_mtime > ENRICH_CACHE_TTL:
+                os.remove(entry.path)
+        except OSError:
+            pass  # Removed by another process in the meantime
+
 def getTCDate(date):
     """Returns date_start, date_end, date_fuzzy of Tokyo Cheapo and Japan Cheapo Events"""
+    from dateutil.parser import parse as parse_date
     # try:
     #     parse_date(date, default=datetime.datetime(1978, 1, 1, 0, 0), fuzzy_with_tokens=True)
     # except Exception:
@@ -85,6 +203,7 @@ def getTCDate(date):
 
 def getTCTime(time):
     """Returns time_start and time_end of Tokyo Cheapo and Japan Cheapo Events"""
+    from dateutil.parser import parse as parse_date
     time = time.split(" – ")
     if not time[0]:
         return '', ''
@@ -95,133 +214,514 @@ def getTCTime(time):
     return time_start, time_end
 
 
-def getEventsTC():
-    """Return events from Tokyo Cheapo"""
-    # Fetch soup from TokyoCheapo
-    url = 'https://tokyocheapo.com/events/'
-    page = grabPage(url)
+def parseCheapoPage(source:sources.Source, page, region:str) -> list[Event]:
+    """Returns events of a listing page of Tokyo Cheapo or Japan Cheapo"""
     event_soup = page.findAll("article",{"class":"article card card--event"})
     # Identify events in soup
     events = []
     for event_ in event_soup:
-        # Process date & Time
-        date=event_.findAll("div", class_="card--event__date-box")[0].div.text.strip().replace("\n"," ")
-        time=', '.join([t.parent.span.text.strip() for t in event_.findAll("div", title="Start/end time")])
-        date_start, date_end, date_fuzzy = getTCDate(date)
-        time_start, time_end = getTCTime(time)
-
-        # Create event-object
-        event = Event(
-            id='TC'+event_.findAll(attrs={"data-post-id" : True})[0]['data-post-id'].strip(),
-            name=event_.findAll("h3", class_="card__title")[0].text.strip(),
-            description=event_.findAll("p", class_="card__excerpt")[0].text.strip(),
-            url=event_.findAll("h3", class_="card__title")[0].a['href'],
-            img=event_.findAll("a",  class_="card__image")[0].img,
-            date_start=date_start,
-            date_end=date_end,
-            date_fuzzy=date_fuzzy,
-            time_start=time_start,
-            time_end=time_end,
-            location=', '.join([loc.text for loc in event_.findAll("a", class_="location")]),
-            cost=', '.join([cost.parent.text.strip() for cost in event_.findAll("div", title="Entry")]),
-            status=', '.join([stat.text.strip().lower() for stat in event_.findAll("div", class_="event-status")]),
-            visibility='Kanto',
-            source='Web:TokyoCheapo')
-        if event.img is not None: # Hotfix
-            event.img = event.img['data-src']
+        try:
+            event = parseCheapoCard(source, event_, region)
+        except Exception as e:  # One broken card should not cost the whole page
+            utils.print_warning(f"[{source}] Skipped event card that could not be parsed: {e!r}")
+            continue
         events.append(event)
     # merge duplicate events: Merge date, check by ID
     #events = mergeDuplicateEvents(events,verbose=True)
     return events
 
+def parseCheapoCard(source:sources.Source, event_, region:str) -> Event:
+    """Returns event of an event card of Tokyo Cheapo or Japan Cheapo"""
+    # Process date & Time
+    date=event_.findAll("div", class_="card--event__date-box")[0].div.text.strip().replace("\n"," ")
+    time=', '.join([t.parent.span.text.strip() for t in event_.findAll("div", title="Start/end time")])
+    date_start, date_end, date_fuzzy = getTCDate(date)
+    time_start, time_end = getTCTime(time)
+
+    # Create event-object
+    event = Event(
+        id=source.prefix+event_.findAll(attrs={"data-post-id" : True})[0]['data-post-id'].strip(),
+        name=event_.findAll("h3", class_="card__title")[0].text.strip(),
+        description=event_.findAll("p", class_="card__excerpt")[0].text.strip(),
+        url=event_.findAll("h3", class_="card__title")[0].a['href'],
+        img=event_.findAll("a",  class_="card__image")[0].img,
+        date_start=date_start,
+        date_end=date_end,
+        date_fuzzy=date_fuzzy,
+        time_start=time_start,
+        time_end=time_end,
+        location=', '.join([loc.text for loc in event_.findAll("a", class_="location")]),
+        cost=', '.join([cost.parent.text.strip() for cost in event_.findAll("div", title="Entry")]),
+        status=', '.join([stat.text.strip().lower() for stat in event_.findAll("div", class_="event-status")]),
+        visibility=[region],
+        source=source.name)
+    if event.img is not None: # Hotfix
+        event.img = event.img['data-src']
+    return event
+
+def enrichCheapoEvent(source:sources.Source, event:Event, page):
+    """Adds full description, address and schedule of the detail page of a Tokyo Cheapo or Japan Cheapo event"""
+    content = page.find("div", class_="article__content") or page.find("div", class_="entry-content") or page.find("article")
+    if content is not None:
+        paragraphs = [p.text.strip() for p in content.findAll("p") if p.text.strip()]
+        event.details = utils.shorten('\n\n'.join(paragraphs), DETAILS_MAX_LENGTH)
+    # Elements whose class merely contains 'address' may wrap whole sections of the page: only short texts are taken as address
+    addresses = page.findAll(attrs={"itemprop": "address"}) + page.findAll(class_=lambda c: c is not None and 'address' in c)
+    address = next((text for text in (' '.join(a.text.split()) for a in addresses) if 0 < len(text) <= ADDRESS_MAX_LENGTH), None)
+    if address is not None:
+        event.address = address
+    schedule = [' '.join((t.parent.span or t).text.split()) for t in page.findAll("div", title=["Date", "Dates", "Start/end time", "Opening hours"])]
+    event.schedule = utils.shorten(' | '.join(dict.fromkeys(s for s in schedule if s)), SCHEDULE_MAX_LENGTH)  # Unique, in order of appearance
+
+
+#########################
+# Sources
+#########################
+
+TOKYO_CHEAPO = sources.register(sources.Source(
+    name='Web:TokyoCheapo',
+    urls={'Kanto': ['https://tokyocheapo.com/events/']},
+    parse=parseCheapoPage,
+    refresh=SCRAP_TIMES,
+    prefix='TC',
+    page_url='{url}/page/{page}/',
+    max_pages=MAX_PAGES,
+    enrich=enrichCheapoEvent,
+    footer='TOKYO CHEAPO',
+    icon='https://community.tokyocheapo.com/uploads/db1536/original/1X/91a0a0ee35d00aaa338a0415496d40f3a5cb298e.png',
+    thumbnail='https://cdn.cheapoguides.com/wp-content/themes/cheapo_theme/assets/img/logos/tokyocheapo/logo.png'
+))
+
+JAPAN_CHEAPO_REGIONS = {
+    'Chubu': ['Niigata','Ishikawa','Fukui','Yamanashi','Nagano','Gifu','Shizuoka','Aichi'],
+    'Chugoku': ['Shimane','Okayama','Hiroshima','Yamaguchi'],
+    'Hokkaido': ['Hokkaido'],
+    'Kansai': ['Mie','Shiga','Kyoto','Osaka','Hyogo','Nara','Wakayama'], # Himeji, Kobe are also options, but are also included in Hyogo
+    'Kanto': ['Tochigi'], # Tokyo, Ibaraki, Gunma... are left out because they are published on Tokyo Cheapo
+    'Kyushu': ['Fukuoka','Saga','Nagasaki','Kumamoto','Oita','Miyazaki'],
+    'Okinawa': ['Okinawa'],
+    'Shikoku': ['Tokushima','Kagawa'],
+    'Tohoku': ['Aomori','Iwate','Miyagi','Akita','Yamagata','Fukushima'],
+    }
+
+JAPAN_CHEAPO = sources.register(sources.Source(
+    name='Web:JapanCheapo',
+    urls={region: ['https://japancheapo.com/events/location/' + prefecture.lower() for prefecture in prefectures]
+          for region, prefectures in JAPAN_CHEAPO_REGIONS.items()},
+    parse=parseCheapoPage,
+    refresh=SCRAP_TIMES,
+    prefix='JC',
+    page_url='{url}/page/{page}/',
+    max_pages=MAX_PAGES,
+    enrich=enrichCheapoEvent,
+    footer='JAPAN CHEAPO',
+    icon='https://pbs.twimg.com/profile_images/1199468429553455104/GdCZbc-R_400x400.png',
+    thumbnail='https://cdn.cheapoguides.com/wp-content/themes/cheapo_theme/assets/img/logos/japancheapo/logo.png'
+))
+
+
+#########################
+# Scrapping pipeline
+#########################
+# Events are streamed through the stages  fetch -> parse -> dedupe -> enrich -> chunked upsert.
+# Every stage is a generator with a bounded buffer, so memory stays flat no matter how many events are found,
+# the first events reach the database right after the first pages are parsed,
+# and a failure late in the run does not throw away the events that have already been ingested.
+
+def prefetch(iterable, size:int):
+    """Returns generator over `iterable` that is consumed in a background thread, at most `size` items ahead."""
+    buffer = queue.Queue(maxsize=size)
+    stopped = threading.Event()  # Set when the consumer stops early
+    done = object()
+    def put(item):
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except Exception as e:
+            put(e)
+        put(done)
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+
+class ScrapRun():
+    """
+    A scrap run of one source, journaled page by page in the database (see `database.DBScrapJournal`).
+
+    If the latest run of the source did not complete all of its URLs (e.g. because the process crashed)
+    and started less than `RESUME_WITHIN` ago, that run is resumed: URLs that have been completed and pages that have already been ingested are skipped.
+    An URL is completed once its last listing page (see `crawlPages()`) has been ingested, so a resumed run continues its pagination where it stopped.
+
+    Parameters
+    ------------
+    source: :class:`sources.Source`
+        The source that is scrapped.
+    journal: Optional[:class:`database.DBScrapJournal`]
+        The journal to record the run in, ``None`` if the run shall not be recorded (and not be resumed).
+    recorder: Optional[:class:`recorder.Recorder`]
+        Records the raw pages, timings and events of the run for replays (see `recorder.py`), ``None`` if they are not recorded.
+    """
+    def __init__(self, source:sources.Source, journal=None, recorder=None):
+        self.source = source
+        self.journal = journal
+        self.recorder = recorder
+        self.started = datetime.datetime.now(tz=LOCAL_TZ)
+        self.run_id = f"{source}@{self.started.isoformat(timespec='seconds')}"
+        self.ingested = set()  # URLs of pages whose events are in the database
+        self.completed = set()  # URLs of the source whose listing pages have all been ingested
+        self._last_pages = {}  # URLs of the source by their last listing page, until it is ingested
+        self._lock = threading.Lock()
+        latest = self._journal('getLatestRun', source.name)
+        if latest:
+            run_id, started, pages = latest
+            ingested = set(url for url, status in pages.items() if status in ['ingested', 'completed'])
+            completed = set(url for url, status in pages.items() if status == 'completed')
+            if self.started - started < RESUME_WITHIN and not set(self.getURLs()) <= completed:
+                self.run_id, self.started, self.ingested, self.completed = run_id, started, ingested, completed
+                print(f"[{source}] Resuming run {run_id}: {len(completed)} URLs are complete, {len(ingested)} pages have already been ingested")
+
+    def getURLs(self) -> list[str]:
+        return [url for urls in self.source.urls.values() for url in urls]
+
+    def mark(self, url:str, status:str, error:Exception=None):
+        """Records the status ('fetched', 'ingested', 'failed') of a page"""
+        if status == 'ingested':
+            self.ingested.add(url)
+        self._journal('markPage', self.run_id, self.source.name, url, status, self.started, repr(error) if error else None)
+        if status == 'ingested':
+            with self._lock:
+                base_url = self._last_pages.pop(url, None)
+            if base_url:
+                self.complete(base_url)
+
+    def endPagination(self, base_url:str, last_url:str):
+        """Records that `last_url` is the last listing page of an URL of the source. The URL is completed once that page has been ingested."""
+        with self._lock:
+            if last_url not in self.ingested:
+                self._last_pages[last_url] = base_url
+                return
+        self.complete(base_url)
+
+    def complete(self, base_url:str):
+        """Records that all listing pages of an URL of the source have been ingested"""
+        self.completed.add(base_url)
+        self._journal('markPage', self.run_id, self.source.name, base_url, 'completed', self.started, None)
+
+    def _journal(self, method:str, *args):
+        """Calls method of the journal. The journal is optional: if it fails, scrapping still continues."""
+        if not self.journal:
+            return None
+        try:
+            return getattr(self.journal, method)(*args)
+        except Exception as e:
+            utils.print_warning(f"[{self.source}] Scrap journal is unavailable: {e!r}")
+            return None
+
+def fetchPage(url:str) -> bytes:
+    """Returns html-code of the page. Retries `PAGE_RETRIES` times, and waits longer after every failed attempt."""
+    for attempt in range(PAGE_RETRIES):
+        try:
+            return downloadPage(url)
+        except HTTPError as e:
+            if e.code == 404 or attempt == PAGE_RETRIES-1:  # Missing pages won't appear by retrying
+                raise
+        except Exception:
+            if attempt == PAGE_RETRIES-1:
+                raise
+            time.sleep(PAGE_RETRY_DELAY * 2**attempt)
+
+def crawlPages(run:ScrapRun):
+    """[Stage] Yields (url, events) of all listing pages of a source that still need to be ingested in this run.
+
+    Follows the listing pages of every URL of the source (up to `Source.max_pages`), and stops early at the first page
+    that has no events, or whose events are all already in the database with the same content.
+    Where the pagination of an URL ends is recorded in the run, so a resumed run skips the URLs that are complete (see `ScrapRun`).
+    Downloads and parses up to `PREFETCH_PAGES` pages ahead. Pages that fail are recorded and skipped.
+    If the run has a recorder, every downloaded page is recorded with its timings and events.
+    """
+    from bs4 import BeautifulSoup as soup
+    def crawl():
+        for region, urls in run.source.urls.items():
+            for base_url in urls:
+                if base_url in run.completed:
+                    continue
+                last_url = None
+                for page_number in range(1, run.source.max_pages+1):
+                    url = run.source.getPageURL(base_url, page_number)
+                    if url in run.ingested:
+                        last_url = url
+                        continue
+                    start = time.perf_counter()
+                    try:
+                        page_html = fetchPage(url)
+                    except HTTPError as e:
+                        if e.code == 404 and page_number > 1:  # Last listing page has been passed
+                            run.endPagination(base_url, last_url)
+                            break
+                        utils.print_warning(f"[{run.source}] Failed to fetch {url}: {e!r}")
+                        run.mark(url, 'failed', e)
+                        break
+                    except Exception as e:
+                        utils.print_warning(f"[{run.source}] Failed to fetch {url}: {e!r}")
+                        run.mark(url, 'failed', e)
+                        break  # Further pages can't be found reliably without this one
+                    run.mark(url, 'fetched')
+                    fetched = time.perf_counter()
+                    try:
+                        events = run.source.parse(run.source, soup(page_html, "html.parser"), region)
+                    except Exception as e:
+                        utils.print_warning(f"[{run.source}] Failed to parse {url}: {e!r}")
+                        if run.recorder:
+                            run.recorder.addPage(url, region, page_html, fetched-start, time.perf_counter()-fetched, error=e)
+                        run.mark(url, 'failed', e)
+                        break
+                    if run.recorder:
+                        run.recorder.addPage(url, region, page_html, fetched-start, time.perf_counter()-fetched, events)
+                    yield url, events
+                    last_url = url
+                    if page_number < run.source.max_pages and isKnown(events):
+                        run.endPagination(base_url, last_url)
+                        break
+                else:
+                    run.endPagination(base_url, last_url)
+    return prefetch(crawl(), PREFETCH_PAGES)
+
+def getChangedEvents(events:list[Event]) -> list[Event]:
+    """Returns the events that are not in the database yet, or whose content has changed. All events, if the database can't be reached."""
+    if not events:
+        return []
+    try:
+        hashes = database.eventDB.getHashes(events)
+    except Exception as e:
+        utils.print_warning(f"Could not look up known events: {e!r}")
+        return events
+    return [event for event in events if hashes.get((event.id, event.date_start)) != event.getHash()]
+
+def isKnown(events:list[Event]) -> bool:
+    """Returns `True` if there are no events, or all of them are already in the database with the same content"""
+    return not getChangedEvents(events)
+
+def dedupeEvents(pages):
+    """[Stage] Yields (url, events) of the given pages, but drops events that have already been yielded (same ID and start date).
+
+    An event listed in several regions (e.g. on the border of two prefectures) is made visible in all of them:
+    the event yielded first gets the new region, and is yielded again so the region is ingested as well.
+    """
+    seen = {}
+    for url, events in pages:
+        unique = []
+        for event in events:
+            key = (event.id, event.date_start)
+            if key not in seen:
+                seen[key] = event
+                unique.append(event)
+            elif not set(event.visibility) <= set(seen[key].visibility):
+                seen[key].addVisibility(event.visibility)
+                unique.append(seen[key])
+        yield url, unique
+
+def enrichEvent(source:sources.Source, event:Event) -> Event:
+    """Adds the details of its detail page to the event. If that fails, the event is left as it is."""
+    if not event.url:
+        return event
+    try:
+        source.enrich(source, event, grabDetailPage(event.url))
+    except Exception as e:
+        utils.print_warning(f"[{source}] Could not enrich event {event.id} from {event.url}: {e!r}")
+    return event
+
+def enrichPages(run:ScrapRun, pages):
+    """[Stage] Yields (url, events) of the given pages, with details of the detail page added to every new or changed event.
+
+    Only runs if `ENRICH_DETAILS` is set and the source has detail pages (see `Source.enrich`).
+    Unchanged events are passed through as they are, since their details are already in the database.
+    Detail pages are downloaded in parallel, but at most `ENRICH_CONCURRENCY` at the same time across all sources.
+    """
+    if not (ENRICH_DETAILS and run.source.enrich):
+        yield from pages
+        return
+    with ThreadPoolExecutor(max_workers=ENRICH_CONCURRENCY) as executor:
+        for url, events in pages:
+            list(executor.map(lambda event: enrichEvent(run.source, event), getChangedEvents(events)))
+            yield url, events
+
+def streamSource(run:ScrapRun):
+    """Yields (url, events) of every page of the source of the run, as soon as the page is parsed"""
+    return enrichPages(run, dedupeEvents(crawlPages(run)))
+
+def ingestPages(run:ScrapRun, pages, chunk_size:int=INGEST_CHUNK_SIZE, publish:bool=False) -> tuple[int,list[str]]:
+    """[Stage] Upserts events of the given pages into the database in chunks of `chunk_size`.
+
+    Before a chunk is upserted, its events are merged with duplicate listings among them and in the database (see `dedupe.py`).
+    Listings merged into another one are not stored as events, but as aliases of it, with their content hash and regions.
+    Duplicates are blocked by start date, so only events of the same days are loaded from the database.
+    A page is recorded as ingested once all of its events are in the database.
+    The image URLs of every chunk are checked before it is published, so the bot knows which images it can show (see `images.py`).
+    Returns the number of ingested events, and the IDs of new or changed events.
+    If flag `publish` is set to `True`, the IDs of every chunk are also published to everyone listening on `DBEvent.CHANNEL`.
+    """
+    count = 0
+    changed = []
+    chunk = []
+    completed = []  # Pages whose events are all in the current chunk (or in previous ones)
+    def flush():
+        dates = [event.date_start for event in chunk]
+        events, stale, aliases = dedupe.mergeDuplicates(chunk, database.eventDB.getEventsOn(dates), database.eventDB.getAliasesOn(dates))
+        if stale:
+            database.eventDB.deleteEvents(stale)
+            print(f"[{run.source}] Merged {len(stale)} duplicate events of the database into other listings")
+        ids = database.eventDB.insertEvents(events)
+        database.eventDB.updateAliases(aliases)  # Merged listings stay known, so they are not scrapped as new events again (see `getChangedEvents()`)
+        try:
+            images.validateImages([event.img for event in events])
+        except Exception as e:  # Without checks, images are shown as they are
+            utils.print_warning(f"[{run.source}] Could not check images: {e!r}")
+        if publish and ids:
+            database.eventDB.publishChanges(ids)
+        changed.extend(ids)
+        for url in completed:
+            run.mark(url, 'ingested')
+        chunk.clear()
+        completed.clear()
+    for url, events in pages:
+        for event in events:
+            chunk.append(event)
+            count += 1
+            if len(chunk) >= chunk_size:
+                flush()
+        completed.append(url)
+    flush()
+    return count, changed
+
+def scrapSource(source:sources.Source, publish:bool=False) -> list[str]:
+    """Scraps all pages of a source and streams its events into the database. Returns IDs of new or changed events.
+
+    The run is journaled, so if it crashes, the next run resumes where it stopped.
+    If `recorder.SCRAP_RECORD_DIR` is set, the run is also recorded, so it can be replayed offline (see `recorder.py`).
+    A source is only scrapped by one process at a time: if it is already being scrapped (e.g. by the scrapper worker), nothing is done.
+    """
+    start = time.perf_counter()
+    with jobs.lock(f'scrap:{source}') as acquired:
+        if not acquired:
+            print(f"[{source}] Skipped: the source is already being scrapped, or its lock could not be acquired")
+            return []
+        run = ScrapRun(source, journal=database.journalDB)
+        with recorder.record(source, run.run_id) as rec:
+            run.recorder = rec
+            count, changed = ingestPages(run, streamSource(run), publish=publish)
+    missing = len(set(run.getURLs()) - run.completed)
+    print(f"[{source}] Ingested {count} events ({len(changed)} new or changed) in {time.perf_counter()-start:.1f}s" + (f", {missing} URLs are incomplete" if missing else ''))
+    return changed
+
+def getEventsOf(source:sources.Source) -> list[Event]:
+    """Return events of a source, without putting them into the database"""
+    return [event for url, events in streamSource(ScrapRun(source)) for event in events]
+
+def getEventsTC():
+    """Return events from Tokyo Cheapo"""
+    return getEventsOf(TOKYO_CHEAPO)
+
 def getEventsJC():
     """Return events from Japan Cheapo"""
-    regions = {
-        'Chubu': ['Niigata','Ishikawa','Fukui','Yamanashi','Nagano','Gifu','Shizuoka','Aichi'],
-        'Chugoku': ['Shimane','Okayama','Hiroshima','Yamaguchi'],
-        'Hokkaido': ['Hokkaido'],
-        'Kansai': ['Mie','Shiga','Kyoto','Osaka','Hyogo','Nara','Wakayama'], # Himeji, Kobe are also options, but are also included in Hyogo
-        'Kanto': ['Tochigi'], # Tokyo, Ibaraki, Gunma... are left out because they are published on Tokyo Cheapo
-        'Kyushu': ['Fukuoka','Saga','Nagasaki','Kumamoto','Oita','Miyazaki'],
-        'Okinawa': ['Okinawa'],
-        'Shikoku': ['Tokushima','Kagawa'],
-        'Tohoku': ['Aomori','Iwate','Miyagi','Akita','Yamagata','Fukushima'],
-        }
-    # setup toolbar
-    WIDTH_PROGRESSBAR = len(regions)
-    sys.stdout.write("Progress: [%s]" % (" " * len(regions)))
-    sys.stdout.flush()
-    sys.stdout.write("\b" * (len(regions)+1)) # return to start of line, after '['
-    # Crawl events
-    events = []
-    for i, region in enumerate(regions):
-        for prefecture in regions[region]:
-            # Fetch soup from JapanCheapo
-            url = 'https://japancheapo.com/events/location/' + prefecture.lower()
-            page = grabPage(url)
-            event_soup = page.findAll("article",{"class":"article card card--event"})
-            # Identify events in soup
-            prefecture_events = []
-            for event_ in event_soup:
-                # Process date & Time
-                date=event_.findAll("div", class_="card--event__date-box")[0].div.text.strip().replace("\n"," ")
-                time=', '.join([t.parent.span.text.strip() for t in event_.findAll("div", title="Start/end time")])
-                date_start, date_end, date_fuzzy = getTCDate(date)
-                time_start, time_end = getTCTime(time)
-
-                # Create event-object
-                event = Event(
-                    id='JC'+event_.findAll(attrs={"data-post-id" : True})[0]['data-post-id'].strip(),
-                    name=event_.findAll("h3", class_="card__title")[0].text.strip(),
-                    description=event_.findAll("p", class_="card__excerpt")[0].text.strip(),
-                    url=event_.findAll("h3", class_="card__title")[0].a['href'],
-                    img=event_.findAll("a",  class_="card__image")[0].img,
-                    date_start=date_start,
-                    date_end=date_end,
-                    date_fuzzy=date_fuzzy,
-                    time_start=time_start,
-                    time_end=time_end,
-                    location=', '.join([loc.text for loc in event_.findAll("a", class_="location")]),
-                    cost=', '.join([cost.parent.text.strip() for cost in event_.findAll("div", title="Entry")]),
-                    status=', '.join([stat.text.strip().lower() for stat in event_.findAll("div", class_="event-status")]),
-                    visibility=region,
-                    source='Web:JapanCheapo')
-                if event.img is not None: # Hotfix
-                    event.img = event.img['data-src']
-                prefecture_events.append(event)
-            # merge duplicate events: Merge date, check by ID
-            #prefecture_events = mergeDuplicateEvents(prefecture_events)
-            events.extend(prefecture_events)
-        # Update progressbar
-        sys.stdout.write("-")
-        sys.stdout.flush()
-    # merge duplicate events: Merge date, check by ID
-    #events = mergeDuplicateEvents(events,verbose=True)
-    sys.stdout.write("]\n") # this ends the progress bar
-    return events
+    return getEventsOf(JAPAN_CHEAPO)
+
+def getEvents(source_names:list[str]=None) -> list[Event]:
+    """Scraps the given event sources (default: all sources) in parallel. Returns list of scrapped events.
 
-def getEvents() -> list[Event]:
-    """Scraps all event sources. Returns list of scrapped events."""
+    Holds all events in memory. To put events into the database, prefer the streaming `scrapEvents()`.
+    """
     events  = []
-    events += getEventsTC()
-    events += getEventsJC()
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_SOURCES) as executor:
+        for source_events in executor.map(getEventsOf, sources.getSources(source_names)):
+            events += source_events
 
     # Print events
     # print("Found the following events:")
     # for event in events:
     #    print(event)
 
-    # TODO: In JapanCheapo, a few events might happen on the border of 2 cities and are thus seen in both cities/categories/visibility. Merge these events before
-    events = mergeDuplicateEvents(events)
+    # Events on the border of 2 prefectures, or listed by several sources, are merged into one event visible in all their regions
+    events, _, _ = dedupe.mergeDuplicates(events)
     return events
 
+def scrapEvents(source_names:list[str]=None, publish:bool=False) -> list[str]:
+    """Scraps the given event sources (default: all sources) in parallel, and streams the events into the database. Returns IDs of new or changed events.
+
+    If flag `publish` is set to `True`, the IDs are also published to everyone listening on `DBEvent.CHANNEL`.
+    Afterwards, the snapshot of all upcoming events is written (see `snapshot.py`), so the bot can read them without the database.
+    """
+    changed = []
+    if ENRICH_DETAILS:
+        pruneDetailCache()
+    try:
+        database.journalDB.prune()
+    except Exception as e:  # The journal is optional, see `ScrapRun`
+        utils.print_warning(f"Could not prune scrap journal: {e!r}")
+    with metrics.SCRAP_DURATION.time():
+        with ThreadPoolExecutor(max_workers=MAX_PARALLEL_SOURCES) as executor:
+            for source_changed in executor.map(lambda source: scrapSource(source, publish), sources.getSources(source_names)):
+                changed += source_changed
+    print(f"Scrapping finished: {len(changed)} events are new or have changed.")
+    if snapshot.SNAPSHOT_PATH:
+        try:
+            snapshot.update(datetime.datetime.now(tz=LOCAL_TZ).date())
+        except Exception as e:  # Without a fresh snapshot, the bot reads events from the database
+            utils.print_warning(f"Could not write event snapshot: {e!r}")
+    return changed
+
+def runWorker(scrap_now:bool=False):
+    """Runs the scrapper as standalone worker process. Blocks forever.
+
+    Every source is scrapped in parallel at its own refresh times, and all changes are published to the bot.
+    Slots missed during a restart are caught up (see `jobs.addJob()`).
+    If flag `scrap_now` is set to `True`, it also scraps once right at the start.
+    """
+    from apscheduler.schedulers.blocking import BlockingScheduler
+    from apscheduler.triggers.cron import CronTrigger
+
+    scheduler = BlockingScheduler()
+    for source in sources.getSources():
+        trigger = CronTrigger.from_crontab(source.refresh, timezone=LOCAL_TZ)
+        jobs.addJob(scheduler, scrapEvents, trigger, kwargs={'source_names': [source.name], 'publish': True}, id=f'scrap:{source}')
+        if scrap_now:
+            scheduler.add_job(scrapEvents, kwargs={'source_names': [source.name], 'publish': True}, id=f'scrap_now:{source}')
+        print(f"Scrapping {source} at '{source.refresh}' ({LOCAL_TZ}).")
+    jobs.addJob(scheduler, database.eventDB.archivePartitions, CronTrigger.from_crontab(ARCHIVE_TIMES, timezone=LOCAL_TZ), id='archive')
+    print(f"Started scrapper worker.")
+    scheduler.start()
+
 
 # START OF PROGRAM
 if __name__ == "__main__":
-    # Crawl events
-    events = getEvents()
-    database.eventDB.insertEvents(events)
-    
+    args = sys.argv[1:]
+    if 'worker' in args:
+        runWorker(scrap_now='now' in args)
+    elif 'replay' in args:
+        # Replay recorded runs through the current parsers. Fails if any of them parses other events than recorded.
+        reports = [recorder.replay(path) for path in args[args.index('replay')+1:]]
+        for report in reports:
+            recorder.printReport(report)
+        sys.exit(1 if any(recorder.isRegression(report) for report in reports) else 0)
+    else:
+        # Crawl events
+        scrapEvents(publish='publish' in args)
 
 
 # TODO:
@@ -0,0 +1,146 @@
+"""iCalendar export
+
+Writes events into `.ics` files (RFC 5545), so they can be subscribed to in any calendar app.
+
+Events are streamed from the database straight into the file (see `database.DBEvent.iterEvents()`), so memory stays constant whatever the number of events.
+Files are cached in `ICS_CACHE_DIR` per set of topics, and only written again after events have changed.
+"""
+
+import os
+import re
+import uuid
+import hashlib
+import datetime
+import tempfile
+import threading
+import pytz
+
+from . import database
+from . import utils
+from .event import Event
+
+
+#########################
+# Global variables
+#########################
+
+# Where the calendars are cached
+ICS_CACHE_DIR = os.getenv('ICS_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'matsubo-ics'))
+
+# Times of events are in Japan time
+LOCAL_TZ = pytz.timezone('Asia/Tokyo')
+
+# Product identifier of the calendars
+PRODID = '-//Matsubo//Events//EN'
+
+# Lines of iCalendar files are folded after this many octets
+LINE_LENGTH = 75
+
+# Calendars are written by only one thread at a time
+_write_lock = threading.Lock()
+
+
+#########################
+# Functions
+#########################
+
+def escape(text:str) -> str:
+    """Returns text escaped for a value of a property"""
+    return re.sub(r'([\\;,])', r'\\\1', str(text or '')).replace('\r\n', '\n').replace('\n', '\\n')
+
+def fold(line:str) -> bytes:
+    """Returns a content line, folded into lines of at most `LINE_LENGTH` octets (without splitting UTF-8 characters)"""
+    data = line.encode('utf-8')
+    lines = []
+    while len(data) > LINE_LENGTH:
+        cut = LINE_LENGTH if not lines else LINE_LENGTH - 1  # Continuation lines start with a space
+        while cut and (data[cut] & 0xC0) == 0x80:  # Do not cut in the middle of a character
+            cut -= 1
+        lines.append(data[:cut])
+        data = data[cut:]
+    lines.append(data)
+    return b'\r\n '.join(lines) + b'\r\n'
+
+def getEventLines(event:Event, stamp:datetime.datetime) -> list[str]:
+    """Returns the content lines of the VEVENT of an event.
+
+    Events of a single day with a start time are timed events, all others are all-day events spanning from `date_start` to `date_end`.
+    """
+    def utc(date, time):
+        start = datetime.datetime.combine(date, time)
+        start = start.astimezone(datetime.timezone.utc) if start.tzinfo else LOCAL_TZ.localize(start).astimezone(datetime.timezone.utc)
+        return start.strftime('%Y%m%dT%H%M%SZ')
+    date_end = max(event.date_end or event.date_start, event.date_start)
+    lines = ['BEGIN:VEVENT',
+             f"UID:{event.id}-{event.date_start:%Y%m%d}@matsubo",
+             f"DTSTAMP:{stamp:%Y%m%dT%H%M%SZ}"]
+    if event.time_start and date_end == event.date_start:
+        lines.append(f"DTSTART:{utc(event.date_start, event.time_start)}")
+        if event.time_end and event.time_end > event.time_start:
+            lines.append(f"DTEND:{utc(event.date_start, event.time_end)}")
+    else:
+        lines.append(f"DTSTART;VALUE=DATE:{event.date_start:%Y%m%d}")
+        lines.append(f"DTEND;VALUE=DATE:{date_end + datetime.timedelta(days=1):%Y%m%d}")  # The end of all-day events is exclusive
+    lines.append(f"SUMMARY:{escape(event.name)}")
+    description = '\n\n'.join(text for text in [event.details or event.description, event.schedule, event.getTimeRange() if event.time_start else '', event.url] if text)
+    lines.append(f"DESCRIPTION:{escape(description)}")
+    if event.address or event.location:
+        lines.append(f"LOCATION:{escape(event.address or event.location)}")
+    if event.url:
+        lines.append(f"URL:{event.url}")
+    if event.visibility:
+        lines.append(f"CATEGORIES:{','.join(escape(region) for region in event.visibility)}")
+    if event.status.lower() in ['cancelled', 'canceled']:
+        lines.append('STATUS:CANCELLED')
+    lines.append('END:VEVENT')
+    return lines
+
+def writeCalendar(file, events, name:str='Matsubo') -> int:
+    """Writes the events into an open binary file as iCalendar. Events are written one by one while iterating. Returns number of events."""
+    stamp = datetime.datetime.now(tz=datetime.timezone.utc)
+    for line in ['BEGIN:VCALENDAR', 'VERSION:2.0', f"PRODID:{PRODID}", 'CALSCALE:GREGORIAN', f"X-WR-CALNAME:{escape(name)}", 'X-WR-TIMEZONE:Asia/Tokyo']:
+        file.write(fold(line))
+    count = 0
+    for event in events:
+        if not event.date_start:
+            continue  # Events with fuzzy dates can't be put in a calendar
+        for line in getEventLines(event, stamp):
+            file.write(fold(line))
+        count += 1
+    file.write(fold('END:VCALENDAR'))
+    return count
+
+def getCalendar(topics:list[str]) -> str:
+    """Returns path to the calendar of all events of the given topics.
+
+    The calendar is only written if events have changed since it was cached (see `database.DBEvent.getVersion()`).
+    Looking up the version is a single cheap query, so repeated requests only cost a file lookup.
+    If the version can't be looked up, the calendar is written anew instead of reusing a cached one.
+    """
+    topics = sorted(set(topics))
+    key = hashlib.sha1(','.join(topics).encode('utf-8')).hexdigest()[:16]
+    try:
+        version = hashlib.sha1(repr(database.eventDB.getVersion()).encode('utf-8')).hexdigest()[:16]
+    except Exception as e:
+        utils.print_warning(f"Could not look up version of events, writing calendar of {topics} anew: {e!r}")
+        version = f"uncached{uuid.uuid4().hex[:8]}"
+    path = os.path.join(ICS_CACHE_DIR, f"{key}-{version}.ics")
+    if os.path.exists(path):
+        return path
+    with _write_lock:
+        if os.path.exists(path):  # Written by another thread in the meantime
+            return path
+        os.makedirs(ICS_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            count = writeCalendar(f, database.eventDB.iterEvents(topics), name=f"Matsubo: {', '.join(topics)}")
+        os.replace(tmp_path, path)  # Atomic, so nobody reads half a calendar
+        # Remove outdated calendars of the same topics
+        for entry in os.scandir(ICS_CACHE_DIR):
+            if entry.name.startswith(f"{key}-") and entry.path != path:
+                try:
+                    os.remove(entry.path)
+                except OSError as e:
+                    utils.print_warning(f"Could not remove outdated calendar {entry.name}: {e!r}")
+    print(f"[INFO] wrote calendar of {topics} with {count} events")
+    return path
@@ -0,0 +1,106 @@
+"""Images
+
+Validates the image URLs of events before they are used in discord embeds.
+
+The scrapper takes image URLs straight from the lazy-loading markup of the websites, so some of them are broken or huge.
+After events are ingested, their image URLs are checked with concurrent `HEAD` requests,
+and the results (reachability, content type, size) are saved in the database for `IMAGE_CHECK_TTL`.
+When posting, the bot only looks up these results, and drops images that can't be shown, without any request of its own.
+"""
+
+import os
+import asyncio
+import datetime
+
+from . import database
+from . import utils
+
+
+#########################
+# Global variables
+#########################
+
+# How many image URLs are checked at the same time
+IMAGE_CHECK_CONCURRENCY = int(os.getenv('IMAGE_CHECK_CONCURRENCY', 8))
+
+# How long the check of an image URL is valid (in hours)
+IMAGE_CHECK_TTL = datetime.timedelta(hours=float(os.getenv('IMAGE_CHECK_TTL', 7*24)))
+
+# Timeout of a single check (in seconds)
+IMAGE_CHECK_TIMEOUT = 10
+
+# Images larger than this (in bytes) are not shown in embeds
+IMAGE_MAX_SIZE = int(os.getenv('IMAGE_MAX_SIZE', 8*1024*1024))
+
+
+#########################
+# Functions
+#########################
+
+async def checkImage(session:'aiohttp.ClientSession', url:str) -> tuple[str,bool,int,str,int]:
+    """Returns (url, reachable, status, content_type, size) of an image URL"""
+    import aiohttp
+    try:
+        async with session.head(url, allow_redirects=True) as response:
+            status, headers = response.status, response.headers
+        if status in [403, 405]:  # Some servers do not allow HEAD. Only read the headers of a GET.
+            async with session.get(url, allow_redirects=True) as response:
+                status, headers = response.status, response.headers
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        return url, False, None, None, None
+    size = headers.get('Content-Length')
+    size = int(size) if size and size.isdigit() else None
+    content_type = headers.get('Content-Type', '').split(';')[0].strip() or None
+    return url, 200 <= status < 300, status, content_type, size
+
+async def checkImages(urls:list[str], concurrency:int=IMAGE_CHECK_CONCURRENCY) -> list[tuple[str,bool,int,str,int]]:
+    """Checks the given image URLs, at most `concurrency` at the same time. Returns a check per URL (see `checkImage()`).
+
+    aiohttp is only imported here, so importing this module (e.g. by the scrapper) does not load the network stack.
+    """
+    import aiohttp
+    semaphore = asyncio.Semaphore(concurrency)
+    async def limited(session, url):
+        async with semaphore:
+            return await checkImage(session, url)
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=IMAGE_CHECK_TIMEOUT)) as session:
+        return await asyncio.gather(*[limited(session, url) for url in urls])
+
+def validateImages(urls:list[str]) -> int:
+    """Checks all image URLs that have not been checked within `IMAGE_CHECK_TTL`, and saves the results. Returns number of checked URLs.
+
+    Blocks until all checks are done. Call it from a scrapper thread, not from the event loop of the bot.
+    """
+    urls = database.imageDB.getUnchecked(urls, IMAGE_CHECK_TTL)
+    if not urls:
+        return 0
+    checks = asyncio.run(checkImages(urls))
+    database.imageDB.saveChecks(checks)
+    broken = sum(1 for url, reachable, status, content_type, size in checks if not isUsable(reachable, content_type, size))
+    if broken:
+        utils.print_warning(f"{broken} of {len(checks)} checked images can't be shown in embeds")
+    return len(checks)
+
+def isUsable(reachable:bool, content_type:str, size:int) -> bool:
+    """Returns `True` if an image of the given check can be shown in an embed"""
+    if not reachable:
+        return False
+    if content_type and not content_type.startswith('image/'):
+        return False
+    return not (size and size > IMAGE_MAX_SIZE)
+
+def dropBrokenImages(events:list) -> list:
+    """Removes images that can't be shown in embeds from the given events (by their saved checks). Returns the events.
+
+    Images that have not been checked yet are kept. If the checks can't be looked up, all images are kept.
+    """
+    try:
+        checks = database.imageDB.getChecks([event.img for event in events])
+    except Exception as e:
+        utils.print_warning(f"Could not look up checks of images: {e!r}")
+        return events
+    for event in events:
+        check = checks.get(event.img)
+        if check and not isUsable(*check):
+            event.img = ''
+    return events
@@ -0,0 +1,189 @@
+"""Jobs
+
+Scheduled jobs that run exactly once per time slot, across restarts and across several processes (bot, shards, scrapper worker).
+
+The jobs themselves live in the scheduler of each process (APScheduler), but every run is recorded in the database (`database.DBJobRun`):
+- Before a job runs, it claims the slot it was scheduled for (e.g. today 15:00). If another process has claimed it already, the run is skipped.
+- Missed runs are coalesced into one, and a run that is late by more than `JOB_MISFIRE_GRACE` seconds is skipped.
+- When a job is scheduled, the latest slot within `JOB_MISFIRE_GRACE` is caught up, if no one has run it yet. So a restart at 14:59 does not skip the scrap at 15:00.
+- A slot that is still running after `JOB_STALE_AFTER` belongs to a process that died, and can be claimed again.
+- If the database fails while a slot is claimed, claiming is retried with backoff until the run would be late by more than `JOB_MISFIRE_GRACE`.
+"""
+
+import os
+import time
+import socket
+import asyncio
+import datetime
+
+from functools import wraps
+
+from . import database
+from . import utils
+
+
+#########################
+# Global variables
+#########################
+
+# How late (in seconds) a run may start, e.g. after a restart. Later runs are skipped until the next slot.
+JOB_MISFIRE_GRACE = int(os.getenv('JOB_MISFIRE_GRACE', 60*60))
+
+# Delay (in seconds) before claiming a slot is retried, if the database failed. It doubles with every attempt, up to `JOB_CLAIM_RETRY_MAX`.
+JOB_CLAIM_RETRY = float(os.getenv('JOB_CLAIM_RETRY', 5))
+JOB_CLAIM_RETRY_MAX = 5*60
+
+# Runs that have not finished after this long are considered dead, and their slot can be claimed again
+JOB_STALE_AFTER = datetime.timedelta(hours=float(os.getenv('JOB_STALE_AFTER', 3)))
+
+# Identifies this process in the database
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+# Slot of locks (see `lock()`): they are not bound to a time
+LOCK_SLOT = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+#########################
+# Functions
+#########################
+
+def getSlot(trigger, now:datetime.datetime=None) -> datetime.datetime:
+    """Returns the latest fire time of the trigger within the last `JOB_MISFIRE_GRACE` seconds, ``None`` if there is none"""
+    now = now or datetime.datetime.now(tz=getattr(trigger, 'timezone', datetime.timezone.utc))  # Date triggers have no timezone of their own
+    slot = None
+    fire_time = trigger.get_next_fire_time(None, now - datetime.timedelta(seconds=JOB_MISFIRE_GRACE))
+    while fire_time and fire_time <= now:
+        slot = fire_time
+        fire_time = trigger.get_next_fire_time(fire_time, fire_time + datetime.timedelta(microseconds=1))
+    return slot
+
+def getRetryDelays(slot:datetime.datetime):
+    """Yields the delays (in seconds) between attempts to claim the slot: doubling from `JOB_CLAIM_RETRY`, until the slot is late by `JOB_MISFIRE_GRACE`"""
+    deadline = slot + datetime.timedelta(seconds=JOB_MISFIRE_GRACE)
+    delay = JOB_CLAIM_RETRY
+    while True:
+        remaining = (deadline - datetime.datetime.now(tz=datetime.timezone.utc)).total_seconds()
+        if remaining <= 0:
+            return
+        yield min(delay, remaining)
+        delay = min(delay * 2, JOB_CLAIM_RETRY_MAX)
+
+def claim(lock_id:str, slot:datetime.datetime, reclaim_done:bool=False) -> bool:
+    """Claims the slot for this process. Returns `True` if the job shall run, `False` if the slot is taken. Errors of the database are raised."""
+    return database.jobDB.claimSlot(lock_id, slot, OWNER, JOB_STALE_AFTER, reclaim_done=reclaim_done)
+
+def claimRetrying(lock_id:str, slot:datetime.datetime) -> bool:
+    """Claims the slot for this process (see `claim()`). While the database fails, claiming is retried (see `getRetryDelays()`); the last error is raised."""
+    delays = getRetryDelays(slot)
+    while True:
+        try:
+            return claim(lock_id, slot)
+        except Exception as e:
+            delay = next(delays, None)
+            if delay is None:
+                raise
+            utils.print_warning(f"[{lock_id}] Could not claim slot {slot}, retrying in {delay:.0f}s: {e!r}")
+            time.sleep(delay)
+
+async def claimRetryingAsync(lock_id:str, slot:datetime.datetime) -> bool:
+    """Like `claimRetrying()`, but waits without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    delays = getRetryDelays(slot)
+    while True:
+        try:
+            return await loop.run_in_executor(None, claim, lock_id, slot)
+        except Exception as e:
+            delay = next(delays, None)
+            if delay is None:
+                raise
+            utils.print_warning(f"[{lock_id}] Could not claim slot {slot}, retrying in {delay:.0f}s: {e!r}")
+            await asyncio.sleep(delay)
+
+def finish(lock_id:str, slot:datetime.datetime, ok:bool):
+    """Records the result of the run of a slot"""
+    try:
+        database.jobDB.finishSlot(lock_id, slot, OWNER, 'done' if ok else 'failed')
+    except Exception as e:
+        utils.print_warning(f"[{lock_id}] Could not record the end of slot {slot}: {e!r}")
+
+def exclusive(lock_id:str, trigger, func):
+    """Wrapper. The returned function runs `func` only if the current slot of the trigger can be claimed (see `claim()`)."""
+    if asyncio.iscoroutinefunction(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            slot = getSlot(trigger)
+            try:
+                claimed = slot is not None and await claimRetryingAsync(lock_id, slot)
+            except Exception as e:
+                utils.print_warning(f"[{lock_id}] Skipped: could not claim slot {slot}, the database failed until the run was too late: {e!r}")
+                return None
+            if not claimed:
+                print(f"[{lock_id}] Skipped: slot {slot} has already been run, or is running elsewhere")
+                return None
+            ok = False
+            try:
+                result = await func(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                await loop.run_in_executor(None, finish, lock_id, slot, ok)
+    else:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            slot = getSlot(trigger)
+            try:
+                claimed = slot is not None and claimRetrying(lock_id, slot)
+            except Exception as e:
+                utils.print_warning(f"[{lock_id}] Skipped: could not claim slot {slot}, the database failed until the run was too late: {e!r}")
+                return None
+            if not claimed:
+                print(f"[{lock_id}] Skipped: slot {slot} has already been run, or is running elsewhere")
+                return None
+            ok = False
+            try:
+                result = func(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                finish(lock_id, slot, ok)
+    return wrapper
+
+def addJob(scheduler, func, trigger, id:str, lock_id:str=None, args:list=None, kwargs:dict=None, replace_existing:bool=False) -> list[str]:
+    """Schedules a job that runs once per slot of the trigger, in only one process. Returns IDs of the scheduled jobs.
+
+    Processes that share the slots of a job use the same `lock_id` (default: `id`).
+    If the latest slot within `JOB_MISFIRE_GRACE` has not been run by anyone, it is caught up right away.
+    """
+    wrapper = exclusive(lock_id or id, trigger, func)
+    options = dict(args=args, kwargs=kwargs, coalesce=True, max_instances=1, misfire_grace_time=JOB_MISFIRE_GRACE, replace_existing=replace_existing)
+    scheduler.add_job(wrapper, trigger, id=id, **options)
+    job_ids = [id]
+    if getSlot(trigger) is not None:  # Claiming the slot decides whether it has already been run
+        scheduler.add_job(wrapper, id=f"{id}:catchup", **options)
+        job_ids.append(f"{id}:catchup")
+    return job_ids
+
+class lock():
+    """
+    Context manager. Lock shared by all processes that use the same database, e.g. so a source is not scrapped twice at the same time.
+
+    with jobs.lock('scrap:Web:TokyoCheapo') as acquired:
+        if acquired:
+            # do something
+
+    A lock that is held longer than `JOB_STALE_AFTER` is considered dead, and can be acquired again.
+    If the database fails, the lock is not acquired.
+    """
+    def __init__(self, lock_id:str):
+        self.lock_id = f"lock:{lock_id}"
+        self.acquired = False
+    def __enter__(self) -> bool:
+        try:
+            self.acquired = claim(self.lock_id, LOCK_SLOT, reclaim_done=True)
+        except Exception as e:
+            utils.print_warning(f"[{self.lock_id}] Could not acquire lock, the database failed: {e!r}")
+        return self.acquired
+    def __exit__(self, type, value, traceback):
+        if self.acquired:
+            finish(self.lock_id, LOCK_SLOT, type is None)
@@ -0,0 +1,262 @@
+"""Metrics
+
+Lightweight Prometheus-style metrics of the bot process, served by a small built-in HTTP endpoint.
+
+The endpoint runs in its own thread, so it still answers when the asyncio event loop is blocked:
+- `/metrics` returns all metrics in the Prometheus text exposition format
+- `/health`  is a liveness check. It fails (HTTP 503) when the event loop has not ticked for `LOOP_BLOCKED_AFTER` seconds
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+
+from functools import wraps
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+#########################
+# Global variables
+#########################
+
+# Address of the metrics endpoint. Set `METRICS_PORT=0` to disable it.
+METRICS_HOST = os.getenv('METRICS_HOST', '0.0.0.0')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 8080))
+
+# How often the event loop is probed for lag (in seconds)
+LOOP_LAG_INTERVAL = 0.5
+
+# After how many seconds without a tick the event loop is considered blocked
+LOOP_BLOCKED_AFTER = float(os.getenv('LOOP_BLOCKED_AFTER', 10))
+
+# All registered metrics, by name
+REGISTRY = {}
+
+
+#########################
+# Metric types
+#########################
+
+class Metric():
+    """
+    Base class of all metrics.
+
+    Values are stored per label-combination, so one metric can e.g. count pages per host.
+    """
+    TYPE = 'untyped'
+    def __init__(self, name:str, documentation:str, labelnames:tuple[str]=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+    def _key(self, labels:dict) -> tuple:
+        return tuple(str(labels.get(label, '')) for label in self.labelnames)
+    def _labelString(self, key:tuple) -> str:
+        labels = dict(zip(self.labelnames, key))
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{name}="{value}"' for name, value in labels.items()) + '}'
+    def samples(self) -> list[tuple[str,str,float]]:
+        """Returns list of (name, labels, value) of this metric"""
+        with self._lock:
+            return [(self.name, self._labelString(key), value) for key, value in self._values.items()]
+    def render(self) -> str:
+        """Returns this metric in the Prometheus text format"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        lines += [f"{name}{labels} {_formatValue(value)}" for name, labels, value in self.samples()]
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    """Metric that only goes up, e.g. number of fetched pages."""
+    TYPE = 'counter'
+    def inc(self, amount:float=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """Metric that can go up and down, e.g. number of open database connections.
+
+    Instead of setting the value, a function can be given that is called whenever the metric is scraped.
+    """
+    TYPE = 'gauge'
+    def __init__(self, name:str, documentation:str, labelnames:tuple[str]=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+    def set(self, value:float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+    def inc(self, amount:float=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    def dec(self, amount:float=1, **labels):
+        self.inc(-amount, **labels)
+    def setFunction(self, function):
+        """Sets function that returns the current value of this gauge"""
+        self._function = function
+    def samples(self) -> list[tuple[str,str,float]]:
+        if self._function:
+            try:
+                self.set(self._function())
+            except Exception:
+                pass
+        return super().samples()
+
+class Summary(Metric):
+    """Metric that tracks count and sum of observations, e.g. durations of the notify-loop."""
+    TYPE = 'summary'
+    def observe(self, value:float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            count, total = self._values.get(key, (0, 0.0))
+            self._values[key] = (count + 1, total + value)
+    @contextmanager
+    def time(self, **labels):
+        """Context manager. Observes the duration of the enclosed block in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+    def timeit(self, func):
+        """Decorator. Observes the duration of every call of the decorated (async) function."""
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.time():
+                    return await func(*args, **kwargs)
+        else:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.time():
+                    return func(*args, **kwargs)
+        return wrapper
+    def samples(self) -> list[tuple[str,str,float]]:
+        with self._lock:
+            samples = []
+            for key, (count, total) in self._values.items():
+                samples.append((f"{self.name}_count", self._labelString(key), count))
+                samples.append((f"{self.name}_sum", self._labelString(key), total))
+            return samples
+
+def _formatValue(value:float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if value == float('-inf'):
+        return '-Inf'
+    return repr(float(value))
+
+def render() -> str:
+    """Returns all registered metrics in the Prometheus text format"""
+    return '\n'.join(metric.render() for metric in REGISTRY.values()) + '\n'
+
+
+#########################
+# Metrics of the bot
+#########################
+
+SCRAP_DURATION = Summary('matsubo_scrap_duration_seconds', 'Duration of scrapping the web for events.')
+PAGES_FETCHED = Counter('matsubo_pages_fetched_total', 'Number of web pages downloaded by the scrapper.', ['host'])
+PAGES_CACHED = Counter('matsubo_pages_cached_total', 'Number of web pages served from a cache instead of being downloaded.', ['host'])
+EVENTS_INGESTED = Counter('matsubo_events_ingested_total', 'Number of scrapped events written to the database.')
+EVENTS_CHANGED = Counter('matsubo_events_changed_total', 'Number of ingested events that were new or had changed.')
+EVENTS_MERGED = Counter('matsubo_events_merged_total', 'Number of scrapped or stored events merged into a duplicate listing of the same event.')
+NOTIFY_DURATION = Summary('matsubo_notify_duration_seconds', 'Duration of notifying channels of new events.')
+REMIND_DURATION = Summary('matsubo_remind_duration_seconds', 'Duration of reminding channels of current events.')
+DISCORD_LATENCY = Gauge('matsubo_discord_latency_seconds', 'Latency between a HEARTBEAT and a HEARTBEAT_ACK of the Discord websocket.')
+DISCORD_RATELIMITS = Counter('matsubo_discord_ratelimits_total', 'Number of HTTP 429 (rate limited) responses of the Discord API.')
+DB_CONNECTIONS = Gauge('matsubo_db_connections_in_use', 'Number of database connections currently in use.')
+LOOP_LAG = Gauge('matsubo_event_loop_lag_seconds', 'Most recently measured lag of the asyncio event loop.')
+LOOP_LAG_SUMMARY = Summary('matsubo_event_loop_lag_observed_seconds', 'All measured lags of the asyncio event loop.')
+STARTUP_DURATION = Gauge('matsubo_startup_seconds', 'Duration of the phases of the startup of the bot.', ['phase'])
+
+
+#########################
+# Event loop monitoring
+#########################
+
+# Monotonic time of the last tick of the event loop, and the probing interval. `None` until the monitor runs.
+_heartbeat = None
+_interval = LOOP_LAG_INTERVAL
+
+async def monitorEventLoop(interval:float=LOOP_LAG_INTERVAL):
+    """[Background task] Measures the lag of the running event loop.
+
+    Sleeps for `interval` seconds, and measures how much later than expected it woke up.
+    Every wake-up is also a heartbeat for the liveness check.
+    """
+    global _heartbeat, _interval
+    _interval = interval
+    while True:
+        start = time.monotonic()
+        _heartbeat = start
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.monotonic() - start - interval)
+        LOOP_LAG.set(lag)
+        LOOP_LAG_SUMMARY.observe(lag)
+
+def getLoopStall() -> float:
+    """Returns seconds since the last tick of the event loop (0 if the monitor has not started yet)"""
+    if _heartbeat is None:
+        return 0.0
+    return max(0.0, time.monotonic() - _heartbeat - _interval)
+
+def isAlive() -> bool:
+    """Returns `False` if the event loop is blocked"""
+    return getLoopStall() < LOOP_BLOCKED_AFTER
+
+
+#########################
+# HTTP endpoint
+#########################
+
+class _RateLimitHandler(logging.Handler):
+    """Logging handler that counts the rate limit warnings of discord.py"""
+    def emit(self, record):
+        if 'rate limited' in record.getMessage():
+            DISCORD_RATELIMITS.inc()
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Serves `/metrics` and `/health`"""
+    def do_GET(self):
+        if self.path.startswith('/metrics'):
+            self._respond(200, render(), 'text/plain; version=0.0.4; charset=utf-8')
+        elif self.path.startswith('/health'):
+            stall = getLoopStall()
+            if isAlive():
+                self._respond(200, "OK\n")
+            else:
+                self._respond(503, f"event loop blocked for {stall:.1f}s\n")
+        else:
+            self._respond(404, "Not found\n")
+    def _respond(self, status:int, body:str, content_type:str='text/plain; charset=utf-8'):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    def log_message(self, format, *args):
+        pass  # Do not spam the console with every scrape
+
+def startServer(host:str=METRICS_HOST, port:int=METRICS_PORT) -> ThreadingHTTPServer:
+    """Starts the metrics endpoint in a daemon thread. Returns `None` if it is disabled."""
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics (liveness check: /health)")
+    return server
+
+def start(bot):
+    """Starts the metrics endpoint and all monitors of the given bot. Call before `bot.run()`."""
+    DISCORD_LATENCY.setFunction(lambda: bot.latency)
+    logging.getLogger('discord.http').addHandler(_RateLimitHandler())
+    bot.loop.create_task(monitorEventLoop())
+    return startServer()
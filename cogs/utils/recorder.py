@@ -0,0 +1,217 @@
+"""Scrap recorder
+
+Records scrap runs, so failures of the parsers (e.g. after a website changed its markup) can be reproduced offline,
+and every run doubles as benchmark and regression corpus.
+
+Recording is opt-in: if `SCRAP_RECORD_DIR` is set, every scrap run of a source is written into a zip archive in that folder, with
+- the raw html of every listing page,
+- how long it took to download and to parse it,
+- the events that were parsed from it (or the error, if parsing failed).
+
+A recorded run can be replayed: its pages are fed through the current parser of the source, without any download or database,
+and the parsed events and timings are compared to the recorded ones:
+
+    python -m cogs.utils.event_scrapper replay archive.zip [archive.zip ...]
+"""
+
+import os
+import re
+import json
+import time
+import zipfile
+import datetime
+import contextlib
+
+from .event import Event
+from . import sources
+from . import utils
+
+
+#########################
+# Global variables
+#########################
+
+# Folder the scrap runs are recorded into. Runs are not recorded if it is not set.
+SCRAP_RECORD_DIR = os.getenv('SCRAP_RECORD_DIR', '')
+
+# How many recorded runs are kept per source. Older archives are deleted.
+SCRAP_RECORD_KEEP = int(os.getenv('SCRAP_RECORD_KEEP', 14))
+
+# Attributes of events that are recorded and compared
+FIELDS = ['id', 'name', 'description', 'url', 'img', 'date_start', 'date_end', 'date_fuzzy', 'time_start', 'time_end',
+          'location', 'cost', 'status', 'other', 'visibility', 'source']
+
+# Name of the file describing the run in an archive
+MANIFEST = 'manifest.json'
+
+
+#########################
+# Recording
+#########################
+
+def toRecord(event:Event) -> dict:
+    """Returns the attributes of an event as JSON-serializable dict. Dates and times are written as ISO strings."""
+    record = {}
+    for field in FIELDS:
+        value = getattr(event, field)
+        record[field] = value if value is None or isinstance(value, (str, list)) else str(value)
+    return record
+
+def getKey(record:dict) -> tuple[str,str]:
+    return record['id'], record['date_start'] or ''
+
+class Recorder():
+    """
+    Records the pages of one scrap run into a zip archive in `SCRAP_RECORD_DIR` (see `record()`).
+
+    Pages are written as soon as they are added, the manifest when the run is closed.
+    The archive is written under a temporary name and only appears once it is complete.
+    """
+    def __init__(self, source:sources.Source, run_id:str, directory:str=SCRAP_RECORD_DIR):
+        self.source = source
+        self.run_id = run_id
+        self.directory = directory
+        self.started = datetime.datetime.now(tz=datetime.timezone.utc)
+        self.prefix = re.sub(r'\W+', '_', source.name)
+        self.path = os.path.join(directory, f"{self.prefix}-{self.started:%Y%m%dT%H%M%S}.zip")
+        self.pages = []
+        os.makedirs(directory, exist_ok=True)
+        self.archive = zipfile.ZipFile(f"{self.path}.tmp", 'w', compression=zipfile.ZIP_DEFLATED)
+
+    def addPage(self, url:str, region:str, data:bytes, fetch_seconds:float, parse_seconds:float, events:list[Event]=(), error:Exception=None):
+        """Records a listing page with its timings, and the events parsed from it (or the error of its parser)"""
+        name = f"pages/{len(self.pages):04d}.html"
+        self.archive.writestr(name, data)
+        self.pages.append({
+            'url': url,
+            'region': region,
+            'file': name,
+            'fetch_seconds': round(fetch_seconds, 4),
+            'parse_seconds': round(parse_seconds, 4),
+            'events': [toRecord(event) for event in events],
+            'error': repr(error) if error else None,
+        })
+
+    def close(self, ok:bool=True):
+        """Writes the manifest, and moves the archive to its final name"""
+        manifest = {
+            'source': self.source.name,
+            'run_id': self.run_id,
+            'started': self.started.isoformat(timespec='seconds'),
+            'finished': datetime.datetime.now(tz=datetime.timezone.utc).isoformat(timespec='seconds'),
+            'ok': ok,
+            'pages': self.pages,
+        }
+        self.archive.writestr(MANIFEST, json.dumps(manifest, ensure_ascii=False, indent=1))
+        self.archive.close()
+        os.replace(f"{self.path}.tmp", self.path)
+        print(f"[{self.source}] Recorded {len(self.pages)} pages into {self.path}")
+        self.prune()
+
+    def prune(self):
+        """Deletes the oldest archives of the source, so only `SCRAP_RECORD_KEEP` are kept"""
+        archives = sorted(entry.path for entry in os.scandir(self.directory) if re.fullmatch(rf"{self.prefix}-\d{{8}}T\d{{6}}\.zip", entry.name))
+        for path in archives[:-SCRAP_RECORD_KEEP] if SCRAP_RECORD_KEEP > 0 else []:
+            try:
+                os.remove(path)
+            except OSError as e:
+                utils.print_warning(f"Could not remove recorded run {path}: {e!r}")
+
+@contextlib.contextmanager
+def record(source:sources.Source, run_id:str):
+    """
+    Context manager. Records a scrap run of the source, if `SCRAP_RECORD_DIR` is set.
+
+    with recorder.record(source, run_id) as rec:
+        if rec:
+            rec.addPage(...)
+
+    Yields the :class:`Recorder`, ``None`` if runs are not recorded or the archive can't be created.
+    If the run fails, what has been recorded so far is kept, and marked as not ok.
+    """
+    rec = None
+    if SCRAP_RECORD_DIR:
+        try:
+            rec = Recorder(source, run_id)
+        except OSError as e:  # Recording is optional: scrapping continues without it
+            utils.print_warning(f"[{source}] Could not record run: {e!r}")
+    ok = False
+    try:
+        yield rec
+        ok = True
+    finally:
+        if rec:
+            try:
+                rec.close(ok)
+            except OSError as e:
+                utils.print_warning(f"[{source}] Could not write recorded run: {e!r}")
+
+
+#########################
+# Replay
+#########################
+
+def replay(path:str) -> dict:
+    """Feeds the pages of a recorded run through the current parser of its source, and compares the results to the recording.
+
+    The source must be registered (i.e. `event_scrapper` imported). Nothing is downloaded, and the database is not used.
+    Returns the report: the events that were added, removed or changed per page, errors of the parser, and the timings of both runs.
+    """
+    from bs4 import BeautifulSoup as soup
+    with zipfile.ZipFile(path) as archive:
+        manifest = json.loads(archive.read(MANIFEST))
+        source = sources.SOURCES[manifest['source']]
+        report = {'path': path, 'source': source.name, 'run_id': manifest['run_id'], 'pages': [],
+                  'recorded_seconds': 0.0, 'replayed_seconds': 0.0, 'fetch_seconds': 0.0}
+        for page in manifest['pages']:
+            data = archive.read(page['file'])
+            events, error = [], None
+            start = time.perf_counter()
+            try:
+                events = source.parse(source, soup(data, "html.parser"), page['region'])
+            except Exception as e:
+                error = e
+            parse_seconds = time.perf_counter() - start
+            recorded = {getKey(record): record for record in page['events']}
+            replayed = {getKey(record): record for record in map(toRecord, events)}
+            changed = {}
+            for key in recorded.keys() & replayed.keys():
+                fields = [field for field in FIELDS if recorded[key].get(field) != replayed[key].get(field)]
+                if fields:
+                    changed[key] = {field: (recorded[key].get(field), replayed[key].get(field)) for field in fields}
+            report['pages'].append({
+                'url': page['url'],
+                'added': sorted(replayed.keys() - recorded.keys()),
+                'removed': sorted(recorded.keys() - replayed.keys()),
+                'changed': changed,
+                'recorded_error': page['error'],
+                'error': repr(error) if error else None,
+                'recorded_seconds': page['parse_seconds'],
+                'replayed_seconds': parse_seconds,
+            })
+            report['recorded_seconds'] += page['parse_seconds']
+            report['replayed_seconds'] += parse_seconds
+            report['fetch_seconds'] += page['fetch_seconds']
+    return report
+
+def isRegression(report:dict) -> bool:
+    """Returns `True` if the replay of a run parsed other events than the recording, or failed where the recording did not"""
+    return any(page['added'] or page['removed'] or page['changed'] or (page['error'] and not page['recorded_error']) for page in report['pages'])
+
+def printReport(report:dict):
+    """Prints the differences and timings of a replayed run"""
+    print(f"[{report['source']}] Replay of {report['run_id']} ({report['path']}):")
+    for page in report['pages']:
+        if page['error'] != page['recorded_error']:
+            print(f"  {page['url']}: error {page['recorded_error']} -> {page['error']}")
+        for key in page['added']:
+            print(f"  {page['url']}: + {key[0]} ({key[1]})")
+        for key in page['removed']:
+            print(f"  {page['url']}: - {key[0]} ({key[1]})")
+        for key, fields in page['changed'].items():
+            for field, (old, new) in fields.items():
+                print(f"  {page['url']}: ~ {key[0]} ({key[1]}) {field}: {old!r} -> {new!r}")
+    recorded, replayed = report['recorded_seconds'], report['replayed_seconds']
+    print(f"  {len(report['pages'])} pages parsed in {replayed:.2f}s (recorded: {recorded:.2f}s"
+          + (f", {replayed/recorded-1:+.0%}" if recorded else '') + f", downloads: {report['fetch_seconds']:.2f}s)")
+    print(f"  {'Events differ from the recording' if isRegression(report) else 'Events are the same as recorded'}")
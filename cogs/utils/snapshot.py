@@ -0,0 +1,296 @@
+"""Event snapshots
+
+Compact binary snapshot of all upcoming events, written after every scrap (see `event_scrapper.scrapEvents()`).
+
+The bot loads it at startup by mapping the file into memory, so posts and reminders find their events without querying the database row by row.
+Two snapshots can be diffed without touching the database, e.g. to find the events that a scrap added or changed.
+
+The file is columnar:
+- a header with the number of rows and strings, the first day of the snapshot, and the offsets of all sections,
+- a table of interned strings (offsets into one UTF-8 blob): names, locations, regions... are stored once, whatever the number of events,
+- one column per attribute: indices into the string table (uint32), dates as ordinals (int32, 0 if unset),
+  or timestamps as microseconds since the epoch (int64, 0 if unset),
+- a column of the content hashes of the events (16 bytes each).
+Rows are sorted by (id, date_start), so two snapshots are diffed in one pass.
+Columns are read straight from the mapped file; only the events that are asked for are turned into `Event` objects.
+"""
+
+import os
+import mmap
+import struct
+import hashlib
+import datetime
+import tempfile
+import threading
+import contextlib
+
+from .event import Event
+from . import database
+from . import utils
+
+
+#########################
+# Global variables
+#########################
+
+# Where the snapshot is written and loaded from. Snapshots are disabled if it is set to an empty string.
+# Processes that share a snapshot (bot and scrapper worker) must see the same file.
+SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', os.path.join(tempfile.gettempdir(), 'matsubo-events.snap'))
+
+# Snapshots older than this (in hours) are not used: the database is queried instead
+SNAPSHOT_MAX_AGE = datetime.timedelta(hours=float(os.getenv('SNAPSHOT_MAX_AGE', 25)))
+
+# How often (in seconds) the bot checks for a new snapshot, if the database can't notify it of changes (see `EventListener.loop_listen()`)
+SNAPSHOT_POLL = 60
+
+# File format
+MAGIC = b'MTSNAP\x00\x02'
+STRING_COLUMNS = ['id', 'name', 'description', 'url', 'img', 'date_fuzzy', 'time_start', 'time_end', 'location', 'cost', 'status', 'other',
+                  'visibility', 'source', 'details', 'address', 'schedule']
+DATE_COLUMNS = ['date_start', 'date_end']
+TIMESTAMP_COLUMNS = ['date_added']
+SECTIONS = ['string_offsets', 'strings'] + STRING_COLUMNS + DATE_COLUMNS + TIMESTAMP_COLUMNS + ['hash']
+HEADER = struct.Struct(f"<8sIIi{len(SECTIONS)}Q")  # magic, rows, strings, first day (ordinal), offsets of the sections
+HASH_SIZE = 16
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+# Regions of an event are interned as one string
+VISIBILITY_SEPARATOR = '\x1f'
+
+# The latest loaded snapshot (see `getSnapshot()`)
+_current = None
+_current_lock = threading.Lock()
+
+# Scraps of several sources may finish at the same time: snapshots are updated by only one thread at a time (see `update()`)
+_update_lock = threading.Lock()
+
+
+#########################
+# Functions
+#########################
+
+def _toString(value) -> str:
+    """Returns the string stored for a value. Times are stored as ISO strings (with their timezone), lists of regions joined."""
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        return VISIBILITY_SEPARATOR.join(value)
+    if isinstance(value, datetime.time):
+        return value.isoformat()
+    return str(value)
+
+def _toOrdinal(date) -> int:
+    return date.toordinal() if date else 0
+
+def _toMicroseconds(timestamp:datetime.datetime) -> int:
+    return (timestamp - EPOCH) // datetime.timedelta(microseconds=1) if timestamp else 0
+
+def getHash(event:Event) -> bytes:
+    """Returns hash of all stored attributes of the event, including its details and visibility. `date_added` is left out: it is not content."""
+    content = [_toString(getattr(event, column)) for column in STRING_COLUMNS] + [str(_toOrdinal(getattr(event, column))) for column in DATE_COLUMNS]
+    return hashlib.md5('\x1f'.join(content).encode('utf-8')).digest()
+
+def write(path:str, events, from_date:datetime.date) -> int:
+    """Writes the events into a snapshot file. `from_date` is the first day the snapshot covers (no event starts before). Returns number of events.
+
+    The file is replaced atomically, so snapshots that are mapped by other processes stay intact.
+    Every call writes into a temporary file of its own, so concurrent writers never replace each other's half-written files.
+    """
+    strings = {'': 0}
+    rows = []
+    for event in events:
+        row = [strings.setdefault(_toString(getattr(event, column)), len(strings)) for column in STRING_COLUMNS]
+        rows.append((event.id, _toOrdinal(event.date_start), row, _toOrdinal(event.date_end), getHash(event), _toMicroseconds(event.date_added)))
+    rows.sort(key=lambda row: (row[0], row[1]))
+    # Sections
+    blobs = [string.encode('utf-8') for string in strings]
+    offsets = [0]
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    sections = [struct.pack(f"<{len(offsets)}I", *offsets), b''.join(blobs)]
+    for i in range(len(STRING_COLUMNS)):
+        sections.append(struct.pack(f"<{len(rows)}I", *[row[2][i] for row in rows]))
+    sections.append(struct.pack(f"<{len(rows)}i", *[row[1] for row in rows]))
+    sections.append(struct.pack(f"<{len(rows)}i", *[row[3] for row in rows]))
+    sections.append(struct.pack(f"<{len(rows)}q", *[row[5] for row in rows]))
+    sections.append(b''.join(row[4] for row in rows))
+    # Sections are aligned to 8 bytes, so the columns can be cast in place
+    positions = []
+    position = HEADER.size
+    for section in sections:
+        positions.append(position)
+        position += len(section) + (-len(section) % 8)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=f"{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(rows), len(blobs), _toOrdinal(from_date), *positions))
+            for section in sections:
+                f.write(section + b'\x00' * (-len(section) % 8))
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+    return len(rows)
+
+class Snapshot():
+    """
+    A snapshot file, mapped into memory (see `write()`).
+
+    Parameters
+    ------------
+    path: :class:`str`
+        Path to the snapshot file.
+
+    Raises :class:`ValueError` if the file is not a snapshot.
+    """
+    def __init__(self, path:str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mtime = os.fstat(f.fileno()).st_mtime
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            raise ValueError(f"{path} is not an event snapshot")
+        magic, self.rows, count, from_date, *positions = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an event snapshot")
+        self.from_date = datetime.date.fromordinal(from_date) if from_date else None
+        view = memoryview(self._map)
+        sections = dict(zip(SECTIONS, positions))
+        self._offsets = view[sections['string_offsets']:sections['string_offsets'] + 4*(count+1)].cast('I')
+        self._strings = view[sections['strings']:sections['strings'] + self._offsets[count]]
+        self.columns = {column: view[sections[column]:sections[column] + 4*self.rows].cast('I') for column in STRING_COLUMNS}
+        self.columns.update({column: view[sections[column]:sections[column] + 4*self.rows].cast('i') for column in DATE_COLUMNS})
+        self.columns.update({column: view[sections[column]:sections[column] + 8*self.rows].cast('q') for column in TIMESTAMP_COLUMNS})
+        self.hashes = view[sections['hash']:sections['hash'] + HASH_SIZE*self.rows]
+        self._cache = {}  # Decoded strings, by index
+
+    def __len__(self):
+        return self.rows
+
+    def __iter__(self):
+        return (self.getEvent(row) for row in range(self.rows))
+
+    def getAge(self) -> datetime.timedelta:
+        return datetime.datetime.now() - datetime.datetime.fromtimestamp(self.mtime)
+
+    def getString(self, index:int) -> str:
+        """Returns string of the string table"""
+        string = self._cache.get(index)
+        if string is None:
+            string = self._cache[index] = bytes(self._strings[self._offsets[index]:self._offsets[index+1]]).decode('utf-8')
+        return string
+
+    def getKey(self, row:int) -> tuple[str,int]:
+        """Returns (id, ordinal of date_start) of a row"""
+        return self.getString(self.columns['id'][row]), self.columns['date_start'][row]
+
+    def getEvent(self, row:int) -> Event:
+        """Returns the event of a row"""
+        values = {column: self.getString(self.columns[column][row]) for column in STRING_COLUMNS}
+        for column in DATE_COLUMNS:
+            values[column] = datetime.date.fromordinal(self.columns[column][row]) if self.columns[column][row] else None
+        for column in TIMESTAMP_COLUMNS:
+            values[column] = EPOCH + datetime.timedelta(microseconds=self.columns[column][row]) if self.columns[column][row] else None
+        for column in ['time_start', 'time_end']:
+            values[column] = datetime.time.fromisoformat(values[column]) if values[column] else ''
+        values['visibility'] = values['visibility'].split(VISIBILITY_SEPARATOR) if values['visibility'] else []
+        return Event(**values)
+
+    def covers(self, from_date:datetime.date=None) -> bool:
+        """Returns `True` if the snapshot holds all events that start on or after `from_date`, and is not older than `SNAPSHOT_MAX_AGE`"""
+        return bool(from_date and self.from_date and from_date >= self.from_date) and self.getAge() <= SNAPSHOT_MAX_AGE
+
+    def getEvents(self, visibility:list[str]=None, from_date:datetime.date=None, until_date:datetime.date=None) -> list[Event]:
+        """Return events of given visibility, in the given date duration, ordered by (date_start, id). Same filters as `database.DBEvent.getEvents()`.
+
+        Filters are evaluated on the columns. Visibilities are matched once per distinct set of regions, not once per event.
+        """
+        date_start, date_end, regions = self.columns['date_start'], self.columns['date_end'], self.columns['visibility']
+        first = _toOrdinal(from_date) if from_date else None
+        last = _toOrdinal(until_date) if until_date else None
+        visible = {}  # Whether a set of regions (by index) overlaps the visibility
+        topics = set(visibility or [])
+        rows = []
+        for row in range(self.rows):
+            if first is not None and date_start[row] < first:
+                continue
+            if last is not None and (date_start[row] > last or not date_end[row] or date_end[row] > last):  # Like the database, events without end are left out
+                continue
+            if topics:
+                index = regions[row]
+                if index not in visible:
+                    visible[index] = bool(topics.intersection(self.getString(index).split(VISIBILITY_SEPARATOR)))
+                if not visible[index]:
+                    continue
+            rows.append(row)
+        rows.sort(key=lambda row: (date_start[row], self.getString(self.columns['id'][row])))
+        return [self.getEvent(row) for row in rows]
+
+def diff(old:Snapshot, new:Snapshot) -> tuple[list[tuple[str,int]],list[tuple[str,int]],list[tuple[str,int]]]:
+    """Returns the keys (id, ordinal of date_start) of the events that have been added, removed, and changed from the old to the new snapshot.
+
+    If the hash columns of both snapshots are equal, nothing has changed and no row is looked at.
+    Otherwise, both snapshots are walked in one pass along their sorted keys, and only the hashes of rows with the same key are compared.
+    """
+    added, removed, changed = [], [], []
+    if old.rows == new.rows and old.hashes == new.hashes:
+        return added, removed, changed
+    i = j = 0
+    while i < old.rows or j < new.rows:
+        key_old = old.getKey(i) if i < old.rows else None
+        key_new = new.getKey(j) if j < new.rows else None
+        if key_new is None or (key_old is not None and key_old < key_new):
+            removed.append(key_old)
+            i += 1
+        elif key_old is None or key_new < key_old:
+            added.append(key_new)
+            j += 1
+        else:
+            if old.hashes[HASH_SIZE*i:HASH_SIZE*(i+1)] != new.hashes[HASH_SIZE*j:HASH_SIZE*(j+1)]:
+                changed.append(key_new)
+            i += 1
+            j += 1
+    return added, removed, changed
+
+def load(path:str=SNAPSHOT_PATH) -> Snapshot:
+    """Returns the snapshot of the file, ``None`` if there is none or it can't be read"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        return Snapshot(path)
+    except (OSError, ValueError) as e:
+        utils.print_warning(f"Could not load event snapshot {path}: {e!r}")
+        return None
+
+def getSnapshot() -> Snapshot:
+    """Returns the latest snapshot at `SNAPSHOT_PATH`, ``None`` if there is none. It is loaded again whenever the file has been replaced."""
+    global _current
+    with _current_lock:
+        try:
+            mtime = os.stat(SNAPSHOT_PATH).st_mtime if SNAPSHOT_PATH else None
+        except OSError:
+            mtime = None
+        if mtime is None:
+            _current = None
+        elif _current is None or _current.mtime != mtime:
+            _current = load(SNAPSHOT_PATH)
+        return _current
+
+def update(from_date:datetime.date) -> tuple[list[tuple[str,int]],list[tuple[str,int]],list[tuple[str,int]]]:
+    """Writes the snapshot of all events of the database starting on or after `from_date` to `SNAPSHOT_PATH`. Returns its diff to the previous snapshot.
+
+    Events are streamed from the database (see `database.DBEvent.iterEvents()`). If there was no previous snapshot, all events are added.
+    Concurrent updates are serialized, so each diff is taken against the snapshot the update before has written.
+    """
+    with _update_lock:
+        previous = load(SNAPSHOT_PATH)
+        os.makedirs(os.path.dirname(os.path.abspath(SNAPSHOT_PATH)), exist_ok=True)
+        count = write(SNAPSHOT_PATH, database.eventDB.iterEvents(from_date=from_date), from_date)
+        current = Snapshot(SNAPSHOT_PATH)
+    if previous is None:
+        changes = [current.getKey(row) for row in range(current.rows)], [], []
+    else:
+        changes = diff(previous, current)
+    print(f"[INFO] wrote event snapshot with {count} events: {len(changes[0])} added, {len(changes[1])} removed, {len(changes[2])} changed")
+    return changes
@@ -0,0 +1,88 @@
+"""Event sources
+
+Registry of all sources that are scrapped for events.
+
+Every source declares its URLs per region, the function that parses a page into events,
+how often it is refreshed, and how its events are branded in discord embeds.
+To add a new website, define a `Source` and `register()` it; the scheduler picks it up automatically:
+
+    register(Source(
+        name='Web:MySite',
+        urls={'Kanto': ['https://mysite.com/events/']},
+        parse=parseMySite,  # parse(source, page, region) -> list[Event]
+        refresh='0 15 * * *',  # Every day at 15:00
+    ))
+"""
+
+
+class Source():
+    """
+    Class that defines a source of events.
+
+    Parameters
+    ------------
+    name: :class:`str`
+        Unique name of the source. Is saved as `Event.source`.
+    urls: :class:`dict`[:class:`str`, :class:`list`[:class:`str`]]
+        The pages to scrap, by region. The region is used as visibility of the events found on the page.
+    parse: :class:`callable`
+        Function `parse(source, page, region) -> list[Event]` that returns all events of a page.
+    refresh: :class:`str`
+        Times when this source is scrapped, in UNIX CRON format.
+    prefix: :class:`str`
+        Prefix of the IDs of events of this source, so IDs of different sources never collide.
+    page_url: :class:`str`
+        Template of the URL of further listing pages, e.g. '{url}/page/{page}/'. ``None`` if the source has only one page per URL.
+    max_pages: :class:`int`
+        How many listing pages per URL are crawled at most.
+    enrich: Optional[:class:`callable`]
+        Function `enrich(source, event, page)` that adds the details of the detail page of an event (`event.url`) to the event.
+        ``None`` if the source has no detail pages.
+    footer, icon, thumbnail: :class:`str`
+        Branding of the events of this source in discord embeds.
+    """
+    def __init__(self, name:str, urls:dict[str,list[str]], parse, refresh:str, prefix:str='', page_url:str=None, max_pages:int=1, enrich=None,
+                 footer:str='', icon:str='', thumbnail:str=''):
+        self.name = name
+        self.urls = urls
+        self.parse = parse
+        self.refresh = refresh
+        self.prefix = prefix
+        self.page_url = page_url
+        self.max_pages = max_pages if page_url else 1
+        self.enrich = enrich
+        self.footer = footer
+        self.icon = icon
+        self.thumbnail = thumbnail
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def regions(self) -> list[str]:
+        return list(self.urls.keys())
+
+    def getPageURL(self, url:str, page:int) -> str:
+        """Returns URL of the given listing page (starting at 1) of an URL"""
+        if page == 1:
+            return url
+        return self.page_url.format(url=url.rstrip('/'), page=page)
+
+
+# All registered sources, by name
+SOURCES:dict[str,Source] = {}
+
+def register(source:Source) -> Source:
+    """Registers a source, so it is scrapped and scheduled"""
+    SOURCES[source.name] = source
+    return source
+
+def getSources(names:list[str]=None) -> list[Source]:
+    """Returns the registered sources of the given names (default: all sources)"""
+    if names is None:
+        return list(SOURCES.values())
+    return [SOURCES[name] for name in names]
+
+def getRegions() -> list[str]:
+    """Returns all regions of all sources, i.e. all topics that can be subscribed"""
+    return sorted(set(region for source in SOURCES.values() for region in source.regions))
@@ -0,0 +1,41 @@
+"""State registry
+
+Holds objects that must survive the reload of a cog (`.reload`), e.g. the scheduler, caches or pools.
+
+On reload, the module of a cog is imported again and the cog is created anew, but the modules in `cogs/utils/` stay loaded.
+Anything a cog keeps in this registry is therefore handed over to its new instance instead of being created a second time:
+
+    cache = state.get('event_listener.cache', dict)  # Same dict before and after a reload
+
+Cogs clean up what only belongs to their instance (jobs, tasks) in `cog_unload()`.
+"""
+
+import threading
+
+
+# All registered objects, by key
+_registry = {}
+_lock = threading.Lock()
+
+def get(key:str, factory=None):
+    """Returns the object registered under `key`. If there is none, it is created by calling `factory()` and registered."""
+    with _lock:
+        if key not in _registry:
+            if factory is None:
+                raise KeyError(f"Nothing registered under '{key}'")
+            _registry[key] = factory()
+        return _registry[key]
+
+def pop(key:str, default=None):
+    """Removes the object registered under `key` from the registry and returns it"""
+    with _lock:
+        return _registry.pop(key, default)
+
+def getScheduler():
+    """Returns the scheduler shared by all cogs. It is started on first use, and keeps running when cogs are reloaded."""
+    def create():
+        from apscheduler.schedulers.asyncio import AsyncIOScheduler
+        scheduler = AsyncIOScheduler()
+        scheduler.start()
+        return scheduler
+    return get('scheduler', create)
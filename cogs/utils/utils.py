@@ -48,7 +48,28 @@ def custom_strftime(format:str, t:datetime.datetime) -> str:
         The date from where to fetch the information.
     """
     return t.strftime(format).replace('{S}', str(t.day) + day_suffix(t.day)).replace('{DAY}', day_kanji(calendar.day_name[t.weekday()]))
+def shorten(text:str, length:int) -> str:
+    """Returns the text cut after at most `length` characters, at the end of a word, with ' ...' appended. Shorter texts are returned as they are.
 
+    Parameters
+    ----------
+    text: :class:`str`
+        The text to shorten.
+    length: :class:`int`
+        Maximum length of the returned text, including the ' ...'.
+    """
+    if len(text) <= length:
+        return text
+    return text[:length-4].rsplit(' ', 1)[0] + ' ...'
+
+
+def isPrimaryShard(bot) -> bool:
+    """Returns `True` if this bot process runs shard 0, or is not sharded at all.
+
+    Work that must only happen once across all bot processes (e.g. scrapping the web) is done by this process.
+    """
+    shard_ids = getattr(bot, 'shard_ids', None)
+    return not shard_ids or 0 in shard_ids
 
 def getJSTtime():
     """Returns current time in JST"""
@@ -0,0 +1,148 @@
+"""Watchdog
+
+Detects blocking calls in the asyncio event loop.
+
+A background thread watches the heartbeat of the event loop (see `metrics.monitorEventLoop()`).
+While the loop has not ticked for longer than `BLOCKING_THRESHOLD` seconds, the stack of the event loop thread is sampled.
+Every sample is attributed to its call site, for example a synchronous `psycopg2` or `urlopen` call made from `EventListener`.
+Call sites are ranked by the total time they blocked the loop, so blocking paths can be removed based on data.
+"""
+
+import os
+import sys
+import time
+import threading
+import traceback
+
+from . import metrics
+from . import utils
+
+
+#########################
+# Global variables
+#########################
+
+# Stalls of the event loop longer than this (in seconds) are treated as blocking calls
+BLOCKING_THRESHOLD = float(os.getenv('BLOCKING_THRESHOLD', 0.25))
+
+# How often the watchdog checks the event loop (in seconds)
+WATCHDOG_INTERVAL = 0.05
+
+# How often the top offenders are printed to the console (in seconds). Set to 0 to disable.
+WATCHDOG_REPORT_INTERVAL = float(os.getenv('WATCHDOG_REPORT_INTERVAL', 6*60*60))
+
+# Frames inside this folder belong to the bot itself
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+LOOP_BLOCKED = metrics.Counter('matsubo_event_loop_blocked_seconds_total', 'Time the event loop was blocked, by call site.', ['site'])
+
+
+#########################
+# Classes & Functions
+#########################
+
+class Offender():
+    """
+    A call site that blocked the event loop.
+    """
+    def __init__(self, site:str, stack:str):
+        self.site = site  # Short description, e.g. 'cogs/event_listener.py:164 scrap -> request.py:214 urlopen'
+        self.stack = stack  # Full stack of the most recent sample
+        self.blocked = 0.0  # Total time this site blocked the event loop (in seconds)
+        self.longest = 0.0  # Longest stall this site was part of (in seconds)
+        self.stalls = 0  # Number of stalls this site was part of
+        self.last_seen = None
+    def __str__(self):
+        return f"{self.blocked:7.2f}s total | {self.longest:6.2f}s max | {self.stalls:4d}x | {self.site}"
+
+class LoopWatchdog(threading.Thread):
+    """
+    Thread that samples the stack of the event loop thread while the loop is blocked.
+
+    Parameters
+    ------------
+    thread_id: :class:`int`
+        Identifier of the thread that runs the event loop.
+    threshold: :class:`float`
+        Stalls longer than this (in seconds) are treated as blocking calls.
+    """
+    def __init__(self, thread_id:int, threshold:float=BLOCKING_THRESHOLD):
+        super().__init__(name='loop-watchdog', daemon=True)
+        self.thread_id = thread_id
+        self.threshold = threshold
+        self.offenders = {}
+        self._lock = threading.Lock()
+
+    def run(self):
+        last_report = time.monotonic()
+        stall_sites = set()  # Sites seen during the current stall
+        while True:
+            time.sleep(WATCHDOG_INTERVAL)
+            stall = metrics.getLoopStall()
+            if stall > self.threshold:
+                frame = sys._current_frames().get(self.thread_id)
+                if frame is not None:
+                    stall_sites.add(self.record(frame, stall, WATCHDOG_INTERVAL))
+            elif stall_sites:
+                with self._lock:
+                    for site in stall_sites:
+                        self.offenders[site].stalls += 1
+                stall_sites = set()
+            if WATCHDOG_REPORT_INTERVAL and time.monotonic() - last_report > WATCHDOG_REPORT_INTERVAL:
+                last_report = time.monotonic()
+                if self.offenders:
+                    print(self.report())
+
+    def record(self, frame, stall:float, duration:float) -> str:
+        """Attributes `duration` seconds of blocked time to the call site of the given frame. Returns the call site."""
+        site = self._site(frame)
+        with self._lock:
+            offender = self.offenders.get(site)
+            if offender is None:
+                offender = self.offenders[site] = Offender(site, '')
+            offender.stack = ''.join(traceback.format_stack(frame))
+            offender.blocked += duration
+            offender.longest = max(offender.longest, stall)
+            offender.last_seen = utils.getJSTtime()
+        LOOP_BLOCKED.inc(duration, site=site)
+        return site
+
+    def _site(self, frame) -> str:
+        """Returns the call site of a frame: the innermost frame of the bot itself, and the innermost frame overall"""
+        stack = traceback.extract_stack(frame)
+        top = stack[-1]
+        own = next((f for f in reversed(stack) if f.filename.startswith(PROJECT_ROOT) and f.filename != __file__), None)
+        site = f"{os.path.basename(top.filename)}:{top.lineno} {top.name}"
+        if own is not None and own is not top:
+            site = f"{os.path.relpath(own.filename, PROJECT_ROOT)}:{own.lineno} {own.name} -> {site}"
+        return site
+
+    def getTopOffenders(self, n:int=10) -> list[Offender]:
+        """Returns the `n` call sites that blocked the event loop the longest"""
+        with self._lock:
+            return sorted(self.offenders.values(), key=lambda offender: offender.blocked, reverse=True)[:n]
+
+    def report(self, n:int=10, stacks:bool=False) -> str:
+        """Returns a printable report of the top offenders"""
+        offenders = self.getTopOffenders(n)
+        if not offenders:
+            return "The event loop has not been blocked yet :sparkles:"
+        string = f"Top {len(offenders)} blocking calls (threshold: {self.threshold}s):"
+        for offender in offenders:
+            string += f"\n  {offender}"
+            if stacks:
+                string += f"\n{offender.stack}"
+        return string
+
+
+# The watchdog of this process. `None` until `start()` is called.
+watchdog:LoopWatchdog = None
+
+def start(thread_id:int=None) -> LoopWatchdog:
+    """Starts the watchdog for the event loop running in the given thread (default: current thread)"""
+    global watchdog
+    if watchdog is None:
+        watchdog = LoopWatchdog(thread_id if thread_id is not None else threading.get_ident())
+        watchdog.start()
+        print(f"Watching event loop for blocking calls longer than {watchdog.threshold}s")
+    return watchdog